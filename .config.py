@@ -28,3 +28,97 @@ MAX_VOLATILITY = 30
 
 # Автообновление списка пар (раз в сутки)
 AUTO_UPDATE_PAIRS = True
+
+# Шардирование пар по процессам-воркерам (0 - всё в одном процессе)
+SHARD_WORKERS = 0
+# Удалённые воркеры (python sharding.py --host ... --port ...): ["host:port"]
+SHARD_REMOTE_WORKERS = []
+# Секретный ключ удалённых воркеров (обязателен: с пустым или "change-me" они не подключаются)
+SHARD_AUTHKEY = "change-me"
+
+# Исполнение ордеров
+EXECUTION_IMPACT_BUDGET = 0.002  # Допустимое проскальзывание от mid (0.2%)
+EXECUTION_MAX_SLICES = 5  # Максимум частей при нарезке ордера
+EXECUTION_SLICE_DELAY = 1  # Пауза между частями (в секундах)
+EXECUTION_FILL_TIMEOUT = 5  # Ожидание подтверждения исполнения рыночного ордера (в секундах)
+EXECUTION_POST_ONLY_TIMEOUT = 30  # Сколько post-only ордер стоит в книге до отмены остатка
+EXECUTION_FILL_POLL = 0.5  # Период опроса состояния ордера (в секундах)
+ORDERBOOK_DEPTH = 50  # Глубина локального стакана
+ORDERBOOK_USE_WEBSOCKET = True  # Поддерживать стакан через WebSocket
+
+# Риск-менеджмент портфеля
+RISK_MAX_TOTAL_EXPOSURE_USDT = 500  # Максимальная суммарная позиция
+RISK_MAX_PAIR_EXPOSURE_USDT = 100  # Максимальная позиция на одну пару
+RISK_MAX_CORRELATED_EXPOSURE_USDT = 200  # Лимит на группу коррелированных пар
+RISK_MAX_CORRELATION = 0.8  # Порог корреляции доходностей
+RISK_MAX_DAILY_LOSS_USDT = 50  # Дневной лимит убытка
+RISK_CORRELATION_WINDOW = 200  # Окно доходностей для корреляции (свечей)
+RISK_MAX_REENTRIES = 3  # Максимум доливок в одну позицию
+
+# Сверка состояния с биржей
+RECONCILE_USE_WEBSOCKET = True  # Приватные потоки order/execution/wallet
+RECONCILE_INTERVAL = 60  # Период сверки позиций с балансом (в секундах)
+RECONCILE_POLL_INTERVAL = 10  # Период опроса исполнений без WebSocket
+RECONCILE_TOLERANCE = 0.01  # Допустимое расхождение количества (1%)
+
+# Общий буфер свечей в shared memory (свечей на пару/интервал)
+CANDLE_STORE_CAPACITY = 1000
+
+# Планировщик: оценка сигналов по закрытию свечи, частота мониторинга по ATR
+SCHEDULER_CLOSE_DELAY = 2  # Задержка после закрытия свечи (в секундах)
+SCHEDULER_RETRY_DELAY = 30  # Повтор оценки пар, по которым сигнал не посчитался (в секундах)
+MONITOR_MIN_INTERVAL = 1  # Опрос позиции у уровня TS/TP (в секундах)
+MONITOR_MAX_INTERVAL = 30  # Опрос позиции далеко от уровней (в секундах)
+MONITOR_FAR_ATR = 3  # Расстояние до уровня (в ATR), начиная с которого опрос редкий
+
+# Выбор торговых пар
+UNIVERSE_SIZE = 15  # Количество торгуемых пар
+UNIVERSE_SNAPSHOT_TTL = 300  # Время жизни снимка тикеров (в секундах)
+UNIVERSE_MAX_SPREAD = 0.005  # Максимальный спред bid/ask (0.5%)
+# Веса составного рейтинга пар (перцентили оборота, волатильности и узости спреда)
+UNIVERSE_WEIGHTS = {"turnover": 0.5, "volatility": 0.3, "spread": 0.2}
+
+# Запись сессии для воспроизведения (python replay.py capture.jsonl.gz)
+CAPTURE_FILE = None  # Например "capture.jsonl.gz"; None - запись выключена
+
+# Диагностика event loop и профилирование (/profile, /diag)
+LOOP_LAG_INTERVAL = 0.1  # Период замера лага (в секундах)
+LOOP_BLOCK_THRESHOLD = 0.25  # Блокировка loop дольше этого пишет стек в лог
+PROFILE_SAMPLE_INTERVAL = 0.005  # Период сэмплирования профайлера
+PROFILE_DEFAULT_SECONDS = 30  # Длительность /profile по умолчанию
+PROFILE_MAX_SECONDS = 300  # Максимальная длительность /profile
+PROFILES_DIR = "profiles"  # Каталог для flame graph
+
+# Устойчивость запросов к бирже
+REQUEST_TIMEOUT = 10  # Таймаут HTTP-запроса (в секундах)
+REQUEST_MAX_RETRIES = 3  # Повторы при сетевых и серверных сбоях
+REQUEST_BACKOFF_BASE = 0.5  # Базовая пауза экспоненциального отката (в секундах)
+REQUEST_BACKOFF_MAX = 8  # Максимальная пауза между повторами (в секундах)
+BREAKER_FAILURE_THRESHOLD = 5  # Сбоев подряд до размыкания эндпоинта
+BREAKER_RESET_TIMEOUT = 30  # Через сколько секунд пробовать снова
+HEDGE_DELAY = 0.3  # Дублировать запрос цены, если ответа нет дольше (None — выключить)
+
+# Бэктест и walk-forward (python backtest.py download ..., python walk_forward.py ...)
+HISTORY_DIR = "history"  # Локальный архив свечей (.npz)
+BACKTEST_FEE = 0.001  # Комиссия за сторону сделки (0.1%)
+WALK_FORWARD_TRAIN_DAYS = 90  # Окно подбора параметров (в днях)
+WALK_FORWARD_TEST_DAYS = 30  # Окно проверки вне выборки (в днях)
+WALK_FORWARD_MIN_TRADES = 5  # Минимум сделок в окне подбора для выбора параметров
+WALK_FORWARD_WORKERS = None  # Процессов в пуле (None - по числу ядер)
+# Сетка параметров: пороги generate_trade_signal и сопровождения позиции
+WALK_FORWARD_GRID = {
+    "rsi_buy": [25, 30, 35],
+    "rsi_sell": [65, 70, 75],
+    "trailing_stop": [0.01, 0.02, 0.03],
+    "take_profit": [0.02, 0.03, 0.05],
+}
+MONTE_CARLO_RUNS = 5000  # Прогонов Монте-Карло и бутстрапа
+BOOTSTRAP_BLOCK_DAYS = 5  # Длина блока бутстрапа дневных доходностей
+CONFIDENCE_LEVEL = 0.9  # Уровень доверительных интервалов
+
+# Локальный HTTP API (GET /status, /positions, /signals, /indicators, /metrics, /events; POST /start, /stop, /kill)
+API_ENABLED = True  # Запускать API вместе с Telegram-ботом
+API_HOST = "127.0.0.1"  # Адрес (только локально; наружу — через reverse proxy)
+API_PORT = 8080  # Порт API
+API_TOKEN = None  # Обязателен: заголовок "Authorization: Bearer <токен>"; без него API не запускается
+API_IDLE_TIMEOUT = 30  # Закрывать простаивающее соединение через (секунд)
@@ -0,0 +1,317 @@
+import asyncio
+import hmac
+import json
+import logging
+import math
+import time
+from urllib.parse import urlsplit, parse_qs
+import autotrade
+import diagnostics
+from events import event_bus
+from config import API_HOST, API_PORT, API_TOKEN, API_IDLE_TIMEOUT
+
+# Локальный HTTP/JSON API: читает состояние бота из памяти, без запросов к бирже,
+# поэтому его можно опрашивать часто, не расходуя лимиты Bybit.
+# Все маршруты требуют API_TOKEN; запросы с нелокальным Host/Origin (DNS rebinding,
+# запросы со сторонних страниц в браузере) отклоняются.
+
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+MAX_BODY = 64 * 1024
+LOCAL_HOSTS = {"127.0.0.1", "localhost", "::1", API_HOST}
+SSE_PING_INTERVAL = 15
+
+started_at = time.time()
+server = None
+
+
+def clean(value):
+    """Готовит данные к JSON: NaN/inf → null, кортежи и numpy-скаляры → обычные типы."""
+    if isinstance(value, dict):
+        return {str(k): clean(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [clean(v) for v in value]
+    if hasattr(value, "item") and not isinstance(value, (str, bytes)):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# --- Обработчики: (request) -> данные ответа ---
+def get_status(request):
+    return {
+        "auto_trade_active": autotrade.auto_trade_active,
+        "halted": autotrade.risk_engine.halted,
+        "pairs": autotrade.pair_manager.get_active_pairs(),
+        "positions": len(autotrade.active_orders),
+        "open_orders": len(autotrade.reconciler.open_orders()),
+        "uptime": time.time() - started_at,
+    }
+
+
+def get_positions(request):
+    ledger = autotrade.pnl_ledger
+    positions = {}
+    for pair, info in autotrade.active_orders.items():
+        if not info:
+            continue
+        position = {
+            key: info.get(key)
+            for key in ("order_id", "side", "entry_price", "order_size", "qty", "reentries")
+        }
+        position["pnl"] = ledger.position(pair)
+        positions[pair] = position
+    return {"positions": positions, "totals": ledger.totals()}
+
+
+def get_signals(request):
+    pair = request["query"].get("pair")
+    signals = autotrade.last_signals
+    if pair:
+        if pair not in signals:
+            raise HttpError(404, f"нет сигнала для {pair}")
+        return {pair: signals[pair]}
+    return signals
+
+
+def get_indicators(request):
+    """
+    Последние значения индикаторов без пересчёта: строки, которые trade_logic
+    получил от скана (в том числе от воркеров шардов) и от обновления пар
+    с открытой позицией. До первого скана пары индикаторы недоступны.
+    """
+    pair = request["query"].get("pair")
+    rows = autotrade.indicator_calc.last_rows
+    if pair:
+        if pair not in rows:
+            raise HttpError(404, f"индикаторы для {pair} недоступны: пара ещё не сканировалась")
+        return {pair: rows[pair]}
+    return rows
+
+
+def get_metrics(request):
+    lag = diagnostics.lag_monitor
+    return {
+        "loop_lag": {"last": lag.last_lag, "avg": lag.avg_lag, "max": lag.max_lag, "blocks": lag.blocks},
+        "task_cpu": dict(diagnostics.task_stats.top()),
+        "requests": autotrade.bybit_client.requests.snapshot(),
+        "risk": autotrade.risk_engine.snapshot(),
+        "pnl": autotrade.pnl_ledger.totals(),
+        "event_subscribers": len(event_bus.subscribers),
+    }
+
+
+async def post_start(request):
+    result = await autotrade.start_auto_trade()
+    return {"message": result, "auto_trade_active": autotrade.auto_trade_active}
+
+
+async def post_stop(request):
+    if not autotrade.auto_trade_active:
+        return {"message": "⚠️ Автоторговля уже остановлена!", "auto_trade_active": False}
+    return {"message": await autotrade.stop_auto_trade(), "auto_trade_active": autotrade.auto_trade_active}
+
+
+async def post_kill(request):
+    return {"message": await autotrade.kill_switch(), "auto_trade_active": autotrade.auto_trade_active}
+
+
+ROUTES = {
+    ("GET", "/status"): get_status,
+    ("GET", "/positions"): get_positions,
+    ("GET", "/signals"): get_signals,
+    ("GET", "/indicators"): get_indicators,
+    ("GET", "/metrics"): get_metrics,
+    ("POST", "/start"): post_start,
+    ("POST", "/stop"): post_stop,
+    ("POST", "/kill"): post_kill,
+}
+
+
+# --- HTTP ---
+async def read_request(reader):
+    """Читает один HTTP-запрос; None, если клиент закрыл соединение."""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HttpError(400, "некорректная строка запроса")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HttpError(400, "некорректный Content-Length")
+    if length < 0 or length > MAX_BODY:
+        raise HttpError(400, "некорректный размер тела запроса")
+    body = await reader.readexactly(length) if length else b""
+    url = urlsplit(target)
+    return {
+        "method": method.upper(),
+        "path": url.path.rstrip("/") or "/",
+        "query": {k: v[-1] for k, v in parse_qs(url.query).items()},
+        "version": version,
+        "headers": headers,
+        "body": body,
+    }
+
+
+def authorized(request):
+    if not API_TOKEN:
+        return False
+    header = request["headers"].get("authorization", "")
+    # Сравнение за постоянное время: токен не подбирается по времени ответа
+    return hmac.compare_digest(header.encode(), f"Bearer {API_TOKEN}".encode())
+
+
+def is_local(request):
+    """Host (и Origin, если есть) указывают на локальный адрес."""
+    headers = request["headers"]
+    if urlsplit("//" + headers.get("host", "")).hostname not in LOCAL_HOSTS:
+        return False
+    origin = headers.get("origin")
+    return origin is None or urlsplit(origin).hostname in LOCAL_HOSTS
+
+
+async def send_json(writer, status, data, keep_alive=True):
+    body = json.dumps(clean(data), ensure_ascii=False).encode()
+    head = (
+        f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+        "Content-Type: application/json; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    writer.write(head.encode() + body)
+    await writer.drain()
+
+
+async def stream_events(request, reader, writer):
+    """GET /events: события бота в формате server-sent events."""
+    last_id = request["headers"].get("last-event-id") or request["query"].get("last_id")
+    queue = event_bus.subscribe(int(last_id) if last_id and last_id.isdigit() else None)
+    writer.write(
+        b"HTTP/1.1 200 OK\r\n"
+        b"Content-Type: text/event-stream; charset=utf-8\r\n"
+        b"Cache-Control: no-cache\r\n"
+        b"Connection: keep-alive\r\n\r\n"
+        b"retry: 3000\n\n"
+    )
+    # Клиент SSE ничего не шлёт: EOF на чтении означает, что он отключился
+    closed = asyncio.create_task(reader.read())
+    try:
+        await writer.drain()
+        while not closed.done():
+            getter = asyncio.create_task(queue.get())
+            done, _ = await asyncio.wait(
+                {getter, closed}, timeout=SSE_PING_INTERVAL, return_when=asyncio.FIRST_COMPLETED
+            )
+            if getter not in done:
+                getter.cancel()
+                if closed in done:
+                    break
+                writer.write(b": ping\n\n")
+            else:
+                event = getter.result()
+                data = json.dumps(clean(event), ensure_ascii=False)
+                writer.write(f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n".encode())
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        closed.cancel()
+        event_bus.unsubscribe(queue)
+
+
+async def handle_connection(reader, writer):
+    try:
+        while True:
+            try:
+                # Простаивающее keep-alive соединение закрывается по таймауту
+                request = await asyncio.wait_for(read_request(reader), API_IDLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            except HttpError as e:
+                await send_json(writer, e.status, {"error": str(e)}, keep_alive=False)
+                break
+            if request is None:
+                break
+            keep_alive = request["headers"].get("connection", "").lower() != "close" and request[
+                "version"
+            ] != "HTTP/1.0"
+            if not is_local(request):
+                await send_json(writer, 403, {"error": "доступ только с локального адреса"}, keep_alive)
+            elif not authorized(request):
+                await send_json(writer, 401, {"error": "нужен токен: Authorization: Bearer <API_TOKEN>"}, keep_alive)
+            elif request["method"] == "GET" and request["path"] == "/events":
+                await stream_events(request, reader, writer)
+                break
+            else:
+                status, data = await dispatch(request)
+                await send_json(writer, status, data, keep_alive)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def dispatch(request):
+    handler = ROUTES.get((request["method"], request["path"]))
+    if handler is None:
+        if any(path == request["path"] for _, path in ROUTES):
+            return 405, {"error": "метод не поддерживается"}
+        return 404, {"error": "не найдено", "routes": sorted({path for _, path in ROUTES} | {"/events"})}
+    with_label = diagnostics.labelled(f"api:{request['path'].strip('/')}", _call)
+    try:
+        return 200, await with_label(handler, request)
+    except HttpError as e:
+        return e.status, {"error": str(e)}
+    except Exception as e:
+        logging.error(f"❌ Ошибка API {request['method']} {request['path']}: {e}")
+        return 500, {"error": str(e)}
+
+
+async def _call(handler, request):
+    result = handler(request)
+    if asyncio.iscoroutine(result):
+        result = await result
+    return result
+
+
+async def start(host=API_HOST, port=API_PORT):
+    """Запускает API в текущем event loop; без API_TOKEN API не запускается."""
+    global server
+    if not API_TOKEN:
+        logging.error("❌ HTTP API не запущен: задайте API_TOKEN в config.py")
+        return None
+    server = await asyncio.start_server(handle_connection, host, port)
+    logging.info(f"🌐 HTTP API: http://{host}:{port}")
+    return server
+
+
+async def stop():
+    if server is not None:
+        server.close()
+        await server.wait_closed()
@@ -1,22 +1,36 @@
 import time
-import json
 import asyncio
 import logging
 import re
+import clock
+import diagnostics
 from config import (
-    TRADE_PAIRS,
     ADMIN_CHAT_ID,
     TELEGRAM_API_TOKEN,
     AUTO_UPDATE_PAIRS,
-    TRADE_INTERVAL,
+    UPDATE_INTERVAL,
     TRAILING_STOP_PERCENT,
     MIN_ORDER_USDT,
+    SHARD_WORKERS,
+    SHARD_REMOTE_WORKERS,
+    RISK_MAX_REENTRIES,
+    RISK_CORRELATION_WINDOW,
+    EXECUTION_FILL_TIMEOUT,
 )
-from telegram import Bot, ReplyKeyboardMarkup
+from telegram import ReplyKeyboardMarkup
 from bybit_client import BybitAPI
 from indicators import IndicatorCalculator
 from pair_manager import PairManager
 from order_storage import load_active_orders, save_active_orders
+from sharding import ShardCoordinator
+from execution import ExecutionEngine, format_execution_report
+from pnl_ledger import PnLLedger
+from risk_engine import RiskEngine
+from reconciliation import Reconciler
+from scheduler import CandleCloseScheduler, monitor_delay
+from universe import UniverseService
+from events import event_bus
+from capture import make_bot, record_stage
 
 # Настройка логов
 logging.basicConfig(
@@ -26,20 +40,181 @@ logging.basicConfig(
 # Глобальные переменные
 auto_trade_active = False
 trade_task = None
+# Последний сигнал по каждой паре (для API и отчётов)
+last_signals = {}
+start_lock = asyncio.Lock()
 
 # Инициализация API, индикаторов и Telegram-бота
 bybit_client = BybitAPI()
 indicator_calc = IndicatorCalculator()
-bot = Bot(TELEGRAM_API_TOKEN)
+execution_engine = ExecutionEngine(bybit_client)
+pnl_ledger = PnLLedger()
+risk_engine = RiskEngine(pnl_ledger)
+bot = make_bot(TELEGRAM_API_TOKEN)
 
 # Загрузка активных ордеров из файла
 active_orders = load_active_orders()
+risk_engine.sync_positions(active_orders)
+reconciler = Reconciler(bybit_client, pnl_ledger, active_orders)
 
+
+def on_position_closed(pair, reason):
+    """Сверка сняла позицию (плоская или не исполнилась): мониторинг остановится сам."""
+    risk_engine.set_exposure(pair, 0)
+    save_active_orders(active_orders)
+    event_bus.publish("position_closed", pair=pair, reason=reason)
+
+
+reconciler.on_position_closed = on_position_closed
+scheduler = CandleCloseScheduler()
 pair_manager = PairManager()
+universe = UniverseService(bybit_client, pair_manager, indicator_calc)
+
+
+def on_pairs_changed(added, removed):
+    """Новые пары оцениваются на ближайшем скане, без перезапуска."""
+    for pair in added + removed:
+        scheduler.reset(pair)
+
+
+pair_manager.subscribe(on_pairs_changed)
 first_signal_check = True
 
-# Порог проверки для трейлинга (секунды)
-TRAILING_CHECK_INTERVAL = 10
+# Координатор шардов: сканирование и рыночные данные уходят в воркеры
+shard_coordinator = (
+    ShardCoordinator() if SHARD_WORKERS or SHARD_REMOTE_WORKERS else None
+)
+
+
+async def get_current_price(pair):
+    """Последняя цена пары: через воркер шарда или напрямую с биржи."""
+    if shard_coordinator and shard_coordinator.shard_count:
+        prices = await shard_coordinator.get_prices([pair])
+        return prices.get(pair)
+    return await diagnostics.to_thread(bybit_client.get_last_price, pair)
+
+
+def update_risk_returns(pairs):
+    """Обновляет доходности пар для корреляций риск-движка из общего буфера свечей."""
+    for pair in pairs:
+        closes = indicator_calc.cached_closes(pair, RISK_CORRELATION_WINDOW + 1)
+        if len(closes) >= 2:
+            risk_engine.update_returns(pair, closes)
+
+
+async def refresh_held_returns():
+    """
+    Пары с позицией не сканируются, поэтому их свечи и индикаторы обновляются
+    отдельно: без свежих доходностей не работает лимит коррелированных позиций,
+    без ATR мониторинг не подстраивает частоту опроса.
+    """
+    held = [pair for pair, info in active_orders.items() if info]
+    if not held:
+        return
+    try:
+        results = await diagnostics.to_thread(indicator_calc.compute_batch, held)
+    except Exception as e:
+        logging.error(f"❌ Ошибка расчёта индикаторов открытых позиций: {e}")
+        results = {}
+    for pair, (last_row, _, _) in results.items():
+        indicator_calc.last_rows[pair] = last_row
+    update_risk_returns(held)
+
+
+async def calculate_signals(trading_pairs):
+    """
+    Сигналы по парам: шардированно, если запущены воркеры. В результате — только
+    пары, по которым сигнал посчитан; индикаторы сохраняются в indicator_calc.last_rows.
+    """
+    try:
+        if shard_coordinator and shard_coordinator.shard_count:
+            results = await shard_coordinator.compute_batch(trading_pairs)
+        else:
+            results = await diagnostics.to_thread(indicator_calc.compute_batch, trading_pairs)
+    except Exception as e:
+        logging.error(f"❌ Ошибка при расчете индикаторов: {e}")
+        results = {}
+    signals = {}
+    for pair, (last_row, signal, strength) in results.items():
+        indicator_calc.last_rows[pair] = last_row
+        signals[pair] = (signal, strength)
+    # Свечи пар уже в общем буфере (его пишут и воркеры шардов)
+    update_risk_returns(trading_pairs)
+    now = clock.now()
+    for pair, (signal, strength) in signals.items():
+        last_signals[pair] = {"signal": signal, "strength": strength, "time": now}
+    event_bus.publish(
+        "signals", signals={pair: last_signals[pair] for pair in signals}
+    )
+    return signals
+
+
+def check_risk(pair, side, order_size):
+    """Предторговая проверка риска; возвращает допустимый объём или 0."""
+    decision, size, reason = risk_engine.check_order(pair, side, order_size)
+    if decision == "reject":
+        logging.warning(f"⛔ {pair}: ордер {order_size} USDT отклонён ({reason})")
+        return 0
+    if decision == "resize":
+        logging.info(f"✂️ {pair}: объём уменьшен {order_size} → {size} USDT ({reason})")
+    return size
+
+
+async def record_order_fills(pair, order_ids):
+    """Подтягивает исполнения ордеров с биржи в журнал PnL."""
+    for order_id in order_ids:
+        if not order_id:
+            continue
+        result = await diagnostics.to_thread(
+            bybit_client.get_executions, pair, order_id
+        )
+        if result:
+            pnl_ledger.record_executions(result["list"])
+    pnl_ledger.save()
+    return pnl_ledger.position(pair)
+
+
+def position_qty(pair, info):
+    """
+    Количество токена в позиции для закрытия: из журнала PnL (учитывает доливки
+    и комиссии), иначе из active_orders.
+    """
+    account = pnl_ledger.position(pair)
+    if account and account["qty"] and (account["qty"] > 0) == (info["side"] == "Buy"):
+        return round(abs(account["qty"]), 8)
+    return info.get("qty") or 0.0
+
+
+async def close_position(pair, info):
+    """Закрывает позицию рыночным ордером на её количество токена; None при ошибке."""
+    qty = position_qty(pair, info)
+    if not qty:
+        logging.error(f"❌ {pair}: количество позиции неизвестно, закрыть нельзя")
+        return None
+    return await diagnostics.to_thread(bybit_client.close_position, pair, info["side"], qty)
+
+
+async def close_and_confirm(pair, info, price):
+    """
+    Закрывает позицию и дожидается исполнения. Возвращает счёт пары из журнала
+    PnL, если позиция закрыта (остаток меньше минимального ордера), иначе None —
+    запись в active_orders остаётся, закрытие повторяется на следующем тике.
+    """
+    qty = position_qty(pair, info)
+    response = await close_position(pair, info)
+    if not response:
+        logging.warning(f"⚠️ {pair}: закрытие не отправлено, повторим на следующем тике")
+        return None
+    filled, _ = await diagnostics.to_thread(
+        execution_engine.settle, pair, response, EXECUTION_FILL_TIMEOUT
+    )
+    account = await record_order_fills(pair, [response.get("result", {}).get("orderId")])
+    if not filled or (qty - filled) * price >= MIN_ORDER_USDT:
+        logging.warning(
+            f"⚠️ {pair}: закрытие исполнено на {filled} из {qty}, повторим на следующем тике"
+        )
+        return None
+    return account or {"realized": 0.0}
 
 
 # --- Функция мониторинга позиции ---
@@ -50,54 +225,86 @@ async def monitor_position(pair, order_info):
     """
     entry_price = order_info["entry_price"]
     side = order_info["side"]
-    order_size = order_info["order_size"]
     max_price = entry_price
     REENTRY_TRIGGER_PERCENT = 0.03
     REENTRY_COOLDOWN = 300
     last_reentry_time = 0
 
     while pair in active_orders and auto_trade_active:
-        kline = bybit_client.get_kline(pair, interval=TRADE_INTERVAL, limit=1)
-        if kline and "result" in kline and kline["result"]["list"]:
-            current_price = float(kline["result"]["list"][-1][4])
-        else:
-            await asyncio.sleep(5)
+        started = time.perf_counter()
+        current_price = await get_current_price(pair)
+        if current_price is None:
+            await clock.async_sleep(5)
             continue
+        pnl_ledger.on_price(pair, current_price)
 
         if side == "Buy":
             if current_price > max_price:
                 max_price = current_price
             trailing_stop = max_price * (1 - TRAILING_STOP_PERCENT)
             take_profit = entry_price * (1 + TRAILING_STOP_PERCENT)
-            if current_price <= trailing_stop or current_price >= take_profit:
-                await asyncio.to_thread(
-                    bybit_client.close_position, pair, side, order_size
-                )
-                await bot.send_message(
-                    ADMIN_CHAT_ID,
-                    f"📉 *{pair}*: Позиция закрыта.\nЦена: {current_price:.2f} | TS: {trailing_stop:.2f} | TP: {take_profit:.2f}",
-                    parse_mode="Markdown",
-                )
-                active_orders.pop(pair, None)
-                save_active_orders(active_orders)
-                break
-
-            if current_price >= entry_price * (1 + REENTRY_TRIGGER_PERCENT):
-                now = time.time()
-                if now - last_reentry_time > REENTRY_COOLDOWN:
-                    additional_order_size = calculate_order_size(entry_price, 3)
-                    response = await asyncio.to_thread(
-                        bybit_client.create_order, pair, side, additional_order_size
+            reentry_price = entry_price * (1 + REENTRY_TRIGGER_PERCENT)
+            closing = current_price <= trailing_stop or current_price >= take_profit
+            if closing:
+                account = await close_and_confirm(pair, order_info, current_price)
+                if account:
+                    realized = account["realized"]
+                    await bot.send_message(
+                        ADMIN_CHAT_ID,
+                        f"📉 *{pair}*: Позиция закрыта.\nЦена: {current_price:.2f} | TS: {trailing_stop:.2f} | TP: {take_profit:.2f}\n"
+                        f"Реализованный PnL по паре: {realized:+.2f} USDT",
+                        parse_mode="Markdown",
                     )
-                    if response:
+                    active_orders.pop(pair, None)
+                    risk_engine.set_exposure(pair, 0)
+                    save_active_orders(active_orders)
+                    event_bus.publish(
+                        "position_closed",
+                        pair=pair,
+                        side=side,
+                        price=current_price,
+                        realized=realized,
+                    )
+                    break
+
+            if not closing and current_price >= reentry_price:
+                now = clock.now()
+                if (
+                    now - last_reentry_time > REENTRY_COOLDOWN
+                    and order_info.get("reentries", 0) < RISK_MAX_REENTRIES
+                ):
+                    additional_order_size = check_risk(
+                        pair, side, calculate_order_size(entry_price, 3)
+                    )
+                    if not additional_order_size:
+                        # Лимит риска не освободится за секунды: повтор — после кулдауна доливки
                         last_reentry_time = now
-                        order_info["order_size"] += additional_order_size
-                        await bot.send_message(
-                            ADMIN_CHAT_ID,
-                            f"✅ *{pair}*: Дополнительный вход при росте.\nДоп. объём: {additional_order_size} USDT",
-                            parse_mode="Markdown",
+                    else:
+                        response, report = await diagnostics.to_thread(
+                            execution_engine.execute,
+                            pair,
+                            side,
+                            additional_order_size,
+                            current_price,
                         )
-                        save_active_orders(active_orders)
+                        if response:
+                            last_reentry_time = now
+                            order_info["order_size"] += report["filled_quote"]
+                            order_info["reentries"] = order_info.get("reentries", 0) + 1
+                            order_info.setdefault("order_ids", reconciler.order_ids(order_info))
+                            order_info["order_ids"] += report["order_ids"]
+                            risk_engine.add_exposure(pair, report["filled_quote"])
+                            account = await record_order_fills(pair, report["order_ids"])
+                            if account and account["qty"]:
+                                entry_price = order_info["entry_price"] = account["avg_entry"]
+                                order_info["qty"] = account["qty"]
+                            await bot.send_message(
+                                ADMIN_CHAT_ID,
+                                f"✅ *{pair}*: Дополнительный вход при росте.\nДоп. объём: {report['filled_quote']:.2f} USDT\n"
+                                f"{format_execution_report(report)}",
+                                parse_mode="Markdown",
+                            )
+                            save_active_orders(active_orders)
         elif side == "Sell":
             if "min_price" not in order_info:
                 order_info["min_price"] = entry_price
@@ -105,38 +312,74 @@ async def monitor_position(pair, order_info):
                 order_info["min_price"] = current_price
             trailing_stop = order_info["min_price"] * (1 + TRAILING_STOP_PERCENT)
             take_profit = entry_price * (1 - TRAILING_STOP_PERCENT)
-            if current_price >= trailing_stop or current_price <= take_profit:
-                await asyncio.to_thread(
-                    bybit_client.close_position, pair, side, order_size
-                )
-                await bot.send_message(
-                    ADMIN_CHAT_ID,
-                    f"📉 *{pair}*: Позиция закрыта.\nЦена: {current_price:.2f} | TS: {trailing_stop:.2f} | TP: {take_profit:.2f}",
-                    parse_mode="Markdown",
-                )
-                active_orders.pop(pair, None)
-                save_active_orders(active_orders)
-                break
-            now = time.time()
-            if current_price <= entry_price * (1 - 0.03):
+            reentry_price = entry_price * (1 - REENTRY_TRIGGER_PERCENT)
+            closing = current_price >= trailing_stop or current_price <= take_profit
+            if closing:
+                account = await close_and_confirm(pair, order_info, current_price)
+                if account:
+                    realized = account["realized"]
+                    await bot.send_message(
+                        ADMIN_CHAT_ID,
+                        f"📉 *{pair}*: Позиция закрыта.\nЦена: {current_price:.2f} | TS: {trailing_stop:.2f} | TP: {take_profit:.2f}\n"
+                        f"Реализованный PnL по паре: {realized:+.2f} USDT",
+                        parse_mode="Markdown",
+                    )
+                    active_orders.pop(pair, None)
+                    risk_engine.set_exposure(pair, 0)
+                    save_active_orders(active_orders)
+                    event_bus.publish(
+                        "position_closed",
+                        pair=pair,
+                        side=side,
+                        price=current_price,
+                        realized=realized,
+                    )
+                    break
+            now = clock.now()
+            if not closing and current_price <= reentry_price:
                 if (
                     "last_reentry_time" not in order_info
                     or now - order_info["last_reentry_time"] > REENTRY_COOLDOWN
-                ):
-                    additional_order_size = calculate_order_size(entry_price, 3)
-                    response = await asyncio.to_thread(
-                        bybit_client.create_order, pair, side, additional_order_size
+                ) and order_info.get("reentries", 0) < RISK_MAX_REENTRIES:
+                    additional_order_size = check_risk(
+                        pair, side, calculate_order_size(entry_price, 3)
                     )
-                    if response:
-                        order_info["order_size"] += additional_order_size
+                    if not additional_order_size:
+                        # Лимит риска не освободится за секунды: повтор — после кулдауна доливки
                         order_info["last_reentry_time"] = now
-                        await bot.send_message(
-                            ADMIN_CHAT_ID,
-                            f"✅ *{pair}*: Дополнительный вход (SELL) при снижении.\nДоп. объём: {additional_order_size} USDT",
-                            parse_mode="Markdown",
+                    else:
+                        response, report = await diagnostics.to_thread(
+                            execution_engine.execute,
+                            pair,
+                            side,
+                            additional_order_size,
+                            current_price,
                         )
-                        save_active_orders(active_orders)
-        await asyncio.sleep(5)
+                        if response:
+                            order_info["order_size"] += report["filled_quote"]
+                            order_info["reentries"] = order_info.get("reentries", 0) + 1
+                            order_info.setdefault("order_ids", reconciler.order_ids(order_info))
+                            order_info["order_ids"] += report["order_ids"]
+                            risk_engine.add_exposure(pair, report["filled_quote"])
+                            order_info["last_reentry_time"] = now
+                            account = await record_order_fills(pair, report["order_ids"])
+                            if account and account["qty"]:
+                                entry_price = order_info["entry_price"] = account["avg_entry"]
+                                order_info["qty"] = account["qty"]
+                            await bot.send_message(
+                                ADMIN_CHAT_ID,
+                                f"✅ *{pair}*: Дополнительный вход (SELL) при снижении.\nДоп. объём: {report['filled_quote']:.2f} USDT\n"
+                                f"{format_execution_report(report)}",
+                                parse_mode="Markdown",
+                            )
+                            save_active_orders(active_orders)
+        record_stage("monitor_position", started, pair=pair)
+        atr = indicator_calc.last_rows.get(pair, {}).get("atr")
+        await clock.async_sleep(
+            monitor_delay(
+                current_price, (trailing_stop, take_profit, reentry_price), atr
+            )
+        )
 
 
 # --- Основной торговый цикл ---
@@ -144,11 +387,24 @@ async def trade_logic():
     global active_orders, first_signal_check, auto_trade_active
     if not auto_trade_active:
         return []
-    trading_pairs = pair_manager.get_active_pairs()
-    signals = indicator_calc.calculate_signals(trading_pairs)
+    await refresh_held_returns()
+    # Пересчитываем только пары без позиции и с новой закрытой свечой
+    trading_pairs = scheduler.due_pairs(
+        [pair for pair in pair_manager.get_active_pairs() if pair not in active_orders]
+    )
+    if not trading_pairs:
+        return []
+    signals = await calculate_signals(trading_pairs)
+    if not signals:
+        return []
     orders_placed = []
 
-    usdt_balance = bybit_client.get_usdt_balance()
+    usdt_balance = await diagnostics.to_thread(bybit_client.get_usdt_balance)
+    if usdt_balance is None:
+        logging.warning("⚠️ Баланс USDT недоступен, пропускаем цикл торговли")
+        return orders_placed
+    # Решение по свече принято; пары без сигнала повторятся на следующем проходе
+    scheduler.mark_evaluated(signals)
     if usdt_balance == 0:
         await bot.send_message(ADMIN_CHAT_ID, "⚠️ Недостаточно USDT для торговли!")
         logging.warning("⚠️ Недостаточно USDT для торговли!")
@@ -166,7 +422,7 @@ async def trade_logic():
         await bot.send_message(ADMIN_CHAT_ID, report, parse_mode="Markdown")
         first_signal_check = False
 
-    for pair, (signal, strength) in signals.items():
+    for index, (pair, (signal, strength)) in enumerate(signals.items()):
         if not auto_trade_active:
             break
         if signal not in ("BUY", "SELL"):
@@ -177,11 +433,16 @@ async def trade_logic():
             continue
         if signal == "SELL":
             asset = pair.replace("USDT", "")
-            asset_balance = bybit_client.get_asset_balance(asset)
-            if asset_balance <= 0:
+            asset_balance = await diagnostics.to_thread(bybit_client.get_asset_balance, asset)
+            if not asset_balance or asset_balance <= 0:
                 continue
 
-        current_usdt_balance = bybit_client.get_usdt_balance()
+        current_usdt_balance = await diagnostics.to_thread(bybit_client.get_usdt_balance)
+        if current_usdt_balance is None:
+            logging.warning("⚠️ Баланс USDT недоступен, прекращаем размещение ордеров")
+            for rest in list(signals)[index:]:
+                scheduler.reset(rest)
+            break
         if current_usdt_balance < MIN_ORDER_USDT:
             logging.warning(
                 f"Текущий баланс USDT ({current_usdt_balance} USDT) меньше минимального ордера ({MIN_ORDER_USDT} USDT)."
@@ -196,28 +457,50 @@ async def trade_logic():
             continue
 
         side = "Buy" if signal == "BUY" else "Sell"
-        response = await asyncio.to_thread(
-            bybit_client.create_order, pair, side, order_size
+        order_size = check_risk(pair, side, order_size)
+        if not order_size:
+            continue
+        response, report = await diagnostics.to_thread(
+            execution_engine.execute, pair, side, order_size
         )
         if response:
-            kline = bybit_client.get_kline(pair, interval=TRADE_INTERVAL, limit=1)
-            entry_price = float(kline["result"]["list"][-1][4]) if kline else 0
+            # Позиция — только то, что реально исполнилось (по состоянию ордеров)
+            order_size = report["filled_quote"]
+            account = await record_order_fills(pair, report["order_ids"])
+            if account and account["qty"]:
+                entry_price = account["avg_entry"]
+            else:
+                entry_price = report["avg_price"]
             active_orders[pair] = {
-                "order_id": response.get("orderId"),
+                "order_id": report["order_ids"][-1],
+                "order_ids": list(report["order_ids"]),
                 "side": side,
                 "entry_price": entry_price,
                 "order_size": order_size,
+                "qty": abs(account["qty"]) if account and account["qty"] else report["filled_qty"],
+                "execution": report,
             }
+            risk_engine.add_exposure(pair, order_size)
             orders_placed.append(pair)
             await bot.send_message(
                 ADMIN_CHAT_ID,
-                f"✅ *{pair}*: Открыта позиция `{side}` на {order_size} USDT по цене {entry_price:.2f}",
+                f"✅ *{pair}*: Открыта позиция `{side}` на {order_size:.2f} USDT по цене {entry_price:.2f}\n"
+                f"{format_execution_report(report)}",
                 parse_mode="Markdown",
             )
             save_active_orders(active_orders)
-            asyncio.create_task(monitor_position(pair, active_orders[pair]))
+            event_bus.publish(
+                "position_opened",
+                pair=pair,
+                side=side,
+                entry_price=entry_price,
+                order_size=order_size,
+            )
+            asyncio.create_task(
+                monitor_position(pair, active_orders[pair]), name=f"monitor:{pair}"
+            )
         else:
-            logging.error(f"❌ {pair}: Ошибка при размещении ордера")
+            logging.error(f"❌ {pair}: ордер не исполнен ({format_execution_report(report)})")
     return orders_placed
 
 
@@ -234,42 +517,34 @@ def calculate_order_size(balance, strength):
 
 
 # --- Функция обновления списка торговых пар ---
-async def update_trade_pairs():
+async def update_trade_pairs(force=True):
+    """Обновляет список торговых пар; возвращает False, если пары получить не удалось."""
     print("📡 Обновление списка торговых пар...")
-    all_pairs = bybit_client.get_spot_pairs()
-    if not all_pairs:
+    result = await universe.rerank(force=force)
+    if result is None:
         print("❌ Ошибка получения пар!")
-        return
-    stablecoins = {"USDC", "BUSD", "DAI", "TUSD", "FDUSD", "EURS"}
-    pair_volumes = []
-    for pair in all_pairs:
-        symbol = pair["symbol"]
-        volume = float(pair.get("turnover24h", 0))
-        if "USDT" in symbol and not any(stable in symbol for stable in stablecoins):
-            pair_volumes.append((symbol, volume))
-    pair_volumes.sort(key=lambda x: x[1], reverse=True)
-    top_pairs = [pair[0] for pair in pair_volumes[:15]]
-    global TRADE_PAIRS
-    TRADE_PAIRS = top_pairs
-    with open("trade_pairs.json", "w") as file:
-        json.dump({"TRADE_PAIRS": top_pairs}, file, indent=4)
+        return False
+    top_pairs, added, removed = result
     msg = (
         f"✅ Обновлено {len(top_pairs)} пар!\n📊 Торговые пары: {', '.join(top_pairs)}"
     )
+    if added or removed:
+        msg += f"\n➕ {', '.join(added) or '-'}\n➖ {', '.join(removed) or '-'}"
     print(msg)
     await bot.send_message(ADMIN_CHAT_ID, msg)
+    return True
 
 
-# --- Ежедневное обновление списка торговых пар ---
+# --- Периодическое обновление списка торговых пар ---
 async def daily_update_trade_pairs():
     while True:
-        await update_trade_pairs()
-        await asyncio.sleep(86400)
+        await update_trade_pairs(force=False)
+        await clock.async_sleep(UPDATE_INTERVAL)
 
 
 def start_background_tasks():
     loop = asyncio.get_event_loop()
-    loop.create_task(daily_update_trade_pairs())
+    loop.create_task(daily_update_trade_pairs(), name="pairs-update")
 
 
 if AUTO_UPDATE_PAIRS:
@@ -277,72 +552,143 @@ if AUTO_UPDATE_PAIRS:
 
 
 # --- Основной торговый цикл ---
+async def run_trade_cycle():
+    """
+    Один вызов trade_logic с записью этапа — и при ошибке тоже, иначе
+    воспроизведение записи пропустит этот цикл и сдвинет очереди ответов.
+    """
+    started = time.perf_counter()
+    error = None
+    try:
+        await trade_logic()
+    except Exception as e:
+        error = str(e)
+        logging.error(f"❌ Ошибка в автоторговле: {e}")
+        await bot.send_message(ADMIN_CHAT_ID, f"❌ Ошибка в автоторговле: {e}")
+    finally:
+        if error is None:
+            record_stage("trade_logic", started)
+        else:
+            record_stage("trade_logic", started, error=error)
+
+
 async def main_trade_loop():
     while auto_trade_active:
-        try:
-            await trade_logic()
-            await asyncio.sleep(30)
-        except Exception as e:
-            logging.error(f"❌ Ошибка в автоторговле: {e}")
-            await bot.send_message(ADMIN_CHAT_ID, f"❌ Ошибка в автоторговле: {e}")
+        await run_trade_cycle()
+        # Следующая оценка — по закрытию свечи TRADE_INTERVAL (или повтор несчитанных пар)
+        await scheduler.wait_next_pass()
     logging.info("⏹ Автоторговля остановлена!")
 
 
 async def restore_active_orders():
     """
-    Восстанавливает открытые ордера с биржи и запускает для них мониторинг.
-    Если биржа возвращает список открытых ордеров, обновляем active_orders и сохраняем их в файл.
+    Восстанавливает состояние после перезапуска. Неисполненные ордера с биржи
+    отслеживаются как заявки, а не как позиции; позиции берутся из сохранённого
+    состояния после догрузки исполнений и сверки с балансом, затем для них запускается мониторинг.
     """
-    response = await asyncio.to_thread(bybit_client.get_open_orders)
+    response = await diagnostics.to_thread(bybit_client.get_open_orders)
     if response and response.get("retCode") == 0:
-        orders = response["result"]["list"]
-        for order in orders:
-            symbol = order["symbol"]
-            order_info = {
-                "order_id": order.get("orderId"),
-                "side": order.get("side"),
-                "entry_price": float(order.get("price", 0)),
-                "order_size": float(order.get("qty", 0)),
-            }
-            active_orders[symbol] = order_info
-            asyncio.create_task(monitor_position(symbol, order_info))
-        save_active_orders(active_orders)
-        logging.info("Восстановлены открытые ордера с биржи.")
-    else:
-        logging.info("Открытых ордеров для восстановления не найдено.")
+        for order in response["result"]["list"]:
+            reconciler.track_order(order)
+    await reconciler.catch_up()
+    await reconciler.diff()
+    for symbol, order_info in active_orders.items():
+        if order_info:
+            asyncio.create_task(
+                monitor_position(symbol, order_info), name=f"monitor:{symbol}"
+            )
+    risk_engine.sync_positions(active_orders)
+    await refresh_held_returns()
+    save_active_orders(active_orders)
+    logging.info(
+        f"Восстановлено позиций: {len(active_orders)}, открытых заявок: {len(reconciler.open_orders())}"
+    )
 
 
 # --- Функции старта и остановки автоторговли ---
 async def start_auto_trade():
     global auto_trade_active, trade_task
-    if auto_trade_active:
-        return "⚠️ Автоторговля уже запущена!"
-
-    balance = bybit_client.get_wallet_balance(as_report=False)
-    try:
-        balance = float(balance)
-    except (TypeError, ValueError):
-        balance = 0
-
-    if balance < MIN_ORDER_USDT:
-        logging.warning(
-            f"Баланс ({balance} USDT) меньше минимального ордера ({MIN_ORDER_USDT} USDT)."
-        )
-        return
-
-    await restore_active_orders()
+    # Запуск возможен и из Telegram, и из HTTP API: не даём двум запускам пересечься
+    async with start_lock:
+        if auto_trade_active:
+            return "⚠️ Автоторговля уже запущена!"
+
+        balance = await diagnostics.to_thread(bybit_client.get_wallet_balance, as_report=False)
+        if balance is None:
+            logging.warning("⚠️ Баланс недоступен, автоторговля не запущена")
+            return "⚠️ Биржа недоступна, повторите запуск позже"
+
+        if balance < MIN_ORDER_USDT:
+            msg = f"Баланс ({balance} USDT) меньше минимального ордера ({MIN_ORDER_USDT} USDT)."
+            logging.warning(msg)
+            return f"⚠️ {msg}"
+
+        if shard_coordinator:
+            try:
+                # Локальные воркеры обычно уже запущены из tg_bot.main();
+                # при ошибке start_local сам закрывает то, что успел запустить
+                shard_coordinator.start_local()
+                failed = await diagnostics.to_thread(shard_coordinator.connect_remote)
+            except Exception as e:
+                # Локальные воркеры не останавливаем: повторный fork из процесса
+                # с потоками небезопасен (см. start_local)
+                logging.error(f"❌ Не удалось запустить шарды: {e}")
+                return f"❌ Не удалось запустить шарды: {e}"
+            if failed:
+                await bot.send_message(
+                    ADMIN_CHAT_ID, f"⚠️ Удалённые воркеры недоступны: {', '.join(failed)}"
+                )
 
-    auto_trade_active = True
-    logging.info("✅ Автоторговля запущена!")
-    await bot.send_message(ADMIN_CHAT_ID, "✅ Автоторговля запущена!")
-    trade_task = asyncio.create_task(main_trade_loop())
+        # Ручной запуск снимает блокировку kill switch
+        risk_engine.resume()
+        # Флаг ставим до восстановления, иначе мониторы позиций сразу завершатся
+        auto_trade_active = True
+        await restore_active_orders()
+        reconciler.start()
+        logging.info("✅ Автоторговля запущена!")
+        await bot.send_message(ADMIN_CHAT_ID, "✅ Автоторговля запущена!")
+        event_bus.publish("status", active=True)
+        trade_task = asyncio.create_task(main_trade_loop(), name="scan")
+        return "✅ Автоторговля запущена!"
 
 
-def stop_auto_trade():
+async def stop_auto_trade():
     global auto_trade_active, trade_task, active_orders
     auto_trade_active = False
     if trade_task:
         trade_task.cancel()
+    if shard_coordinator:
+        # Закрытие соединений ждёт текущих запросов к воркерам — не в event loop
+        await diagnostics.to_thread(shard_coordinator.disconnect_remote)
+    reconciler.stop()
     save_active_orders(active_orders)
     logging.info("⏹ Автоторговля остановлена!")
+    event_bus.publish("status", active=False)
     return "⏹ Автоторговля остановлена!"
+
+
+async def kill_switch():
+    """
+    Аварийная остановка: блокирует новые ордера, закрывает все позиции
+    рыночными ордерами и останавливает автоторговлю.
+    """
+    risk_engine.halt()
+    closed = []
+    for pair, info in list(active_orders.items()):
+        if not info:
+            continue
+        price = await get_current_price(pair) or info.get("entry_price") or 0.0
+        if await close_and_confirm(pair, info, price):
+            active_orders.pop(pair, None)
+            risk_engine.set_exposure(pair, 0)
+            closed.append(pair)
+        else:
+            logging.error(f"❌ {pair}: не удалось закрыть позицию kill switch")
+    await stop_auto_trade()
+    msg = f"🛑 Kill switch: закрыто позиций {len(closed)}"
+    if active_orders:
+        msg += f", не закрыты: {', '.join(active_orders)}"
+    logging.warning(msg)
+    event_bus.publish("kill", closed=closed, remaining=list(active_orders))
+    await bot.send_message(ADMIN_CHAT_ID, msg)
+    return msg
@@ -0,0 +1,211 @@
+import logging
+import os
+import time
+import numpy as np
+from candles import Candles, parse_kline
+from candle_store import interval_ms
+from fast_indicators import compute_indicators
+from indicators import SIGNAL_PARAMS, generate_trade_signals
+from config import HISTORY_DIR, BACKTEST_FEE, TRAILING_STOP_PERCENT
+
+# Параметры сопровождения позиции, как в autotrade.monitor_position
+EXIT_PARAMS = {
+    "trailing_stop": TRAILING_STOP_PERCENT,
+    "take_profit": TRAILING_STOP_PERCENT,
+}
+DEFAULT_PARAMS = {**SIGNAL_PARAMS, **EXIT_PARAMS}
+
+# Сколько свечей проверять за раз при поиске выхода из позиции
+EXIT_CHUNK = 512
+
+
+# --- Локальная история свечей ---
+def history_path(symbol, interval, directory=HISTORY_DIR):
+    return os.path.join(directory, f"{symbol}_{interval}.npz")
+
+
+def load_history(symbol, interval, directory=HISTORY_DIR):
+    """Свечи пары из локального архива .npz или None."""
+    try:
+        with np.load(history_path(symbol, interval, directory)) as archive:
+            return Candles(np.ascontiguousarray(archive["data"]))
+    except FileNotFoundError:
+        return None
+
+
+def save_history(symbol, interval, candles, directory=HISTORY_DIR):
+    os.makedirs(directory, exist_ok=True)
+    np.savez(history_path(symbol, interval, directory), data=candles.data)
+
+
+def download_history(client, symbol, interval, days, directory=HISTORY_DIR):
+    """
+    Догружает историю пары за days дней страницами по 1000 свечей (от новых
+    к старым) и дописывает её в локальный архив. Возвращает Candles.
+    """
+    now = int(time.time() * 1000)
+    since = now - days * 86400 * 1000
+    stored = load_history(symbol, interval, directory)
+    known_from = stored.timestamp[0] if stored is not None and len(stored) else None
+    known_to = stored.timestamp[-1] if stored is not None and len(stored) else None
+    pages = []
+    end = now
+    while end > since:
+        response = client.get_kline(symbol, interval=interval, limit=1000, end=end)
+        if not response or not response.get("result") or not response["result"]["list"]:
+            break
+        page = parse_kline(response["result"]["list"])
+        pages.append(page.data)
+        oldest = page.timestamp[0]
+        # Всё более старое уже есть в архиве
+        if known_to is not None and oldest <= known_to and known_from <= since:
+            break
+        end = int(oldest) - 1
+    parts = pages[::-1] + ([stored.data] if stored is not None else [])
+    if not parts:
+        return stored
+    data = np.concatenate(parts, axis=1)
+    data = data[:, data[0] >= since]
+    # Свечи без дублей, по времени (последняя незакрытая свеча отбрасывается)
+    _, unique = np.unique(data[0], return_index=True)
+    data = data[:, unique]
+    data = data[:, data[0] + interval_ms(interval) <= now]
+    candles = Candles(np.ascontiguousarray(data))
+    save_history(symbol, interval, candles, directory)
+    logging.info(f"📥 {symbol}: {len(candles)} свечей {interval} в архиве")
+    return candles
+
+
+# --- Симуляция ---
+def trade_sides(indicators, params):
+    """Направление сигнала на каждой свече: 1 — BUY, -1 — SELL, 0 — HOLD."""
+    signals, _ = generate_trade_signals(indicators, params)
+    return np.where(signals == "BUY", 1, np.where(signals == "SELL", -1, 0))
+
+
+def find_exit(candles, entry, side, entry_price, trailing_stop, take_profit):
+    """
+    Первая свеча после entry, на которой срабатывает трейлинг-стоп или
+    тейк-профит. Внутри свечи при касании обоих уровней считается стоп
+    (консервативно); при гэпе исполнение по цене открытия.
+    Возвращает (индекс, цена выхода); если выхода нет — последняя свеча.
+    """
+    high, low, opens = candles.high, candles.low, candles.open
+    bars = len(candles)
+    extreme = entry_price
+    start = entry + 1
+    while start < bars:
+        stop = min(start + EXIT_CHUNK, bars)
+        if side > 0:
+            peak = np.maximum.accumulate(np.concatenate(([extreme], high[start:stop])))[:-1]
+            stop_level = peak * (1 - trailing_stop)
+            target = entry_price * (1 + take_profit)
+            hit_stop = low[start:stop] <= stop_level
+            hit_target = high[start:stop] >= target
+        else:
+            peak = np.minimum.accumulate(np.concatenate(([extreme], low[start:stop])))[:-1]
+            stop_level = peak * (1 + trailing_stop)
+            target = entry_price * (1 - take_profit)
+            hit_stop = high[start:stop] >= stop_level
+            hit_target = low[start:stop] <= target
+        hit = hit_stop | hit_target
+        if hit.any():
+            k = int(hit.argmax())
+            i = start + k
+            if hit_stop[k]:
+                price = min(stop_level[k], opens[i]) if side > 0 else max(stop_level[k], opens[i])
+            else:
+                price = max(target, opens[i]) if side > 0 else min(target, opens[i])
+            return i, price
+        extreme = max(extreme, high[start:stop].max()) if side > 0 else min(extreme, low[start:stop].min())
+        start = stop
+    return bars - 1, candles.close[-1]
+
+
+def simulate(candles, indicators, params=None, fee=BACKTEST_FEE):
+    """
+    Прогоняет стратегию бота по истории: вход по закрытию свечи с сигналом,
+    выход по трейлинг-стопу/тейк-профиту, одна позиция на пару, без доливок.
+    Возвращает словарь массивов сделок: entry, exit (индексы свечей),
+    side и ret (доходность сделки на вложенный объём с учётом комиссий).
+    """
+    params = DEFAULT_PARAMS if params is None else {**DEFAULT_PARAMS, **params}
+    sides = trade_sides(indicators, params)
+    candidates = np.flatnonzero(sides)
+    close = candles.close
+    entries, exits, trade_side, returns = [], [], [], []
+    position = 0
+    while position < len(candidates):
+        entry = int(candidates[position])
+        side = int(sides[entry])
+        entry_price = close[entry]
+        exit_index, exit_price = find_exit(
+            candles, entry, side, entry_price, params["trailing_stop"], params["take_profit"]
+        )
+        entries.append(entry)
+        exits.append(exit_index)
+        trade_side.append(side)
+        returns.append(side * (exit_price / entry_price - 1) - 2 * fee)
+        # После закрытия пара снова оценивается на закрытии той же свечи
+        position = int(np.searchsorted(candidates, max(exit_index, entry + 1)))
+    return {
+        "entry": np.array(entries, dtype=np.int64),
+        "exit": np.array(exits, dtype=np.int64),
+        "side": np.array(trade_side, dtype=np.int8),
+        "ret": np.array(returns, dtype=np.float64),
+    }
+
+
+def max_drawdown(returns):
+    """Максимальная просадка кривой накопленного PnL (в долях объёма сделки)."""
+    if not len(returns):
+        return 0.0
+    equity = np.concatenate(([0.0], np.cumsum(returns)))
+    return float((np.maximum.accumulate(equity) - equity).max())
+
+
+def summarize(returns):
+    returns = np.asarray(returns, dtype=np.float64)
+    return {
+        "trades": int(len(returns)),
+        "pnl": float(returns.sum()),
+        "win_rate": float((returns > 0).mean()) if len(returns) else 0.0,
+        "max_drawdown": max_drawdown(returns),
+    }
+
+
+def run_backtest(symbol, interval, params=None, directory=HISTORY_DIR):
+    """Бэктест одной пары на локальной истории; возвращает (сделки, сводка)."""
+    candles = load_history(symbol, interval, directory)
+    if candles is None or not len(candles):
+        raise FileNotFoundError(f"нет истории {symbol} {interval}, сначала download")
+    trades = simulate(candles, compute_indicators(candles), params)
+    return trades, summarize(trades["ret"])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="История свечей и бэктест стратегии бота")
+    parser.add_argument("command", choices=("download", "run"))
+    parser.add_argument("pairs", nargs="+")
+    parser.add_argument("--interval", default="1")
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    if args.command == "download":
+        from bybit_client import BybitAPI
+
+        client = BybitAPI()
+        for pair in args.pairs:
+            download_history(client, pair, args.interval, args.days)
+    else:
+        for pair in args.pairs:
+            _, summary = run_backtest(pair, args.interval)
+            print(
+                f"{pair}: сделок {summary['trades']}, PnL {summary['pnl'] * 100:+.2f}%, "
+                f"побед {summary['win_rate'] * 100:.1f}%, просадка {summary['max_drawdown'] * 100:.2f}%"
+            )
@@ -1,7 +1,24 @@
 import logging
 import time
+from decimal import Decimal
 from pybit.unified_trading import HTTP
-from config import BYBIT_API_KEY, BYBIT_API_SECRET, USE_TESTNET, TRADE_INTERVAL
+from universe import is_tradable_symbol
+from capture import recording_session, get_recorder
+from request_layer import RequestLayer, BybitError, DuplicateOrderError, new_order_link_id
+from config import (
+    BYBIT_API_KEY,
+    BYBIT_API_SECRET,
+    USE_TESTNET,
+    TRADE_INTERVAL,
+    REQUEST_TIMEOUT,
+    HEDGE_DELAY,
+)
+
+
+def floor_to_step(value, step):
+    """Округляет вниз до шага биржи (basePrecision, tickSize) и возвращает строку для API."""
+    step = Decimal(step)
+    return format((Decimal(str(value)) // step) * step, "f")
 
 
 class BybitAPI:
@@ -11,77 +28,232 @@ class BybitAPI:
             testnet=USE_TESTNET,
             api_key=BYBIT_API_KEY,
             api_secret=BYBIT_API_SECRET,
+            timeout=REQUEST_TIMEOUT,
+        )
+        # В режиме записи (CAPTURE_FILE) все ответы биржи журналируются
+        self.session = recording_session(self.session)
+        # Дублирующие запросы портят порядок записи, поэтому при записи они выключены
+        self.requests = RequestLayer(hedge_delay=HEDGE_DELAY if get_recorder() is None else None)
+        # Правила инструментов (шаги количества и цены, минимумы) — меняются редко
+        self.instruments = {}
+
+    def _read(self, endpoint, error_message, hedge=False, **params):
+        """Идемпотентный запрос с повторами; при окончательной ошибке пишет лог и возвращает None."""
+        try:
+            return self.requests.call(
+                endpoint, getattr(self.session, endpoint), hedge=hedge, **params
+            )
+        except BybitError as e:
+            logging.error(f"{error_message}: {e}")
+            return None
+
+    def get_instrument(self, symbol):
+        """
+        Правила спотовой пары: basePrecision, tickSize, minOrderQty, minOrderAmt.
+        Запрашиваются один раз и кэшируются; None, если биржа недоступна.
+        """
+        rules = self.instruments.get(symbol)
+        if rules is not None:
+            return rules
+        response = self._read(
+            "get_instruments_info",
+            f"Ошибка получения параметров {symbol}",
+            category="spot",
+            symbol=symbol,
         )
+        items = response["result"]["list"] if response else []
+        if not items:
+            return None
+        lot, price = items[0]["lotSizeFilter"], items[0]["priceFilter"]
+        rules = self.instruments[symbol] = {
+            "base_precision": lot["basePrecision"],
+            "tick_size": price["tickSize"],
+            "min_qty": float(lot["minOrderQty"]),
+            "min_amount": float(lot["minOrderAmt"]),
+        }
+        return rules
 
-    def create_order(self, symbol, side, order_size, price=None, order_link_id=None):
-        """Создает ордер на Bybit Spot через Unified API v5 c использованием pybit."""
+    def create_order(
+        self,
+        symbol,
+        side,
+        order_size,
+        price=None,
+        order_link_id=None,
+        time_in_force="GTC",
+        base_qty=False,
+    ):
+        """
+        Создает ордер на Bybit Spot через Unified API v5 c использованием pybit.
+        Рыночная покупка задаётся в USDT (order_size), продажа и base_qty=True —
+        в количестве токена.
+        Для лимитного ордера time_in_force="PostOnly" гарантирует роль мейкера.
+        Количество и цена округляются вниз до шагов инструмента: лишние знаки
+        биржа отклоняет (170137); ордер меньше минимума пары не отправляется.
+        Каждый ордер получает orderLinkId, поэтому повтор после сетевого сбоя
+        не создаёт дубль: если первая попытка дошла до биржи, возвращается она.
+        """
+        rules = self.get_instrument(symbol)
+        if rules is None:
+            logging.error(f"❌ {symbol}: нет параметров инструмента, ордер не отправлен")
+            return None
         params = {
             "category": "spot",
             "symbol": symbol,
             "side": side,
+            "orderLinkId": order_link_id or new_order_link_id(),
         }
+        qty = order_size
         if price is None:
             params["orderType"] = "Market"
-            if side == "Buy":
+            # Количество рыночного ордера всегда в токене (по умолчанию Buy — в USDT)
+            params["marketUnit"] = "baseCoin"
+            if side == "Buy" and not base_qty:
                 # Получаем текущую цену, чтобы рассчитать количество токена, которое соответствует order_size (USDT)
-                kline = self.get_kline(symbol, interval=TRADE_INTERVAL, limit=1)
-                if kline and "result" in kline and kline["result"]["list"]:
-                    current_price = float(kline["result"]["list"][-1][4])
-                    # Рассчитываем количество токена с округлением (например, до 8 знаков)
-                    token_qty = round(order_size / current_price, 8)
-                    params["qty"] = str(token_qty)
-                else:
+                current_price = self.get_last_price(symbol)
+                if not current_price:
                     return None
+                qty = order_size / current_price
+                amount_price = current_price
             else:
-                params["qty"] = str(order_size)
+                amount_price = None
         else:
             params["orderType"] = "Limit"
-            params["price"] = str(price)
-            params["qty"] = str(order_size)
-            params["timeInForce"] = "GTC"
-            if order_link_id is not None:
-                params["orderLinkId"] = order_link_id
+            params["price"] = floor_to_step(price, rules["tick_size"])
+            params["timeInForce"] = time_in_force
+            amount_price = float(params["price"])
+        params["qty"] = floor_to_step(qty, rules["base_precision"])
+        qty = float(params["qty"])
+        if qty < rules["min_qty"] or (amount_price and qty * amount_price < rules["min_amount"]):
+            logging.error(
+                f"❌ {symbol}: ордер {params['qty']} меньше минимума пары "
+                f"({rules['min_qty']} токена / {rules['min_amount']} USDT)"
+            )
+            return None
 
         try:
-            response = self.session.place_order(**params)
-            logging.info(f"Ответ API при создании ордера: {response}")
+            response = self.requests.call("place_order", self.session.place_order, **params)
+        except DuplicateOrderError:
+            response = self.find_order(symbol, params["orderLinkId"])
+            logging.info(f"Ордер {params['orderLinkId']} уже создан предыдущей попыткой: {response}")
             return response
-        except Exception as e:
+        except BybitError as e:
             logging.error(f"Ошибка создания ордера: {e}")
             return None
+        logging.info(f"Ответ API при создании ордера: {response}")
+        return response
 
-    def get_usdt_balance(self):
+    def find_order(self, symbol, order_link_id):
+        """
+        Ищет ордер по orderLinkId среди открытых и в истории.
+        Возвращает ответ в формате place_order или None.
+        """
+        for endpoint in ("get_open_orders", "get_order_history"):
+            response = self._read(
+                endpoint,
+                f"Ошибка поиска ордера {order_link_id}",
+                category="spot",
+                symbol=symbol,
+                orderLinkId=order_link_id,
+            )
+            orders = response["result"]["list"] if response else []
+            if orders:
+                return {
+                    "retCode": 0,
+                    "retMsg": "OK",
+                    "result": {"orderId": orders[0]["orderId"], "orderLinkId": order_link_id},
+                }
+        return None
+
+    def get_order(self, symbol, order_id):
+        """
+        Текущее состояние ордера (orderStatus, cumExecQty, cumExecValue, avgPrice)
+        среди открытых и в истории или None.
+        """
+        for endpoint in ("get_open_orders", "get_order_history"):
+            response = self._read(
+                endpoint,
+                f"Ошибка получения ордера {order_id}",
+                category="spot",
+                symbol=symbol,
+                orderId=order_id,
+            )
+            orders = response["result"]["list"] if response else []
+            if orders:
+                return orders[0]
+        return None
+
+    def cancel_order(self, symbol, order_id):
+        """Отменяет ордер; None при ошибке (например, ордер уже исполнен)."""
         try:
-            response = self.session.get_wallet_balance(accountType="UNIFIED")
-        except Exception as e:
-            logging.error(f"Ошибка получения баланса: {e}")
-            return 0.0
-        coins = response["result"]["list"][0]["coin"]
+            return self.requests.call(
+                "cancel_order",
+                self.session.cancel_order,
+                category="spot",
+                symbol=symbol,
+                orderId=order_id,
+            )
+        except BybitError as e:
+            logging.error(f"Ошибка отмены ордера {order_id}: {e}")
+            return None
+
+    def get_usdt_balance(self):
+        """
+        Баланс USDT или None, если биржа недоступна: ошибка запроса не должна
+        выглядеть как нулевой баланс.
+        """
+        coins = self.get_wallet_coins()
+        if coins is None:
+            return None
         for coin in coins:
             if coin["coin"] == "USDT":
                 return float(coin["walletBalance"])
         return 0.0
 
-    def close_position(self, symbol, current_side, order_size):
+    def close_position(self, symbol, current_side, qty):
         """
-        Закрывает позицию на Bybit Spot.
+        Закрывает позицию на Bybit Spot рыночным ордером на qty токена.
         Если позиция Buy, закрытие происходит ордером Sell, и наоборот.
         """
         opposite_side = "Sell" if current_side == "Buy" else "Buy"
-        return self.create_order(symbol, opposite_side, order_size)
+        return self.create_order(symbol, opposite_side, qty, base_qty=True)
 
     def get_open_orders(self):
         """
         Получает открытые ордера по спотовой торговле через Unified API v5.
-        Здесь предполагается, что метод get_order_list существует и принимает параметр orderStatus.
         """
-        try:
-            response = self.session.get_order_list(category="spot", orderStatus="New")
+        response = self._read(
+            "get_open_orders", "Ошибка получения открытых ордеров", category="spot"
+        )
+        if response is not None:
             logging.info(f"Получены открытые ордера: {response}")
-            return response
-        except Exception as e:
-            logging.error(f"Ошибка получения открытых ордеров: {e}")
-            return None
+        return response
+
+    def get_executions(self, symbol=None, order_id=None, start_time=None, cursor=None, limit=100):
+        """
+        Получает историю исполнений (fills) через Unified API v5.
+        Возвращает result c полями list и nextPageCursor.
+        """
+        params = {"category": "spot", "limit": limit}
+        if symbol is not None:
+            params["symbol"] = symbol
+        if order_id is not None:
+            params["orderId"] = order_id
+        if start_time is not None:
+            params["startTime"] = start_time
+        if cursor:
+            params["cursor"] = cursor
+        response = self._read("get_executions", "Ошибка получения исполнений", **params)
+        return response["result"] if response else None
+
+    def get_wallet_coins(self):
+        """
+        Возвращает список монет Unified-счёта (coin, walletBalance, ...) или None при ошибке.
+        """
+        response = self._read(
+            "get_wallet_balance", "Ошибка получения баланса", accountType="UNIFIED"
+        )
+        return response["result"]["list"][0]["coin"] if response else None
 
     def get_wallet_balance(self, as_report=False):
         """
@@ -89,13 +261,9 @@ class BybitAPI:
         Если as_report=True, возвращается форматированный отчёт,
         иначе возвращается числовое значение общего баланса (USDT).
         """
-        try:
-            response = self.session.get_wallet_balance(accountType="UNIFIED")
-        except Exception as e:
-            logging.error(f"Ошибка получения баланса: {e}")
+        coins = self.get_wallet_coins()
+        if coins is None:
             return None
-
-        coins = response["result"]["list"][0]["coin"]
         total_balance = sum(float(coin["usdValue"]) for coin in coins)
 
         if as_report:
@@ -108,37 +276,56 @@ class BybitAPI:
         else:
             return total_balance
 
-    def get_kline(self, symbol, interval=TRADE_INTERVAL, limit=1000):
+    def get_kline(self, symbol, interval=TRADE_INTERVAL, limit=1000, hedge=False, end=None):
         """
         Получает исторические данные свечей через Unified API v5.
+        hedge=True дублирует медленный запрос (для чувствительных к задержке цен),
+        end (мс) — свечи до этого момента (для загрузки истории страницами).
         """
-        try:
-            response = self.session.get_kline(
-                category="spot", symbol=symbol, interval=interval, limit=str(limit)
-            )
-            return response
-        except Exception as e:
-            logging.error(f"Ошибка получения свечей для {symbol}: {e}")
-            return None
+        params = {"category": "spot", "symbol": symbol, "interval": interval, "limit": str(limit)}
+        if end is not None:
+            params["end"] = int(end)
+        return self._read(
+            "get_kline", f"Ошибка получения свечей для {symbol}", hedge=hedge, **params
+        )
+
+    def get_last_price(self, symbol):
+        """
+        Последняя цена пары (close текущей свечи) или None при ошибке.
+        """
+        kline = self.get_kline(symbol, interval=TRADE_INTERVAL, limit=1, hedge=True)
+        if kline and kline.get("result") and kline["result"]["list"]:
+            return float(kline["result"]["list"][-1][4])
+        return None
+
+    def get_orderbook(self, symbol, limit=50):
+        """
+        Получает снимок стакана L2 через Unified API v5.
+        """
+        response = self._read(
+            "get_orderbook",
+            f"Ошибка получения стакана для {symbol}",
+            hedge=True,
+            category="spot",
+            symbol=symbol,
+            limit=limit,
+        )
+        return response["result"] if response else None
 
     def get_trading_pairs(self, min_volume=100000):
         """
         Получает список торговых пар с Bybit Spot через Unified API v5.
         Фильтрует пары по объему и исключает пары со стейблкоинами.
         """
-        try:
-            response = self.session.get_tickers(category="spot")
-        except Exception as e:
-            logging.error(f"Ошибка получения тикеров: {e}")
+        response = self._read("get_tickers", "Ошибка получения тикеров", category="spot")
+        if response is None:
             return []
-        stablecoins = {"USDC", "BUSD", "DAI", "TUSD", "FDUSD", "EURS"}
-        pairs = []
-        for ticker in response["result"]["list"]:
-            symbol = ticker["symbol"]
-            volume = float(ticker["turnover24h"])
-            if "USDT" in symbol and not any(stable in symbol for stable in stablecoins):
-                if volume >= min_volume:
-                    pairs.append(symbol)
+        pairs = [
+            ticker["symbol"]
+            for ticker in response["result"]["list"]
+            if is_tradable_symbol(ticker["symbol"])
+            and float(ticker["turnover24h"]) >= min_volume
+        ]
         logging.info(f"✅ Найдено {len(pairs)} ликвидных пар")
         return pairs
 
@@ -146,36 +333,27 @@ class BybitAPI:
         """
         Получает список всех доступных торговых пар на Bybit Spot через Unified API v5.
         """
-        try:
-            response = self.session.get_instruments(category="spot")
-            pairs = [item["symbol"] for item in response["result"]["list"]]
-            return pairs
-        except Exception as e:
-            logging.error(f"Ошибка получения доступных пар: {e}")
-            return []
+        response = self._read(
+            "get_instruments_info", "Ошибка получения доступных пар", category="spot"
+        )
+        return [item["symbol"] for item in response["result"]["list"]] if response else []
 
     def get_spot_pairs(self):
         """
         Получает все доступные пары на Bybit Spot через Unified API v5 (тикеры).
         """
-        try:
-            response = self.session.get_tickers(category="spot")
-            return response["result"]["list"]
-        except Exception as e:
-            logging.error(f"Ошибка получения тикеров: {e}")
-            return []
+        response = self._read("get_tickers", "Ошибка получения тикеров", category="spot")
+        return response["result"]["list"] if response else []
 
     def get_asset_balance(self, asset):
         """
-        Возвращает баланс конкретного актива (например, BTC) из счета Unified Trading.
+        Возвращает баланс конкретного актива (например, BTC) из счета Unified Trading
+        или None, если баланс получить не удалось.
         """
-        try:
-            response = self.session.get_wallet_balance(accountType="UNIFIED")
-            coins = response["result"]["list"][0]["coin"]
-            for coin in coins:
-                if coin["coin"] == asset:
-                    return float(coin["walletBalance"])
-            return 0.0
-        except Exception as e:
-            logging.error(f"Ошибка получения баланса для {asset}: {e}")
-            return 0.0
+        coins = self.get_wallet_coins()
+        if coins is None:
+            return None
+        for coin in coins:
+            if coin["coin"] == asset:
+                return float(coin["walletBalance"])
+        return 0.0
@@ -0,0 +1,220 @@
+import fcntl
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import clock
+from candles import Candles, KLINE_FIELDS
+from config import CANDLE_STORE_CAPACITY, USE_TESTNET
+
+# Заголовок: [seq, count, capacity, reserved] (int64)
+HEADER_SIZE = 4
+FIELDS = len(KLINE_FIELDS)
+# Буферы testnet и mainnet не должны смешиваться
+STORE_PREFIX = "bbt_testnet" if USE_TESTNET else "bbt_mainnet"
+SHM_DIR = "/dev/shm"
+LOCK_DIR = SHM_DIR if os.path.isdir(SHM_DIR) else "/tmp"
+# Ожидание читателя при нечётном seq: попыток и пауза (растёт вдвое до максимума)
+READ_RETRIES = 100
+READ_BACKOFF = 0.00001
+READ_BACKOFF_MAX = 0.001
+
+
+def cleanup(prefix=STORE_PREFIX):
+    """Удаляет буферы и lock-файлы префикса (после остановки всех процессов)."""
+    for directory in {SHM_DIR, LOCK_DIR}:
+        if not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if name.startswith(prefix + "_"):
+                try:
+                    os.unlink(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+def interval_ms(interval):
+    """Длительность свечи Bybit в миллисекундах ("15", "60", "D", "W", "M")."""
+    minutes = {"D": 1440, "W": 10080, "M": 43200}.get(str(interval))
+    if minutes is None:
+        minutes = int(interval)
+    return minutes * 60 * 1000
+
+
+class CandleRing:
+    """
+    Кольцевой буфер свечей одной пары/интервала в shared memory.
+
+    Каждая свеча пишется дважды — в позиции i и i + capacity, поэтому последние
+    N свечей всегда лежат непрерывно и читаются как срез без копирования.
+    Читатели не берут блокировок: счётчик seq (seqlock) нечётный во время записи,
+    и по нему читатель проверяет, что данные не менялись. Писатели между собой
+    синхронизируются через flock; нечётный seq, оставленный упавшим писателем,
+    исправляется под той же блокировкой.
+    """
+
+    def __init__(self, symbol, interval, capacity=CANDLE_STORE_CAPACITY, prefix=STORE_PREFIX):
+        self.name = f"{prefix}_{symbol}_{interval}"
+        self.lock_path = os.path.join(LOCK_DIR, self.name + ".lock")
+        size = (HEADER_SIZE + FIELDS * 2 * capacity) * 8
+        # Создание и заголовок — под блокировкой писателей: подключившийся процесс
+        # не увидит буфер с ещё не записанной ёмкостью
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+                created = True
+            except FileExistsError:
+                self.shm = shared_memory.SharedMemory(name=self.name)
+                created = False
+            # Буфер живёт дольше процесса: не даём resource_tracker удалить его при выходе
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+            self.header = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=self.shm.buf)
+            # Нулевая ёмкость у существующего буфера — создатель упал до записи заголовка
+            if created or not self.header[2]:
+                self.header[:] = (0, 0, capacity, 0)
+            self.capacity = int(self.header[2])
+        self.data = np.ndarray(
+            (FIELDS, 2 * self.capacity),
+            dtype=np.float64,
+            buffer=self.shm.buf,
+            offset=HEADER_SIZE * 8,
+        )
+        if not created:
+            self.repair()
+
+    # --- Чтение ---
+    @property
+    def count(self):
+        return int(self.header[1])
+
+    @property
+    def seq(self):
+        return int(self.header[0])
+
+    def last_timestamp(self):
+        count = self.count
+        if not count:
+            return None
+        return float(self.data[0, (count - 1) % self.capacity])
+
+    def view(self, bars):
+        """
+        Возвращает (Candles-срез последних bars свечей без копирования, seq).
+        Срез остаётся валидным, пока changed_since(seq) == False.
+        """
+        seq = self._stable_seq()
+        count = self.count
+        bars = min(bars, count, self.capacity)
+        end = (count - 1) % self.capacity + 1 + self.capacity if count else self.capacity
+        return Candles(self.data[:, end - bars:end]), seq
+
+    def changed_since(self, seq):
+        return self.seq != seq
+
+    def snapshot(self, bars):
+        """Согласованная копия последних bars свечей."""
+        for _ in range(READ_RETRIES):
+            candles, seq = self.view(bars)
+            data = candles.data.copy()
+            if not self.changed_since(seq):
+                return Candles(data)
+        # Запись идёт непрерывно — читаем под блокировкой писателей
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            candles, _ = self.view(bars)
+            return Candles(candles.data.copy())
+
+    def _stable_seq(self):
+        """Ждёт чётного seq с ограниченным числом попыток и нарастающей паузой."""
+        delay = READ_BACKOFF
+        for _ in range(READ_RETRIES):
+            seq = self.seq
+            if seq % 2 == 0:
+                return seq
+            time.sleep(delay)
+            delay = min(delay * 2, READ_BACKOFF_MAX)
+        self.repair()
+        return self.seq
+
+    def repair(self):
+        """
+        Нечётный seq под блокировкой писателей означает, что писатель упал посреди
+        записи: последняя свеча могла остаться недописанной — отбрасываем её
+        (она догрузится с биржи) и закрываем запись.
+        """
+        if self.seq % 2 == 0:
+            return
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.seq % 2:
+                if self.count:
+                    self.header[1] = self.count - 1
+                self.header[0] += 1
+
+    # --- Запись ---
+    def _put(self, position, values):
+        self.data[:, position] = values
+        self.data[:, position + self.capacity] = values
+
+    def write(self, candles):
+        """Добавляет новые свечи и обновляет текущую (незакрытую) свечу."""
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            last = self.last_timestamp()
+            timestamps = candles.timestamp
+            start = 0 if last is None else int(np.searchsorted(timestamps, last))
+            self.header[0] += 1
+            try:
+                count = self.count
+                for i in range(start, len(timestamps)):
+                    if count and timestamps[i] == self.data[0, (count - 1) % self.capacity]:
+                        self._put((count - 1) % self.capacity, candles.data[:, i])
+                    else:
+                        self._put(count % self.capacity, candles.data[:, i])
+                        count += 1
+                self.header[1] = count
+            finally:
+                self.header[0] += 1
+
+    def missing_bars(self, interval, limit):
+        """Сколько свечей нужно догрузить с биржи, чтобы буфер стал актуальным."""
+        last = self.last_timestamp()
+        if last is None or self.count < min(limit, self.capacity):
+            return limit
+        behind = int((clock.now() * 1000 - last) // interval_ms(interval))
+        return min(limit, behind + 2)
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        """Удаляет буфер и его lock-файл из системы (после остановки всех процессов)."""
+        self.shm.unlink()
+        try:
+            os.unlink(self.lock_path)
+        except FileNotFoundError:
+            pass
+
+
+class CandleStore:
+    """Реестр кольцевых буферов (symbol, interval) текущего процесса."""
+
+    def __init__(self, capacity=CANDLE_STORE_CAPACITY, prefix=STORE_PREFIX):
+        self.capacity = capacity
+        self.prefix = prefix
+        self.rings = {}
+
+    def get(self, symbol, interval):
+        key = (symbol, str(interval))
+        ring = self.rings.get(key)
+        if ring is None:
+            ring = self.rings[key] = CandleRing(
+                symbol, interval, self.capacity, self.prefix
+            )
+        return ring
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
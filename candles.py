@@ -0,0 +1,91 @@
+import numpy as np
+
+# Порядок полей свечи в ответе Bybit get_kline
+KLINE_FIELDS = ("timestamp", "open", "high", "low", "close", "volume")
+
+
+class Candles:
+    """
+    Свечи пары в виде float64-массивов NumPy, упорядоченных по времени
+    (старые → новые). Все поля — строки одного непрерывного блока памяти.
+    """
+
+    __slots__ = ("data",) + KLINE_FIELDS
+
+    def __init__(self, data):
+        self.data = data
+        for index, name in enumerate(KLINE_FIELDS):
+            setattr(self, name, data[index])
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    def tail(self, count):
+        """Последние count свечей (срез без копирования)."""
+        return Candles(self.data[:, -count:])
+
+    def before(self, timestamp):
+        """Свечи, открывшиеся раньше timestamp (мс), — срез без копирования."""
+        return Candles(self.data[:, : int(np.searchsorted(self.timestamp, timestamp))])
+
+
+def parse_kline(raw_list):
+    """
+    Разбирает список строк Bybit (новые → старые) сразу в float64-массив
+    без DataFrame. Разворачивает порядок, чтобы индикаторы считались по времени.
+    """
+    if not raw_list:
+        return None
+    rows = np.array(raw_list, dtype=np.float64)
+    data = np.ascontiguousarray(rows[::-1, : len(KLINE_FIELDS)].T)
+    return Candles(data)
+
+
+def valid_candles(candles):
+    """Свечи пригодны для расчёта: значения конечны, время строго растёт, цены положительны."""
+    data = candles.data
+    return bool(
+        len(candles)
+        and np.isfinite(data).all()
+        and (np.diff(candles.timestamp) > 0).all()
+        and (data[1:5] > 0).all()
+    )
+
+
+def stack_candles(candles_list, bars, step=None):
+    """
+    Складывает свечи нескольких пар в один пакет: поля становятся матрицами
+    pairs × bars. С шагом step (мс) пары выравниваются по сетке времени,
+    заканчивающейся последней свечой пакета: пропущенные внутри истории свечи
+    заполняются плоской свечой по предыдущему закрытию с нулевым объёмом.
+    Без шага (месячные свечи неравной длины) — по позиции от последней свечи.
+    У пар с короткой историей слева NaN — индикаторы fast_indicators их пропускают.
+    """
+    data = np.full((len(KLINE_FIELDS), len(candles_list), bars), np.nan)
+    if step is None:
+        for row, candles in enumerate(candles_list):
+            count = min(len(candles), bars)
+            if count:
+                data[:, row, bars - count:] = candles.data[:, -count:]
+        return Candles(data)
+
+    start = max(candles.timestamp[-1] for candles in candles_list if len(candles)) - step * (bars - 1)
+    for row, candles in enumerate(candles_list):
+        offsets = (candles.timestamp - start) / step
+        columns = np.rint(offsets).astype(np.int64)
+        on_grid = (columns >= 0) & (columns < bars) & (np.abs(offsets - columns) < 1e-6)
+        data[:, row, columns[on_grid]] = candles.data[:, on_grid]
+
+    # Пропуски после первой свечи пары: индекс последней известной свечи слева
+    close = data[4]
+    known = ~np.isnan(close)
+    last_known = np.maximum.accumulate(np.where(known, np.arange(bars), -1), axis=1)
+    gaps = ~known & (last_known >= 0)
+    if gaps.any():
+        rows, columns = np.nonzero(gaps)
+        previous_close = close[rows, last_known[rows, columns]]
+        for field in range(1, 5):
+            data[field, rows, columns] = previous_close
+        data[5, rows, columns] = 0.0
+        data[0, rows, columns] = start + columns * step
+    return Candles(data)
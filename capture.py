@@ -0,0 +1,148 @@
+import gzip
+import json
+import os
+import threading
+import time
+from config import CAPTURE_FILE
+
+# Запись сессии бота (CAPTURE_FILE): интерфейс, через который её подключают
+# рабочие модули. Воспроизведение записи — отдельный модуль replay.
+
+# Файлы состояния, снимок которых пишется в начало записи сессии
+STATE_FILES = (
+    "active_orders.json",
+    "trade_pairs.json",
+    "pnl_ledger.json",
+    "reconcile_state.json",
+    "risk_state.json",
+)
+
+_recorder = None
+
+
+def _open(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Recorder:
+    """
+    Запись сессии бота в компактный JSONL (.gz — со сжатием): ответы биржи,
+    поток стакана, входящие апдейты Telegram, исходящие сообщения и длительности
+    этапов. Приватные потоки order/execution не пишутся.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = _open(path, "a")
+        state = {}
+        for name in STATE_FILES:
+            if os.path.exists(name):
+                with open(name, "r") as file:
+                    state[name] = file.read()
+        self.record("state", "files", files=state)
+
+    def record(self, kind, name, **fields):
+        event = {"t": time.time(), "kind": kind, "name": name}
+        event.update(fields)
+        line = json.dumps(event, ensure_ascii=False, separators=(",", ":"), default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def stage(self, name, started, **fields):
+        """Этап (trade_logic, итерация монитора, обработчик Telegram): started — perf_counter()."""
+        self.record("stage", name, dt=time.perf_counter() - started, **fields)
+
+
+def get_recorder():
+    """Глобальный рекордер; None, если запись выключена (CAPTURE_FILE = None)."""
+    global _recorder
+    if _recorder is None and CAPTURE_FILE:
+        _recorder = Recorder(CAPTURE_FILE)
+    return _recorder
+
+
+def set_recorder(recorder):
+    """Подключает свой рекордер (воспроизведение собирает им длительности этапов)."""
+    global _recorder
+    _recorder = recorder
+
+
+def record_stage(name, started, **fields):
+    recorder = get_recorder()
+    if recorder is not None:
+        recorder.stage(name, started, **fields)
+
+
+class RecordingSession:
+    """Прокси над pybit HTTP: каждый вызов пишется в запись вместе с ответом или ошибкой."""
+
+    def __init__(self, session, recorder):
+        self._session = session
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        method = getattr(self._session, name)
+        if not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            except Exception as e:
+                self._recorder.record(
+                    "exchange",
+                    name,
+                    args=kwargs,
+                    error=str(e),
+                    error_type=type(e).__name__,
+                    status_code=getattr(e, "status_code", None),
+                    dt=time.perf_counter() - started,
+                )
+                raise
+            self._recorder.record(
+                "exchange", name, args=kwargs, result=result, dt=time.perf_counter() - started
+            )
+            return result
+
+        return call
+
+
+def recording_session(session):
+    recorder = get_recorder()
+    return RecordingSession(session, recorder) if recorder else session
+
+
+def make_bot(token):
+    """Bot для бота; при включённой записи — с журналированием исходящих сообщений."""
+    from telegram import Bot
+
+    if get_recorder() is None:
+        return Bot(token)
+
+    class RecordingBot(Bot):
+        async def send_message(self, chat_id, text, *args, **kwargs):
+            get_recorder().record("telegram_out", "send_message", text=text)
+            return await super().send_message(chat_id, text, *args, **kwargs)
+
+    return RecordingBot(token)
+
+
+_update_started = {}
+
+
+async def record_update(update, context):
+    """Обработчик PTB (group=-1): пишет входящие апдейты."""
+    _update_started[update.update_id] = time.perf_counter()
+    get_recorder().record("telegram_in", "update", update=update.to_dict())
+
+
+async def record_update_done(update, context):
+    """Обработчик PTB (group=1): длительность обработки апдейта."""
+    started = _update_started.pop(update.update_id, None)
+    if started is not None:
+        record_stage("telegram", started)
@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+
+class Clock:
+    """
+    Источник времени бота: реальные часы. Воспроизведение записи подставляет
+    свои часы через set_clock, не подменяя модули time и asyncio глобально.
+    Задержки для замеров латентности (perf_counter) всегда реальные.
+    """
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    async def async_sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+
+_clock = Clock()
+
+
+def set_clock(source=None):
+    """Подключает часы (None — вернуть реальные)."""
+    global _clock
+    _clock = source if source is not None else Clock()
+
+
+def now():
+    return _clock.time()
+
+
+def monotonic():
+    return _clock.monotonic()
+
+
+def gmtime(secs=None):
+    return time.gmtime(_clock.time() if secs is None else secs)
+
+
+def sleep(seconds):
+    _clock.sleep(seconds)
+
+
+async def async_sleep(seconds):
+    await _clock.async_sleep(seconds)
@@ -0,0 +1,309 @@
+import asyncio
+import collections.abc
+import contextvars
+import functools
+import html
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, defaultdict
+from config import (
+    LOOP_LAG_INTERVAL,
+    LOOP_BLOCK_THRESHOLD,
+    PROFILE_SAMPLE_INTERVAL,
+    PROFILES_DIR,
+)
+
+# Метка текущей операции (обработчик Telegram и т.п.) для учёта CPU
+current_label = contextvars.ContextVar("diagnostics_label", default=None)
+
+DEFAULT_TASK_NAME = re.compile(r"^Task-\d+$")
+
+
+def task_label():
+    """Метка для учёта CPU: явная метка операции, иначе имя текущей задачи."""
+    label = current_label.get()
+    if label is None:
+        task = asyncio.current_task()
+        name = task.get_name() if task else "?"
+        label = "unnamed" if DEFAULT_TASK_NAME.match(name) else name
+    return label
+
+
+class LoopLagMonitor:
+    """
+    Измеряет задержку event loop: корутина просыпается каждые interval секунд,
+    опоздание и есть лаг. Отдельный поток-сторож при зависании цикла дольше
+    threshold пишет в лог стек блокирующего кода.
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, threshold=LOOP_BLOCK_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.avg_lag = 0.0
+        self.blocks = 0
+        self.heartbeat = time.monotonic()
+        self.loop_thread_id = None
+        self.task = None
+        self.stopped = threading.Event()
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.heartbeat = now
+            lag = max(0.0, now - expected)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.avg_lag = self.avg_lag * 0.95 + lag * 0.05
+
+    def _watchdog(self):
+        reported = None
+        while not self.stopped.wait(self.threshold / 2):
+            stalled = time.monotonic() - self.heartbeat - self.interval
+            if stalled < self.threshold:
+                reported = None
+                continue
+            if reported == self.heartbeat:
+                continue
+            reported = self.heartbeat
+            self.blocks += 1
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "стек недоступен"
+            logging.warning(f"🐢 Event loop заблокирован > {stalled:.3f} с:\n{stack}")
+
+    def start(self):
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.task = asyncio.get_running_loop().create_task(self._run(), name="diagnostics:lag")
+        threading.Thread(target=self._watchdog, name="diagnostics-watchdog", daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.task:
+            self.task.cancel()
+
+
+class _TimedCoroutine(collections.abc.Coroutine):
+    """Обёртка корутины задачи: замеряет CPU каждого шага и относит его к имени задачи."""
+
+    __slots__ = ("_coro", "_stats")
+
+    def __init__(self, coro, stats):
+        self._coro = coro
+        self._stats = stats
+
+    def _step(self, method, *args):
+        label = current_label.get()
+        started = time.thread_time()
+        try:
+            return method(*args)
+        finally:
+            elapsed = time.thread_time() - started
+            self._stats.add(label or task_label(), elapsed)
+
+    def send(self, value):
+        return self._step(self._coro.send, value)
+
+    def __next__(self):
+        return self._step(self._coro.send, None)
+
+    def __iter__(self):
+        return self
+
+    def throw(self, *args):
+        return self._step(self._coro.throw, *args)
+
+    def close(self):
+        return self._coro.close()
+
+    def __await__(self):
+        return self
+
+    def __repr__(self):
+        return repr(self._coro)
+
+
+class TaskCpuStats:
+    """CPU-время по именованным задачам (scan, monitor:PAIR, tg:...)."""
+
+    def __init__(self):
+        self.cpu = defaultdict(float)
+        self.steps = Counter()
+        # add вызывается и из потоков to_thread
+        self.lock = threading.Lock()
+
+    def add(self, label, elapsed):
+        with self.lock:
+            self.cpu[label] += elapsed
+            self.steps[label] += 1
+
+    def install(self, loop):
+        """Ставит фабрику задач, оборачивающую корутины для учёта CPU."""
+        previous = loop.get_task_factory()
+
+        def factory(loop, coro, **kwargs):
+            if asyncio.iscoroutine(coro) and not isinstance(coro, _TimedCoroutine):
+                coro = _TimedCoroutine(coro, self)
+            if previous is not None:
+                return previous(loop, coro, **kwargs)
+            return asyncio.Task(coro, loop=loop, **kwargs)
+
+        loop.set_task_factory(factory)
+
+    def top(self, count=15):
+        return sorted(self.cpu.items(), key=lambda item: item[1], reverse=True)[:count]
+
+
+def labelled(name, func):
+    """Оборачивает обработчик: его CPU учитывается под меткой name."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = current_label.set(name)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            current_label.reset(token)
+
+    return wrapper
+
+
+async def to_thread(func, *args, **kwargs):
+    """
+    asyncio.to_thread с учётом CPU: время потока замеряется внутри него и
+    относится к метке вызывающей задачи (thread_time цикла его не видит).
+    """
+    label = task_label()
+
+    def run():
+        started = time.thread_time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            task_stats.add(label, time.thread_time() - started)
+
+    return await asyncio.to_thread(run)
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий профайлер: раз в interval снимает стеки всех потоков
+    и сохраняет их в формате folded (flamegraph.pl) и готовый SVG.
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+
+    def run(self, seconds):
+        own = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+        return self.samples
+
+    def write(self, directory=PROFILES_DIR):
+        """Пишет .folded и .svg; возвращает путь к SVG."""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, time.strftime("profile-%Y%m%d-%H%M%S"))
+        with open(base + ".folded", "w") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+        with open(base + ".svg", "w") as file:
+            file.write(render_flamegraph(self.samples))
+        return base + ".svg"
+
+
+def render_flamegraph(samples, width=1200, row_height=16):
+    """Минимальный рендер flame graph в SVG из свёрнутых стеков."""
+    root = {"count": 0, "children": {}}
+    for stack, count in samples.items():
+        node = root
+        node["count"] += count
+        for frame in stack.split(";"):
+            node = node["children"].setdefault(frame, {"count": 0, "children": {}})
+            node["count"] += count
+    total = root["count"] or 1
+    rects = []
+    depth_max = [0]
+
+    def layout(node, x, depth):
+        depth_max[0] = max(depth_max[0], depth)
+        for name, child in sorted(node["children"].items()):
+            w = child["count"] / total * width
+            if w >= 0.5:
+                rects.append((x, depth, w, name, child["count"]))
+                layout(child, x, depth + 1)
+            x += w
+
+    layout(root, 0.0, 0)
+    height = (depth_max[0] + 1) * row_height
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">'
+    ]
+    for x, depth, w, name, count in rects:
+        y = height - (depth + 1) * row_height
+        hue = (hash(name) % 40) + 10
+        label = html.escape(name)
+        parts.append(
+            f'<g><title>{label} ({count} samples, {count / total:.1%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row_height - 1}" fill="hsl({hue},90%,60%)"/>'
+        )
+        if w > 40:
+            text = html.escape(name[: int(w / 7)])
+            parts.append(f'<text x="{x + 2:.1f}" y="{y + row_height - 4}">{text}</text>')
+        parts.append("</g>")
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+lag_monitor = LoopLagMonitor()
+task_stats = TaskCpuStats()
+
+
+def start():
+    """Включает диагностику в текущем event loop (вызывать из корутины)."""
+    task_stats.install(asyncio.get_running_loop())
+    lag_monitor.start()
+
+
+async def profile(seconds):
+    """Профилирует процесс seconds секунд; возвращает путь к SVG flame graph."""
+    profiler = SamplingProfiler()
+    await asyncio.to_thread(profiler.run, seconds)
+    return profiler.write()
+
+
+def report():
+    """Текстовый отчёт: лаг event loop и CPU по задачам."""
+    lines = [
+        "🩺 Диагностика",
+        f"Лаг loop: сейчас {lag_monitor.last_lag * 1000:.1f} мс, "
+        f"средний {lag_monitor.avg_lag * 1000:.1f} мс, макс {lag_monitor.max_lag * 1000:.1f} мс",
+        f"Блокировок > {lag_monitor.threshold * 1000:.0f} мс: {lag_monitor.blocks}",
+        "CPU по задачам:",
+    ]
+    for label, cpu in task_stats.top():
+        lines.append(f"• {label}: {cpu:.3f} с ({task_stats.steps[label]} шагов)")
+    return "\n".join(lines)
@@ -0,0 +1,47 @@
+import asyncio
+import time
+from collections import deque
+
+# Сколько последних событий отдавать новому подписчику
+HISTORY_SIZE = 100
+# Очередь медленного подписчика: при переполнении старые события выбрасываются
+QUEUE_SIZE = 1000
+
+
+class EventBus:
+    """
+    Шина событий бота (сигналы, открытие/закрытие позиций, старт/стоп).
+    publish вызывается из event loop; подписчики (SSE-клиенты API)
+    получают события через свою asyncio.Queue.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.sequence = 0
+
+    def publish(self, kind, **data):
+        self.sequence += 1
+        event = {"id": self.sequence, "type": kind, "time": time.time(), "data": data}
+        self.history.append(event)
+        for queue in self.subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+        return event
+
+    def subscribe(self, last_id=None):
+        """Новая очередь подписчика; с last_id — сначала пропущенные события из истории."""
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        if last_id is not None:
+            for event in self.history:
+                if event["id"] > last_id:
+                    queue.put_nowait(event)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+
+event_bus = EventBus()
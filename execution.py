@@ -0,0 +1,329 @@
+import logging
+import threading
+import clock
+from capture import get_recorder
+from reconciliation import TERMINAL_STATUSES
+from config import (
+    USE_TESTNET,
+    EXECUTION_IMPACT_BUDGET,
+    EXECUTION_MAX_SLICES,
+    EXECUTION_SLICE_DELAY,
+    EXECUTION_FILL_TIMEOUT,
+    EXECUTION_POST_ONLY_TIMEOUT,
+    EXECUTION_FILL_POLL,
+    ORDERBOOK_DEPTH,
+    ORDERBOOK_USE_WEBSOCKET,
+)
+
+# Снимок стакана старше этого считается устаревшим (секунды)
+ORDERBOOK_MAX_AGE = 5
+
+
+class OrderBook:
+    """Локальный L2-стакан одной пары: снимок + инкрементальные дельты."""
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.bids = {}
+        self.asks = {}
+        self.update_id = 0
+        self.updated_at = 0.0
+        self.lock = threading.Lock()
+
+    def apply_snapshot(self, data):
+        with self.lock:
+            self.bids = {float(p): float(s) for p, s in data.get("b", [])}
+            self.asks = {float(p): float(s) for p, s in data.get("a", [])}
+            self.update_id = data.get("u", 0)
+            self.updated_at = clock.now()
+
+    def apply_delta(self, data):
+        """Применяет дельту: нулевой объём удаляет уровень."""
+        with self.lock:
+            for levels, updates in ((self.bids, data.get("b", [])), (self.asks, data.get("a", []))):
+                for price, size in updates:
+                    price, size = float(price), float(size)
+                    if size == 0:
+                        levels.pop(price, None)
+                    else:
+                        levels[price] = size
+            self.update_id = data.get("u", self.update_id)
+            self.updated_at = clock.now()
+
+    def is_fresh(self):
+        return bool(self.bids and self.asks) and clock.now() - self.updated_at < ORDERBOOK_MAX_AGE
+
+    def top(self):
+        """Возвращает (best_bid, best_ask)."""
+        with self.lock:
+            if not self.bids or not self.asks:
+                return None, None
+            return max(self.bids), min(self.asks)
+
+    def estimate_fill(self, side, quote_amount):
+        """
+        Проходит по уровням стакана и оценивает исполнение рыночного ордера
+        на quote_amount USDT. Возвращает (средняя цена, кол-во токена, исполнено USDT).
+        """
+        with self.lock:
+            if side == "Buy":
+                levels = sorted(self.asks.items())
+            else:
+                levels = sorted(self.bids.items(), reverse=True)
+        remaining = quote_amount
+        qty = 0.0
+        for price, size in levels:
+            level_quote = price * size
+            if level_quote >= remaining:
+                qty += remaining / price
+                remaining = 0
+                break
+            qty += size
+            remaining -= level_quote
+        filled = quote_amount - remaining
+        if qty == 0:
+            return None, 0.0, 0.0
+        return filled / qty, qty, filled
+
+
+class OrderBookFeed:
+    """Держит локальные стаканы торгуемых пар по WebSocket с откатом на REST."""
+
+    def __init__(self, client, depth=ORDERBOOK_DEPTH, use_websocket=ORDERBOOK_USE_WEBSOCKET):
+        self.client = client
+        self.depth = depth
+        self.use_websocket = use_websocket
+        self.books = {}
+        self.ws = None
+
+    def _on_message(self, message):
+        recorder = get_recorder()
+        if recorder is not None:
+            recorder.record("stream", "orderbook", message=message)
+        data = message.get("data", {})
+        book = self.books.get(data.get("s"))
+        if book is None:
+            return
+        if message.get("type") == "snapshot":
+            book.apply_snapshot(data)
+        else:
+            book.apply_delta(data)
+
+    def subscribe(self, symbol):
+        if symbol in self.books:
+            return self.books[symbol]
+        book = OrderBook(symbol)
+        self.books[symbol] = book
+        if self.use_websocket:
+            try:
+                if self.ws is None:
+                    from pybit.unified_trading import WebSocket
+
+                    self.ws = WebSocket(testnet=USE_TESTNET, channel_type="spot")
+                self.ws.orderbook_stream(self.depth, symbol, self._on_message)
+            except Exception as e:
+                logging.error(f"Ошибка подписки на стакан {symbol}: {e}")
+        return book
+
+    def get_book(self, symbol):
+        """Возвращает актуальный стакан; если поток молчит — берёт снимок по REST."""
+        book = self.subscribe(symbol)
+        if not book.is_fresh():
+            snapshot = self.client.get_orderbook(symbol, limit=self.depth)
+            if snapshot:
+                book.apply_snapshot(snapshot)
+        return book
+
+
+class ExecutionEngine:
+    """
+    Выбирает способ исполнения по оценке проскальзывания:
+    рыночный ордер, нарезка на части или post-only лимит по лучшей цене.
+    """
+
+    def __init__(
+        self,
+        client,
+        feed=None,
+        impact_budget=EXECUTION_IMPACT_BUDGET,
+        max_slices=EXECUTION_MAX_SLICES,
+        slice_delay=EXECUTION_SLICE_DELAY,
+    ):
+        self.client = client
+        self.feed = feed or OrderBookFeed(client)
+        self.impact_budget = impact_budget
+        self.max_slices = max_slices
+        self.slice_delay = slice_delay
+
+    def plan(self, symbol, side, order_size):
+        """Строит план исполнения ордера на order_size USDT."""
+        book = self.feed.get_book(symbol)
+        best_bid, best_ask = book.top()
+        if best_bid is None:
+            return {"strategy": "market", "slices": 1, "mid": None, "est_price": None, "est_slippage": None}
+        mid = (best_bid + best_ask) / 2
+        half_spread = (best_ask - best_bid) / 2 / mid
+
+        def slippage_for(amount):
+            price, _, filled = book.estimate_fill(side, amount)
+            if price is None or filled < amount:
+                return None, None
+            return price, abs(price - mid) / mid
+
+        est_price, est_slippage = slippage_for(order_size)
+        plan = {"mid": mid, "est_price": est_price, "est_slippage": est_slippage}
+        if est_slippage is not None and est_slippage <= self.impact_budget:
+            plan.update(strategy="market", slices=1)
+            return plan
+        if half_spread < self.impact_budget:
+            for slices in range(2, self.max_slices + 1):
+                price, slippage = slippage_for(order_size / slices)
+                if slippage is not None and slippage <= self.impact_budget:
+                    plan.update(strategy="sliced", slices=slices, est_price=price, est_slippage=slippage)
+                    return plan
+        # Даже минимальная часть дороже бюджета — встаём в стакан мейкером
+        plan.update(
+            strategy="post_only",
+            slices=1,
+            limit_price=best_bid if side == "Buy" else best_ask,
+            est_price=best_bid if side == "Buy" else best_ask,
+            est_slippage=0.0,
+        )
+        return plan
+
+    def _market(self, symbol, side, order_size, price):
+        if side == "Buy":
+            return self.client.create_order(symbol, side, order_size)
+        return self.client.create_order(symbol, side, round(order_size / price, 8))
+
+    def _wait_order(self, symbol, order_id, timeout):
+        """Опрашивает ордер, пока он не перейдёт в финальный статус или не выйдет timeout."""
+        deadline = clock.now() + timeout
+        while True:
+            order = self.client.get_order(symbol, order_id)
+            if order and order.get("orderStatus") in TERMINAL_STATUSES:
+                return order
+            if clock.now() >= deadline:
+                return order
+            clock.sleep(EXECUTION_FILL_POLL)
+
+    def _executed_from_fills(self, symbol, order_id):
+        """Исполнение ордера по списку сделок (если состояние ордера прочитать не удалось)."""
+        result = self.client.get_executions(symbol, order_id)
+        if not result:
+            return None
+        executions = result.get("list", [])
+        return {
+            "cumExecQty": sum(float(e["execQty"]) for e in executions),
+            "cumExecValue": sum(float(e["execQty"]) * float(e["execPrice"]) for e in executions),
+        }
+
+    def settle(self, symbol, response, timeout):
+        """
+        Дожидается исполнения ордера и возвращает (кол-во токена, объём USDT).
+        Неисполненный за timeout остаток снимается с книги.
+        """
+        order_id = response.get("result", {}).get("orderId")
+        if not order_id:
+            return 0.0, 0.0
+        order = self._wait_order(symbol, order_id, timeout)
+        if order is None or order.get("orderStatus") not in TERMINAL_STATUSES:
+            logging.info(f"{symbol}: ордер {order_id} не исполнен полностью, снимаем остаток")
+            self.client.cancel_order(symbol, order_id)
+            order = self._wait_order(symbol, order_id, EXECUTION_FILL_TIMEOUT) or order
+        if order is None:
+            order = self._executed_from_fills(symbol, order_id)
+        if order is None:
+            logging.error(f"❌ {symbol}: не удалось узнать исполнение ордера {order_id}")
+            return 0.0, 0.0
+        qty = float(order.get("cumExecQty") or 0)
+        quote = float(order.get("cumExecValue") or 0)
+        if qty and not quote:
+            quote = qty * float(order.get("avgPrice") or 0)
+        return qty, quote
+
+    def execute(self, symbol, side, order_size, fallback_price=None):
+        """
+        Исполняет ордер на order_size USDT по плану.
+        Возвращает (ответ API последнего исполненного ордера или None, отчёт).
+        В отчёте — фактически исполненные кол-во и объём по состоянию ордеров,
+        а не отправленные: post-only остаток отменяется, упавшая часть нарезки
+        не отменяет уже исполненные.
+        """
+        started = clock.now()
+        plan = self.plan(symbol, side, order_size)
+        price = plan["est_price"] or plan["mid"] or fallback_price
+        orders = []
+        if plan["strategy"] == "post_only":
+            limit_price = plan["limit_price"]
+            response = self.client.create_order(
+                symbol,
+                side,
+                round(order_size / limit_price, 8),
+                price=limit_price,
+                time_in_force="PostOnly",
+            )
+            orders.append((response, EXECUTION_POST_ONLY_TIMEOUT))
+        elif price is None and side == "Sell":
+            logging.error(f"❌ {symbol}: нет цены для расчёта объёма продажи")
+        else:
+            slice_size = round(order_size / plan["slices"], 2)
+            for index in range(plan["slices"]):
+                response = self._market(symbol, side, slice_size, price)
+                orders.append((response, EXECUTION_FILL_TIMEOUT))
+                if not response:
+                    break
+                if index + 1 < plan["slices"]:
+                    clock.sleep(self.slice_delay)
+
+        filled_qty = filled_quote = 0.0
+        filled_ids = []
+        last_filled = None
+        for response, timeout in orders:
+            if not response:
+                continue
+            qty, quote = self.settle(symbol, response, timeout)
+            if qty > 0:
+                filled_qty += qty
+                filled_quote += quote
+                filled_ids.append(response.get("result", {}).get("orderId"))
+                last_filled = response
+        avg_price = filled_quote / filled_qty if filled_qty else None
+        slippage = None
+        if avg_price and plan["mid"]:
+            # Со знаком: > 0 — исполнено хуже mid
+            direction = 1 if side == "Buy" else -1
+            slippage = direction * (avg_price - plan["mid"]) / plan["mid"]
+        report = {
+            "symbol": symbol,
+            "side": side,
+            "order_size": order_size,
+            "strategy": plan["strategy"],
+            "slices": plan["slices"],
+            "sent": sum(1 for response, _ in orders if response),
+            "order_ids": filled_ids,
+            "filled_qty": filled_qty,
+            "filled_quote": round(filled_quote, 8),
+            "avg_price": avg_price,
+            "mid": plan["mid"],
+            "est_price": plan["est_price"],
+            "est_slippage": plan["est_slippage"],
+            "slippage": slippage,
+            "latency": clock.now() - started,
+        }
+        logging.info(f"Исполнение {symbol}: {report}")
+        return last_filled, report
+
+
+def format_execution_report(report):
+    """Короткая строка об исполнении для Telegram."""
+    line = f"⚙️ Исполнение: {report['strategy']}"
+    if report["slices"] > 1:
+        line += f" ({report['sent']}/{report['slices']} частей)"
+    if report["filled_quote"] < report["order_size"] * 0.999:
+        line += f", исполнено {report['filled_quote']:.2f} из {report['order_size']} USDT"
+    if report["slippage"] is not None:
+        line += f", проскальзывание {report['slippage'] * 100:.3f}%"
+    if report["est_slippage"] is not None:
+        line += f" (оценка {report['est_slippage'] * 100:.3f}%)"
+    return line
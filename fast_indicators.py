@@ -0,0 +1,289 @@
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Индикаторы на массивах NumPy. Формулы повторяют библиотеку ta (0.10),
+# чтобы сигналы не изменились при переходе с pandas.
+# Все функции считают по последней оси: одна пара — вектор (bars,),
+# пакет пар — матрица (pairs × bars), выровненная по последней свече,
+# где у пар с короткой историей слева стоят NaN.
+
+
+def history_start(values):
+    """Индекс первой свечи с данными (NaN бывают только слева); bars, если данных нет."""
+    missing = np.isnan(values)
+    return np.where(missing.all(axis=-1), values.shape[-1], missing.argmin(axis=-1))
+
+
+def warmup_mask(values, periods, start=None):
+    """Свечи, к которым у пары накоплено меньше periods значений."""
+    start = history_start(values) if start is None else start
+    return np.arange(values.shape[-1]) < np.expand_dims(start + periods - 1, -1)
+
+
+def _rolling_mean(filled, window):
+    """Среднее по окну для свечей window-1.. (без NaN на входе)."""
+    cumsum = np.cumsum(filled, axis=-1)
+    sums = cumsum[..., window - 1:]
+    sums[..., 1:] -= cumsum[..., :-window]
+    sums /= window
+    return sums
+
+
+def sma(values, window):
+    """Простая скользящая средняя (NaN до заполнения окна)."""
+    result = np.full(values.shape, np.nan)
+    if values.shape[-1] >= window:
+        result[..., window - 1:] = _rolling_mean(np.nan_to_num(values), window)
+        result[warmup_mask(values, window)] = np.nan
+    return result
+
+
+def rolling_std(values, window):
+    """
+    Скользящее стандартное отклонение с ddof=0, как в ta.BollingerBands.
+    Считается через накопленные суммы от значений, центрированных по среднему
+    пары, чтобы разность квадратов не теряла точность на больших ценах.
+    """
+    result = np.full(values.shape, np.nan)
+    if values.shape[-1] >= window:
+        missing = np.isnan(values)
+        centered = np.where(missing, 0.0, values)
+        centered -= centered.sum(axis=-1, keepdims=True) / np.maximum(
+            (~missing).sum(axis=-1, keepdims=True), 1
+        )
+        centered[missing] = 0.0
+        mean = _rolling_mean(centered, window)
+        centered *= centered
+        variance = _rolling_mean(centered, window)
+        variance -= mean * mean
+        result[..., window - 1:] = np.sqrt(np.maximum(variance, 0.0))
+        result[warmup_mask(values, window)] = np.nan
+    return result
+
+
+def _groups(index, bars):
+    """Номера пар, сгруппированные по свече index (значения вне [0, bars) пропускаются)."""
+    groups = {}
+    for row, i in enumerate(np.ravel(index)):
+        if 0 <= i < bars:
+            groups.setdefault(int(i), []).append(row)
+    return groups
+
+
+def _columns(values):
+    """Матрица bars × pairs в непрерывной памяти: шаг рекурсии читает одну строку."""
+    return np.ascontiguousarray(values.reshape(-1, values.shape[-1]).T)
+
+
+def _ewm_scalar(values, alpha, start):
+    """Рекурсия сглаживания для одной пары: цикл по float быстрее ufunc на векторе длины 1."""
+    result = np.full(values.shape, np.nan)
+    column = values.ravel().tolist()
+    out = result.ravel()
+    level = None
+    for i in range(int(np.ravel(start)[0]), len(column)):
+        level = column[i] if level is None else alpha * column[i] + (1 - alpha) * level
+        out[i] = level
+    return result
+
+
+def _ewm_loop(values, alpha, start):
+    """Рекурсия сглаживания по свечам, векторно по всем парам сразу."""
+    if values.size == values.shape[-1]:
+        return _ewm_scalar(values, alpha, start)
+    scaled = _columns(values) * alpha
+    result = np.empty(scaled.shape)
+    level = np.full(scaled.shape[1], np.nan)
+    beta = 1 - alpha
+    groups = _groups(start, scaled.shape[0])
+    for i in range(scaled.shape[0]):
+        row = result[i]
+        np.multiply(level, beta, out=row)
+        row += scaled[i]
+        if i in groups:
+            index = groups[i]
+            row[index] = scaled[i, index] / alpha
+        level = row
+    return result.T.reshape(values.shape)
+
+
+def _wilder_scalar(tr, seed, start, window):
+    """Рекурсия ATR для одной пары."""
+    result = np.zeros(tr.shape)
+    column = tr.ravel().tolist()
+    out = result.ravel()
+    first = int(np.ravel(start)[0]) + window - 1
+    if first < len(column):
+        level = float(seed.ravel()[first])
+        out[first] = level
+        for i in range(first + 1, len(column)):
+            level = (level * (window - 1) + column[i]) / window
+            out[i] = level
+    return result
+
+
+def _wilder_loop(tr, seed, start, window):
+    """Рекурсия ATR Уайлдера: на свече полного окна — среднее TR, дальше сглаживание."""
+    if tr.size == tr.shape[-1]:
+        return _wilder_scalar(tr, seed, start, window)
+    scaled = _columns(tr) / window
+    seed_rows = seed.reshape(-1, seed.shape[-1])
+    result = np.empty(scaled.shape)
+    level = np.zeros(scaled.shape[1])
+    beta = (window - 1) / window
+    groups = _groups(start + window - 1, scaled.shape[0])
+    for i in range(scaled.shape[0]):
+        row = result[i]
+        np.multiply(level, beta, out=row)
+        row += scaled[i]
+        if i in groups:
+            index = groups[i]
+            row[index] = seed_rows[index, i]
+        level = row
+    return result.T.reshape(tr.shape)
+
+
+if njit is not None:
+
+    @njit(cache=True)
+    def _ewm_kernel(values, alpha):
+        rows, bars = values.shape
+        result = np.empty((rows, bars))
+        for r in range(rows):
+            level = np.nan
+            for i in range(bars):
+                x = values[r, i]
+                if np.isnan(level):
+                    level = x
+                else:
+                    level = alpha * x + (1 - alpha) * level
+                result[r, i] = level
+        return result
+
+    @njit(cache=True)
+    def _wilder_kernel(tr, seed, start, window):
+        rows, bars = tr.shape
+        result = np.zeros((rows, bars))
+        for r in range(rows):
+            level = 0.0
+            for i in range(start[r] + window - 1, bars):
+                if i == start[r] + window - 1:
+                    level = seed[r, i]
+                else:
+                    level = (level * (window - 1) + tr[r, i]) / window
+                result[r, i] = level
+        return result
+
+
+def _as_rows(*arrays):
+    """Приводит массивы к 2-D (строка на пару) для ядер numba."""
+    return [np.ascontiguousarray(a.reshape(-1, a.shape[-1]), dtype=np.float64) for a in arrays]
+
+
+def ewm(values, alpha, min_periods):
+    """
+    Экспоненциальное сглаживание как pandas ewm(adjust=False):
+    стартует с первого не-NaN значения, NaN до min_periods наблюдений.
+    """
+    if not values.shape[-1]:
+        return np.full(values.shape, np.nan)
+    start = history_start(values)
+    if njit is not None:
+        (rows,) = _as_rows(values)
+        result = _ewm_kernel(rows, alpha).reshape(values.shape)
+    else:
+        result = _ewm_loop(values, alpha, start)
+    result[warmup_mask(values, min_periods, start)] = np.nan
+    return result
+
+
+def ema(values, span):
+    return ewm(values, 2.0 / (span + 1), span)
+
+
+def rsi(close, window=14):
+    diff = np.diff(close, prepend=np.nan, axis=-1)
+    up = np.where(diff > 0, diff, 0.0)
+    down = np.where(diff < 0, -diff, 0.0)
+    # Свечи до начала истории пары не участвуют в сглаживании
+    padding = np.isnan(close)
+    up[padding] = np.nan
+    down[padding] = np.nan
+    ema_up = ewm(up, 1.0 / window, window)
+    ema_down = ewm(down, 1.0 / window, window)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = np.where(ema_down == 0, 100.0, 100 - 100 / (1 + ema_up / ema_down))
+    result[np.isnan(ema_up)] = np.nan
+    return result
+
+
+def macd(close, fast=12, slow=26, signal=9):
+    """Возвращает (macd, macd_signal)."""
+    line = ema(close, fast) - ema(close, slow)
+    return line, ema(line, signal)
+
+
+def bollinger(close, window=20, window_dev=2):
+    """Возвращает (верхняя, нижняя) полосы Боллинджера."""
+    mavg = sma(close, window)
+    std = rolling_std(close, window)
+    return mavg + window_dev * std, mavg - window_dev * std
+
+
+def true_range(high, low, close):
+    prev_close = np.full(close.shape, np.nan)
+    prev_close[..., 1:] = close[..., :-1]
+    # На первой свече предыдущего закрытия нет: fmax пропускает NaN и берёт high - low
+    return np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+
+def atr(high, low, close, window=14):
+    """ATR по Уайлдеру: нули до окна, затем рекурсивное сглаживание (как в ta)."""
+    tr = true_range(high, low, close)
+    if close.shape[-1] < window:
+        return np.zeros(close.shape)
+    seed = sma(tr, window)
+    start = history_start(close)
+    if njit is not None:
+        tr_rows, seed_rows = _as_rows(tr, seed)
+        result = _wilder_kernel(tr_rows, seed_rows, np.ravel(start), window)
+        result = result.reshape(close.shape)
+    else:
+        result = _wilder_loop(tr, seed, start, window)
+    result[warmup_mask(close, window, start)] = 0.0
+    return result
+
+
+def compute_indicators(candles):
+    """
+    Считает набор индикаторов бота по свечам; возвращает словарь массивов.
+    Для пакета (stack_candles) каждый массив — матрица pairs × bars.
+    """
+    close = candles.close
+    macd_line, macd_signal = macd(close)
+    bb_high, bb_low = bollinger(close)
+    return {
+        "close": close,
+        "rsi": rsi(close),
+        "macd": macd_line,
+        "macd_signal": macd_signal,
+        "sma_50": sma(close, 50),
+        "sma_200": sma(close, 200),
+        "bb_high": bb_high,
+        "bb_low": bb_low,
+        "atr": atr(candles.high, candles.low, close),
+    }
+
+
+def last_values(indicators):
+    """Последние значения индикаторов как словарь float (замена df.iloc[-1])."""
+    return {name: float(values[-1]) for name, values in indicators.items()}
+
+
+def last_columns(indicators):
+    """Последние значения индикаторов пакета: словарь векторов длины pairs."""
+    return {name: values[..., -1] for name, values in indicators.items()}
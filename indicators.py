@@ -1,17 +1,90 @@
-import pandas as pd
-import ta
+import numpy as np
 from bybit_client import BybitAPI
+from candles import parse_kline, stack_candles, valid_candles
+from candle_store import CandleStore, interval_ms
+from fast_indicators import compute_indicators, last_columns
+from scheduler import candle_bounds
 from config import TRADE_PAIRS, TRADE_INTERVAL
 
+# Сколько свечей нужно для индикаторов (SMA 200 + запас на сглаживание)
+HISTORY_BARS = 1000
+
+SIGNAL_NAMES = np.array(["HOLD", "BUY", "SELL"])
+
+# Пороги связок индикаторов (подбираются в walk_forward.py)
+SIGNAL_PARAMS = {
+    "rsi_buy": 30,
+    "rsi_sell": 70,
+    "bb_buy": 1.02,
+    "bb_sell": 0.98,
+    "atr_max": 10,
+    "min_conditions": 3,
+}
+
+
+def generate_trade_signals(last, params=None):
+    """
+    Сигналы сразу для всех пар по последним значениям индикаторов
+    (словарь векторов, см. last_columns). Подходит и для полной истории
+    одной пары (бэктест). Возвращает (сигналы, силы).
+    """
+    params = SIGNAL_PARAMS if params is None else {**SIGNAL_PARAMS, **params}
+    price = np.asarray(last["close"])
+    rsi = np.asarray(last["rsi"])
+    macd = np.asarray(last["macd"])
+    macd_signal = np.asarray(last["macd_signal"])
+    low_volatility = np.asarray(last["atr"]) < params["atr_max"]
+    sma_50 = np.asarray(last["sma_50"])
+
+    # BUY условия
+    buy_conditions = (
+        (rsi < params["rsi_buy"]).astype(int)
+        + (macd > macd_signal)
+        + (price <= np.asarray(last["bb_low"]) * params["bb_buy"])
+        + low_volatility
+        + (price > sma_50)
+    )
+    # SELL условия
+    sell_conditions = (
+        (rsi > params["rsi_sell"]).astype(int)
+        + (macd < macd_signal)
+        + (price >= np.asarray(last["bb_high"]) * params["bb_sell"])
+        + low_volatility
+        + (price < sma_50)
+    )
+
+    buy = buy_conditions >= params["min_conditions"]
+    sell = ~buy & (sell_conditions >= params["min_conditions"])
+    codes = np.where(buy, 1, np.where(sell, 2, 0))
+    strengths = np.where(buy, buy_conditions, np.where(sell, sell_conditions, 0))
+    return SIGNAL_NAMES[codes], strengths
+
+
+def closed_candles(candles, interval=TRADE_INTERVAL):
+    """
+    Отбрасывает формирующуюся свечу: буфер хранит и незакрытую свечу текущего
+    интервала, а сигналы строятся только по закрытым.
+    """
+    return candles.before(candle_bounds(interval)[0] * 1000)
+
 
 class IndicatorCalculator:
     def __init__(self):
         self.client = BybitAPI()
+        # Последние значения индикаторов по парам
+        self.last_rows = {}
+        # Общие для всех процессов кольцевые буферы свечей
+        self.store = CandleStore()
 
     def get_historical_data(self, symbol):
-        """Получает исторические данные OHLCV для пары"""
+        """
+        Возвращает последние свечи пары из общего буфера, догружая с биржи
+        только недостающие (при холодном старте — всю историю).
+        """
         try:
-            response = self.client.get_kline(symbol, interval=TRADE_INTERVAL)
+            ring = self.store.get(symbol, TRADE_INTERVAL)
+            limit = ring.missing_bars(TRADE_INTERVAL, HISTORY_BARS)
+            response = self.client.get_kline(symbol, interval=TRADE_INTERVAL, limit=limit)
             if (
                 not response
                 or "result" not in response
@@ -20,48 +93,96 @@ class IndicatorCalculator:
                 print(f"❌ Ошибка API для {symbol}: некорректный ответ")
                 return None
 
-            raw_data = response["result"]["list"]
-            columns = ["timestamp", "open", "high", "low", "close", "volume"]
-            if len(raw_data[0]) == 7:
-                columns.append("turnover")
-            df = pd.DataFrame(raw_data, columns=columns)
-            df["close"] = df["close"].astype(float)
-            df["high"] = df["high"].astype(float)
-            df["low"] = df["low"].astype(float)
-            return df
+            candles = parse_kline(response["result"]["list"])
+            if candles is not None:
+                ring.write(candles)
+            return closed_candles(ring.snapshot(HISTORY_BARS + 1)).tail(HISTORY_BARS)
 
         except Exception as e:
             print(f"❌ Ошибка загрузки данных для {symbol}: {e}")
             return None
 
+    def get_cached_data(self, symbol, bars=HISTORY_BARS):
+        """Закрытые свечи из общего буфера без обращения к бирже (zero-copy срез и его seq)."""
+        candles, seq = self.store.get(symbol, TRADE_INTERVAL).view(bars + 1)
+        return closed_candles(candles).tail(bars), seq
+
+    def cached_closes(self, symbol, bars):
+        """Последние цены закрытия пары из общего буфера (без запроса к бирже)."""
+        return self.store.get(symbol, TRADE_INTERVAL).snapshot(bars).close
+
+    def load_batch(self, trade_pairs):
+        """
+        Загружает свечи пар и отбрасывает непригодные (пропуски, NaN, нарушенный порядок).
+        Возвращает (пары с данными, список их свечей).
+        """
+        loaded = []
+        candles_list = []
+        for pair in trade_pairs:
+            candles = self.get_historical_data(pair)
+            if candles is None or not len(candles):
+                continue
+            if not valid_candles(candles):
+                print(f"⚠️ {pair}: некорректные свечи, пара пропущена")
+                continue
+            loaded.append(pair)
+            candles_list.append(candles)
+        return loaded, candles_list
+
+    def evaluate(self, pairs, candles_list):
+        """Индикаторы и сигналы пар одним векторным проходом по пакету pairs × bars."""
+        bars = max(len(candles) for candles in candles_list)
+        step = None if str(TRADE_INTERVAL) == "M" else interval_ms(TRADE_INTERVAL)
+        batch = stack_candles(candles_list, bars, step)
+        last = last_columns(compute_indicators(batch))
+        signals, strengths = generate_trade_signals(last)
+        results = {}
+        for row, pair in enumerate(pairs):
+            last_row = {name: float(values[row]) for name, values in last.items()}
+            results[pair] = (last_row, str(signals[row]), int(strengths[row]))
+        return results
+
+    def compute_batch(self, trade_pairs):
+        """
+        Индикаторы и сигналы для всех пар одним векторным проходом.
+        Пары без последней закрытой свечи не оцениваются (сигнал по ним — HOLD);
+        если пакет не посчитался, пары считаются по отдельности, чтобы сбой
+        одной пары не лишал сигналов остальные.
+        Возвращает словарь pair -> (last_row, signal, strength).
+        """
+        loaded, candles_list = self.load_batch(trade_pairs)
+        if not loaded:
+            return {}
+        latest = max(candles.timestamp[-1] for candles in candles_list)
+        fresh = [i for i, candles in enumerate(candles_list) if candles.timestamp[-1] == latest]
+        for i in set(range(len(loaded))) - set(fresh):
+            print(f"⚠️ {loaded[i]}: нет последней свечи, пара пропущена")
+        loaded = [loaded[i] for i in fresh]
+        candles_list = [candles_list[i] for i in fresh]
+        try:
+            return self.evaluate(loaded, candles_list)
+        except Exception as e:
+            print(f"Ошибка пакетного расчета индикаторов, расчет по парам: {e}")
+        results = {}
+        for pair, candles in zip(loaded, candles_list):
+            try:
+                results.update(self.evaluate([pair], [candles]))
+            except Exception as e:
+                print(f"Ошибка при расчете индикаторов {pair}: {e}")
+        return results
+
     def calculate_indicators(self, trade_pairs=None):
         """Анализирует все пары и возвращает индикаторы"""
         if trade_pairs is None:
             trade_pairs = TRADE_PAIRS
         report = f"📊 *Анализ индикаторов (интервал: {TRADE_INTERVAL} мин)*\n\n"
+        results = self.compute_batch(trade_pairs)
         for pair in trade_pairs:
-            df = self.get_historical_data(pair)
-            if df is None:
+            if pair not in results:
                 report += f"❌ {pair}: Ошибка загрузки данных\n"
                 continue
 
-            df["rsi"] = ta.momentum.RSIIndicator(df["close"], window=14).rsi()
-            macd = ta.trend.MACD(df["close"])
-            df["macd"] = macd.macd()
-            df["macd_signal"] = macd.macd_signal()
-            df["sma_50"] = ta.trend.SMAIndicator(df["close"], window=50).sma_indicator()
-            df["sma_200"] = ta.trend.SMAIndicator(
-                df["close"], window=200
-            ).sma_indicator()
-            bb = ta.volatility.BollingerBands(df["close"], window=20, window_dev=2)
-            df["bb_high"] = bb.bollinger_hband()
-            df["bb_low"] = bb.bollinger_lband()
-            atr = ta.volatility.AverageTrueRange(
-                df["high"], df["low"], df["close"], window=14
-            )
-            df["atr"] = atr.average_true_range()
-            last_row = df.iloc[-1]
-            signal, strength = self.generate_trade_signal(last_row)
+            last_row, signal, strength = results[pair]
             composite = signal
             if strength >= 3:
                 composite += " 💪"
@@ -79,88 +200,27 @@ class IndicatorCalculator:
         return report
 
     def generate_trade_signal(self, last_row):
-        """Генерация сигнала с использованием связок индикаторов."""
-        signal = "HOLD"
-        strength = 0
-        price = last_row["close"]
-
-        # BUY условия
-        buy_conditions = 0
-        if last_row["rsi"] < 30:
-            buy_conditions += 1
-        if last_row["macd"] > last_row["macd_signal"]:
-            buy_conditions += 1
-        if price <= last_row["bb_low"] * 1.02:
-            buy_conditions += 1
-        if last_row["atr"] < 10:
-            buy_conditions += 1
-        if price > last_row["sma_50"]:
-            buy_conditions += 1
-
-        # SELL условия
-        sell_conditions = 0
-        if last_row["rsi"] > 70:
-            sell_conditions += 1
-        if last_row["macd"] < last_row["macd_signal"]:
-            sell_conditions += 1
-        if price >= last_row["bb_high"] * 0.98:
-            sell_conditions += 1
-        if last_row["atr"] < 10:
-            sell_conditions += 1
-        if price < last_row["sma_50"]:
-            sell_conditions += 1
-
-        if buy_conditions >= 3:
-            signal = "BUY"
-            strength = buy_conditions
-        elif sell_conditions >= 3:
-            signal = "SELL"
-            strength = sell_conditions
-
-        return signal, strength
+        """Генерация сигнала с использованием связок индикаторов (одна пара)."""
+        signals, strengths = generate_trade_signals(last_row)
+        return str(signals), int(strengths)
 
     def calculate_signals(self, trade_pairs=None):
-        """Анализирует все пары и возвращает сигналы с рассчитанными индикаторами"""
+        """
+        Анализирует все пары и возвращает сигналы с рассчитанными индикаторами.
+        Индикаторы считаются пакетом: матрица pairs × bars за один проход.
+        """
         if trade_pairs is None:
             trade_pairs = TRADE_PAIRS
-        signals = {}
-
-        for pair in trade_pairs:
-            df = self.get_historical_data(pair)
-            if df is None or df.empty:
-                signals[pair] = ("HOLD", 0)
-                continue
+        signals = {pair: ("HOLD", 0) for pair in trade_pairs}
 
-            try:
-                df["rsi"] = ta.momentum.RSIIndicator(df["close"], window=14).rsi()
-                macd = ta.trend.MACD(df["close"])
-                df["macd"] = macd.macd()
-                df["macd_signal"] = macd.macd_signal()
-                df["sma_50"] = ta.trend.SMAIndicator(
-                    df["close"], window=50
-                ).sma_indicator()
-                df["sma_200"] = ta.trend.SMAIndicator(
-                    df["close"], window=200
-                ).sma_indicator()
-                bb = ta.volatility.BollingerBands(df["close"], window=20, window_dev=2)
-                df["bb_high"] = bb.bollinger_hband()
-                df["bb_low"] = bb.bollinger_lband()
-                atr = ta.volatility.AverageTrueRange(
-                    df["high"], df["low"], df["close"], window=14
-                )
-                df["atr"] = atr.average_true_range()
-            except Exception as e:
-                print(f"Ошибка при расчете индикаторов для {pair}: {e}")
-                signals[pair] = ("HOLD", 0)
-                continue
-
-            last_row = df.iloc[-1]
-            try:
-                signal, strength = self.generate_trade_signal(last_row)
-            except Exception as e:
-                print(f"Ошибка при генерации сигнала для {pair}: {e}")
-                signal, strength = ("HOLD", 0)
+        try:
+            results = self.compute_batch(trade_pairs)
+        except Exception as e:
+            print(f"Ошибка при расчете индикаторов: {e}")
+            return signals
 
+        for pair, (last_row, signal, strength) in results.items():
+            self.last_rows[pair] = last_row
             signals[pair] = (signal, strength)
         return signals
 
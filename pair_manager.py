@@ -1,4 +1,5 @@
 import json
+import logging
 from config import TRADE_PAIRS
 
 
@@ -8,6 +9,7 @@ class PairManager:
     def __init__(self):
         self.pairs_file = "trade_pairs.json"
         self.active_pairs = self.load_pairs()
+        self.subscribers = []
 
     def load_pairs(self):
         """Загружает торговые пары из JSON или берёт из trade_pairs.py"""
@@ -19,10 +21,22 @@ class PairManager:
             return TRADE_PAIRS
 
     def save_pairs(self, pairs):
-        """Сохраняет новые пары в trade_pairs.json"""
+        """Сохраняет новые пары в trade_pairs.json и уведомляет подписчиков"""
+        previous = self.active_pairs
         self.active_pairs = pairs
         with open(self.pairs_file, "w") as file:
             json.dump({"TRADE_PAIRS": pairs}, file, indent=4)
+        added = [pair for pair in pairs if pair not in previous]
+        removed = [pair for pair in previous if pair not in pairs]
+        for callback in self.subscribers:
+            try:
+                callback(added, removed)
+            except Exception as e:
+                logging.error(f"Ошибка подписчика PairManager: {e}")
+
+    def subscribe(self, callback):
+        """Подписывает callback(added, removed) на изменения списка пар"""
+        self.subscribers.append(callback)
 
     def get_active_pairs(self):
         """Возвращает актуальный список пар"""
@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+from collections import OrderedDict
+
+LEDGER_FILE = "pnl_ledger.json"
+# Сколько последних execId помнить для защиты от повторного учёта
+SEEN_EXECUTIONS_LIMIT = 10000
+
+
+class PositionAccount:
+    """Учёт одной пары: позиция, средняя цена входа, комиссии и PnL."""
+
+    __slots__ = ("symbol", "qty", "avg_entry", "fees", "realized", "last_price", "unrealized", "fills")
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.qty = 0.0  # > 0 - лонг, < 0 - шорт (в токенах)
+        self.avg_entry = 0.0
+        self.fees = 0.0
+        self.realized = 0.0
+        self.last_price = 0.0
+        self.unrealized = 0.0
+        self.fills = 0
+
+    def apply_fill(self, side, qty, price, fee=0.0):
+        """
+        Применяет исполнение за O(1): усредняет вход при наращивании
+        и фиксирует PnL при сокращении/развороте позиции.
+        Возвращает изменение реализованного PnL.
+        """
+        signed = qty if side == "Buy" else -qty
+        realized = 0.0
+        if self.qty == 0 or (self.qty > 0) == (signed > 0):
+            total = abs(self.qty) + qty
+            self.avg_entry = (abs(self.qty) * self.avg_entry + qty * price) / total
+            self.qty += signed
+        else:
+            closed = min(qty, abs(self.qty))
+            direction = 1 if self.qty > 0 else -1
+            realized = closed * (price - self.avg_entry) * direction
+            self.qty += signed
+            if abs(self.qty) < 1e-12:
+                self.qty = 0.0
+                self.avg_entry = 0.0
+            elif (self.qty > 0) != (direction > 0):
+                # Разворот: остаток открыт по цене этого исполнения
+                self.avg_entry = price
+        self.realized += realized
+        self.fees += fee
+        self.fills += 1
+        return realized
+
+    def mark(self, price):
+        """Переоценивает позицию по цене; возвращает изменение нереализованного PnL."""
+        self.last_price = price
+        unrealized = (price - self.avg_entry) * self.qty if self.qty else 0.0
+        delta = unrealized - self.unrealized
+        self.unrealized = unrealized
+        return delta
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class PnLLedger:
+    """
+    Журнал PnL: инкрементально обновляет позиции и общие итоги,
+    поэтому любой запрос (Telegram, метрики) отвечает за O(1) без пересчёта истории.
+    """
+
+    def __init__(self, ledger_file=LEDGER_FILE):
+        self.ledger_file = ledger_file
+        self.accounts = {}
+        self.seen_executions = OrderedDict()
+        self.total_realized = 0.0
+        self.total_unrealized = 0.0
+        self.total_fees = 0.0
+        self.load()
+
+    def account(self, symbol):
+        account = self.accounts.get(symbol)
+        if account is None:
+            account = self.accounts[symbol] = PositionAccount(symbol)
+        return account
+
+    def record_fill(self, symbol, side, qty, price, fee=0.0, exec_id=None):
+        """Учитывает исполнение; повторный execId игнорируется."""
+        if exec_id is not None:
+            if exec_id in self.seen_executions:
+                return False
+            self.seen_executions[exec_id] = None
+            if len(self.seen_executions) > SEEN_EXECUTIONS_LIMIT:
+                self.seen_executions.popitem(last=False)
+        account = self.account(symbol)
+        self.total_realized += account.apply_fill(side, qty, price, fee)
+        self.total_fees += fee
+        self.total_unrealized += account.mark(account.last_price or price)
+        return True
+
+    def record_executions(self, executions):
+        """
+        Учитывает список исполнений Bybit (get_executions).
+        Комиссия спота за покупку списывается в токене — пересчитываем в USDT
+        и уменьшаем полученное количество.
+        """
+        recorded = 0
+        for execution in executions:
+            qty = float(execution["execQty"])
+            price = float(execution["execPrice"])
+            fee = float(execution.get("execFee") or 0)
+            fee_currency = execution.get("feeCurrency")
+            if fee_currency and fee_currency != "USDT":
+                qty -= fee
+                fee *= price
+            if self.record_fill(
+                execution["symbol"],
+                execution["side"],
+                qty,
+                price,
+                fee,
+                exec_id=execution.get("execId"),
+            ):
+                recorded += 1
+        return recorded
+
+    def on_price(self, symbol, price):
+        """Обновление цены (на каждом тике) за O(1)."""
+        account = self.accounts.get(symbol)
+        if account is not None:
+            self.total_unrealized += account.mark(price)
+
+    def adjust_position(self, symbol, qty):
+        """Принудительно выставляет количество по данным биржи (сверка)."""
+        account = self.account(symbol)
+        account.qty = qty
+        if not qty:
+            account.avg_entry = 0.0
+        if account.last_price:
+            self.total_unrealized += account.mark(account.last_price)
+
+    def position(self, symbol):
+        account = self.accounts.get(symbol)
+        return account.to_dict() if account else None
+
+    def totals(self):
+        return {
+            "realized": self.total_realized,
+            "unrealized": self.total_unrealized,
+            "fees": self.total_fees,
+            "net": self.total_realized + self.total_unrealized - self.total_fees,
+        }
+
+    def snapshot(self):
+        """Полный снимок для отчётов и метрик."""
+        return {
+            "totals": self.totals(),
+            "positions": {symbol: a.to_dict() for symbol, a in self.accounts.items()},
+        }
+
+    def load(self):
+        if not os.path.exists(self.ledger_file):
+            return
+        try:
+            with open(self.ledger_file, "r") as file:
+                data = json.load(file)
+        except Exception as e:
+            logging.error(f"Ошибка загрузки журнала PnL: {e}")
+            return
+        for symbol, values in data.get("positions", {}).items():
+            account = self.account(symbol)
+            for name in PositionAccount.__slots__:
+                if name in values:
+                    setattr(account, name, values[name])
+            self.total_realized += account.realized
+            self.total_unrealized += account.unrealized
+            self.total_fees += account.fees
+        self.seen_executions = OrderedDict.fromkeys(data.get("seen_executions", []))
+
+    def save(self):
+        data = self.snapshot()
+        data["seen_executions"] = list(self.seen_executions)
+        try:
+            with open(self.ledger_file, "w") as file:
+                json.dump(data, file, indent=4)
+        except Exception as e:
+            logging.error(f"Ошибка сохранения журнала PnL: {e}")
+
+
+def format_position_pnl(account):
+    """Строка PnL позиции для Telegram."""
+    if not account:
+        return ""
+    return (
+        f"Средний вход: {account['avg_entry']:.6g}, Кол-во: {account['qty']:.8g}, "
+        f"PnL: {account['unrealized']:+.2f} / реализ. {account['realized']:+.2f}, "
+        f"Комиссии: {account['fees']:.4f} USDT"
+    )
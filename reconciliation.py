@@ -0,0 +1,307 @@
+import asyncio
+import json
+import logging
+import os
+import clock
+from config import (
+    BYBIT_API_KEY,
+    BYBIT_API_SECRET,
+    USE_TESTNET,
+    RECONCILE_USE_WEBSOCKET,
+    RECONCILE_INTERVAL,
+    RECONCILE_POLL_INTERVAL,
+    RECONCILE_TOLERANCE,
+)
+from request_layer import ORDER_LINK_PREFIX
+
+RECONCILE_STATE_FILE = "reconcile_state.json"
+
+# Финальные статусы ордера Bybit: из них ордер больше не выходит
+TERMINAL_STATUSES = {"Filled", "Cancelled", "Rejected", "PartiallyFilledCanceled", "Deactivated"}
+
+
+class OrderState:
+    """Локальная машина состояний одного ордера."""
+
+    __slots__ = ("order_id", "symbol", "side", "status", "qty", "cum_exec_qty", "avg_price", "updated_time")
+
+    def __init__(self, order_id, symbol, side):
+        self.order_id = order_id
+        self.symbol = symbol
+        self.side = side
+        self.status = "Created"
+        self.qty = 0.0
+        self.cum_exec_qty = 0.0
+        self.avg_price = 0.0
+        self.updated_time = 0
+
+    def apply(self, order):
+        """
+        Применяет обновление ордера с биржи. Устаревшие обновления и выход
+        из финального статуса игнорируются. Возвращает True, если состояние изменилось.
+        """
+        updated_time = int(order.get("updatedTime") or 0)
+        if updated_time and updated_time < self.updated_time:
+            return False
+        if self.status in TERMINAL_STATUSES:
+            return False
+        self.status = order.get("orderStatus", self.status)
+        self.qty = float(order.get("qty") or self.qty)
+        self.cum_exec_qty = float(order.get("cumExecQty") or self.cum_exec_qty)
+        self.avg_price = float(order.get("avgPrice") or self.avg_price)
+        self.updated_time = updated_time or self.updated_time
+        return True
+
+    @property
+    def is_open(self):
+        return self.status not in TERMINAL_STATUSES
+
+
+class Reconciler:
+    """
+    Сверка локального состояния с аккаунтом: приватные потоки order/execution/wallet
+    (или инкрементальный опрос истории исполнений по курсору) плюс периодический дифф
+    позиций с балансами кошелька. Позиция живёт, пока живут её ордера (order_ids):
+    если все они завершились без исполнения или позиция оказалась плоской,
+    она снимается через колбэк on_position_closed(symbol, reason).
+    """
+
+    def __init__(self, client, ledger, active_orders, state_file=RECONCILE_STATE_FILE):
+        self.client = client
+        self.ledger = ledger
+        self.active_orders = active_orders
+        self.state_file = state_file
+        self.orders = {}
+        self.balances = {}
+        self.last_exec_time = None
+        self.ws = None
+        self.loop = None
+        self.task = None
+        self.on_position_closed = None
+        self.load_state()
+
+    def load_state(self):
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, "r") as file:
+                    self.last_exec_time = json.load(file).get("last_exec_time")
+            except Exception as e:
+                logging.error(f"Ошибка загрузки состояния сверки: {e}")
+
+    def save_state(self):
+        try:
+            with open(self.state_file, "w") as file:
+                json.dump({"last_exec_time": self.last_exec_time}, file, indent=4)
+        except Exception as e:
+            logging.error(f"Ошибка сохранения состояния сверки: {e}")
+
+    # --- Обработка событий ---
+    def track_order(self, order):
+        """Регистрирует или обновляет ордер в машине состояний."""
+        order_id = order["orderId"]
+        state = self.orders.get(order_id)
+        if state is None:
+            state = self.orders[order_id] = OrderState(order_id, order["symbol"], order["side"])
+        if state.apply(order) and not state.is_open:
+            logging.info(f"Ордер {order_id} ({state.symbol}) → {state.status}")
+            if self.unfilled(self.active_orders.get(state.symbol)):
+                self.close_position(state.symbol, "ордера завершились без исполнения")
+        return state
+
+    # --- Жизненный цикл позиций ---
+    @staticmethod
+    def order_ids(info):
+        """Ордера, из которых собрана позиция (старые записи хранят только order_id)."""
+        return [i for i in info.get("order_ids") or [info.get("order_id")] if i]
+
+    def unfilled(self, info):
+        """True, если все ордера позиции известны, завершены и ничего не исполнили."""
+        if not info:
+            return False
+        states = [self.orders.get(order_id) for order_id in self.order_ids(info)]
+        return bool(states) and all(
+            state is not None and not state.is_open and not state.cum_exec_qty for state in states
+        )
+
+    def close_position(self, symbol, reason):
+        if self.active_orders.pop(symbol, None) is None:
+            return
+        logging.warning(f"⚠️ {symbol}: позиция снята сверкой ({reason})")
+        if self.on_position_closed:
+            self.on_position_closed(symbol, reason)
+
+    async def refresh_orders(self):
+        """Догружает состояние ордеров позиций, финальный статус которых ещё не известен."""
+        for symbol, info in list(self.active_orders.items()):
+            if not info:
+                continue
+            for order_id in self.order_ids(info):
+                state = self.orders.get(order_id)
+                if state is not None and not state.is_open:
+                    continue
+                order = await asyncio.to_thread(self.client.get_order, symbol, order_id)
+                if order:
+                    self.track_order(order)
+
+    def on_order(self, message):
+        for order in message.get("data", []):
+            if order.get("category", "spot") == "spot":
+                self.track_order(order)
+
+    def on_execution(self, message):
+        executions = [e for e in message.get("data", []) if e.get("category", "spot") == "spot"]
+        # В журнал — только исполнения ордеров бота; ручные сделки аккаунта не в счёт
+        own = [e for e in executions if (e.get("orderLinkId") or "").startswith(ORDER_LINK_PREFIX)]
+        if self.ledger.record_executions(own):
+            self.ledger.save()
+        for execution in executions:
+            exec_time = int(execution.get("execTime") or 0)
+            if exec_time > (self.last_exec_time or 0):
+                self.last_exec_time = exec_time
+        self.save_state()
+
+    def on_wallet(self, message):
+        for account in message.get("data", []):
+            for coin in account.get("coin", []):
+                self.balances[coin["coin"]] = float(coin.get("walletBalance") or 0)
+
+    def _threadsafe(self, handler):
+        """Колбэки pybit приходят из потока WebSocket — переносим их в event loop."""
+
+        def callback(message):
+            self.loop.call_soon_threadsafe(handler, message)
+
+        return callback
+
+    def start_streams(self):
+        from pybit.unified_trading import WebSocket
+
+        self.ws = WebSocket(
+            testnet=USE_TESTNET,
+            channel_type="private",
+            api_key=BYBIT_API_KEY,
+            api_secret=BYBIT_API_SECRET,
+        )
+        self.ws.order_stream(self._threadsafe(self.on_order))
+        self.ws.execution_stream(self._threadsafe(self.on_execution))
+        self.ws.wallet_stream(self._threadsafe(self.on_wallet))
+        logging.info("✅ Подписка на приватные потоки order/execution/wallet")
+
+    # --- Опрос и сверка ---
+    async def catch_up(self):
+        """Догружает исполнения с момента курсора (без полного перечитывания истории)."""
+        if self.last_exec_time is None:
+            self.last_exec_time = int(clock.now() * 1000)
+            self.save_state()
+            return
+        cursor = None
+        while True:
+            result = await asyncio.to_thread(
+                self.client.get_executions, start_time=self.last_exec_time, cursor=cursor
+            )
+            if not result:
+                return
+            self.on_execution({"data": result.get("list", [])})
+            cursor = result.get("nextPageCursor")
+            if not cursor or not result.get("list"):
+                return
+
+    async def refresh_balances(self):
+        coins = await asyncio.to_thread(self.client.get_wallet_coins)
+        if coins is None:
+            raise RuntimeError("баланс недоступен")
+        self.on_wallet({"data": [{"coin": coins}]})
+
+    async def diff(self):
+        """
+        Сравнивает позиции журнала с балансами кошелька и исправляет расхождения:
+        источник истины — аккаунт на бирже. Плоские позиции и позиции, чьи ордера
+        так и не исполнились, снимаются.
+        """
+        try:
+            await self.refresh_orders()
+        except Exception as e:
+            logging.error(f"Ошибка обновления ордеров позиций: {e}")
+        if self.ws is None or not self.balances:
+            try:
+                await self.refresh_balances()
+            except Exception as e:
+                logging.error(f"Ошибка сверки балансов: {e}")
+                return []
+        drift = []
+        for symbol, info in list(self.active_orders.items()):
+            if not info or not symbol.endswith("USDT"):
+                continue
+            if self.unfilled(info):
+                self.close_position(symbol, "ордера завершились без исполнения")
+                continue
+            account = self.ledger.position(symbol)
+            local_qty = account["qty"] if account else 0.0
+            if info.get("side") == "Sell":
+                # Продажа монет: позиция открыта, пока журнал показывает проданный остаток
+                if not account:
+                    continue
+                sold_qty = max(-local_qty, 0.0)
+                expected_qty = float(info.get("qty") or 0.0) or sold_qty
+                if sold_qty <= expected_qty * RECONCILE_TOLERANCE:
+                    drift.append((symbol, local_qty, 0.0))
+                    self.close_position(symbol, "журнал не показывает проданного остатка")
+                elif sold_qty < expected_qty * (1 - RECONCILE_TOLERANCE):
+                    drift.append((symbol, -expected_qty, local_qty))
+                    logging.warning(
+                        f"⚠️ Расхождение {symbol}: продано {sold_qty}, ожидалось {expected_qty}"
+                    )
+                    info["qty"] = sold_qty
+                continue
+            local_qty = local_qty or float(info.get("qty") or 0.0)
+            wallet_qty = self.balances.get(symbol[: -len("USDT")], 0.0)
+            if wallet_qty <= local_qty * RECONCILE_TOLERANCE:
+                drift.append((symbol, local_qty, wallet_qty))
+                self.ledger.adjust_position(symbol, 0.0)
+                self.close_position(symbol, f"на бирже {wallet_qty}, позиция плоская")
+            # Лишние монеты в кошельке могут быть не нашими — исправляем только недостачу
+            elif wallet_qty < local_qty * (1 - RECONCILE_TOLERANCE):
+                drift.append((symbol, local_qty, wallet_qty))
+                logging.warning(
+                    f"⚠️ Расхождение {symbol}: локально {local_qty}, на бирже {wallet_qty}"
+                )
+                self.ledger.adjust_position(symbol, wallet_qty)
+                info["qty"] = wallet_qty
+        if drift:
+            self.ledger.save()
+        return drift
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        if RECONCILE_USE_WEBSOCKET:
+            try:
+                await asyncio.to_thread(self.start_streams)
+            except Exception as e:
+                logging.error(f"Ошибка подписки на приватные потоки, переход на опрос: {e}")
+                self.ws = None
+        last_diff = 0
+        while True:
+            if self.ws is None:
+                await self.catch_up()
+            if clock.now() - last_diff >= RECONCILE_INTERVAL:
+                await self.diff()
+                last_diff = clock.now()
+            await clock.async_sleep(RECONCILE_POLL_INTERVAL)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run(), name="reconcile")
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if self.ws is not None:
+            try:
+                self.ws.exit()
+            except Exception:
+                pass
+            self.ws = None
+
+    def open_orders(self):
+        return [state for state in self.orders.values() if state.is_open]
@@ -0,0 +1,324 @@
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+import capture
+import clock
+from capture import _open
+
+# Воспроизведение записи сессии (capture.py) через рабочий код бота.
+
+
+class ReplayExhausted(BaseException):
+    """
+    Записанные ответы для вызова закончились. Наследуется от BaseException,
+    чтобы его не поглотили обработчики "except Exception" в BybitAPI.
+    """
+
+
+class VirtualTime(clock.Clock):
+    """
+    Виртуальные часы: двигаются по меткам записи, sleep мгновенный.
+    monotonic идёт от тех же меток, чтобы таймауты (circuit breaker) истекали
+    в виртуальном времени.
+    """
+
+    def __init__(self):
+        self.now = None
+
+    def time(self):
+        return self.now if self.now is not None else time.time()
+
+    def monotonic(self):
+        return self.now if self.now is not None else time.monotonic()
+
+    def sleep(self, seconds):
+        if self.now is not None:
+            self.now += seconds
+
+    async def async_sleep(self, seconds):
+        # Отдаём управление другим задачам, но не ждём реального времени
+        self.sleep(seconds)
+        await asyncio.sleep(0)
+
+
+class ReplayedError(RuntimeError):
+    """Записанная ошибка биржи: тип и код сохраняются для классификации в request_layer."""
+
+    def __init__(self, event):
+        super().__init__(event["error"])
+        self.error_type = event.get("error_type")
+        self.status_code = event.get("status_code")
+
+
+class ReplaySession:
+    """Заглушка pybit HTTP: отдаёт записанные ответы по очереди для (метод, symbol)."""
+
+    def __init__(self, events, clock, decisions):
+        self.queues = defaultdict(deque)
+        self.clock = clock
+        self.decisions = decisions
+        for event in events:
+            if event["kind"] == "exchange":
+                self.queues[(event["name"], event["args"].get("symbol"))].append(event)
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            queue = self.queues.get((name, kwargs.get("symbol")))
+            if not queue:
+                raise ReplayExhausted(f"{name} {kwargs.get('symbol')}")
+            event = queue.popleft()
+            if self.clock.now is not None:
+                self.clock.now = max(self.clock.now, event["t"])
+            if name == "place_order":
+                self.decisions.append(_order_decision(kwargs))
+            if "error" in event:
+                raise ReplayedError(event)
+            return event["result"]
+
+        return call
+
+
+class StubBot:
+    """Заглушка telegram.Bot: запоминает отправленные сообщения."""
+
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def send_message(self, chat_id=None, text=None, *args, **kwargs):
+        self.messages.append(text)
+
+    def __getattr__(self, name):
+        async def call(*args, **kwargs):
+            return None
+
+        return call
+
+
+class LatencyCollector:
+    """Рекордер для режима воспроизведения: собирает только длительности этапов."""
+
+    def __init__(self):
+        self.stages = defaultdict(list)
+
+    def record(self, kind, name, **fields):
+        pass
+
+    def stage(self, name, started, **fields):
+        self.stages[name].append(time.perf_counter() - started)
+
+
+def _order_decision(args):
+    return {k: v for k, v in args.items() if k != "orderLinkId"}
+
+
+def load_events(path):
+    with _open(path, "r") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def latency_summary(stages):
+    return {
+        name: {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": _percentile(values, 0.5),
+            "p95": _percentile(values, 0.95),
+            "max": max(values),
+        }
+        for name, values in stages.items()
+        if values
+    }
+
+
+class ReplayDriver:
+    """
+    Прогоняет запись через trade_logic, мониторы позиций и обработчики tg_bot
+    с заглушками биржи и Telegram. speed=None — максимально быстро
+    (виртуальные часы), иначе с реальными паузами, ускоренными в speed раз.
+    Работает во временном каталоге, чтобы не трогать файлы живого бота.
+    Приватные потоки аккаунта (order/execution) не записываются: при
+    воспроизведении исполнения ордеров берутся только из ответов REST.
+    """
+
+    def __init__(self, path, speed=None):
+        self.path = os.path.abspath(path)
+        self.speed = speed
+        self.events = load_events(self.path)
+        self.clock = VirtualTime()
+        self.decisions = []
+        self.messages = []
+        self.collector = LatencyCollector()
+
+    def _prepare_workdir(self):
+        self.project_dir = os.path.dirname(os.path.abspath(__file__))
+        self.workdir = tempfile.mkdtemp(prefix="bbt-replay-")
+        state = next((e for e in self.events if e["kind"] == "state"), None)
+        for name, content in (state["files"] if state else {}).items():
+            with open(os.path.join(self.workdir, name), "w") as file:
+                file.write(content)
+        os.chdir(self.workdir)
+
+    def _install(self):
+        capture.set_recorder(self.collector)
+        if self.project_dir not in sys.path:
+            sys.path.insert(0, self.project_dir)
+        import autotrade
+        import tg_bot
+        from candle_store import CandleStore
+
+        session = ReplaySession(self.events, self.clock, self.decisions)
+        stub_bot = StubBot(self.messages)
+        for client in (
+            autotrade.bybit_client,
+            autotrade.indicator_calc.client,
+            tg_bot.bybit_client,
+            tg_bot.indicator_calc.client,
+        ):
+            client.session = session
+        autotrade.bot = stub_bot
+        autotrade.shard_coordinator = None
+        autotrade.execution_engine.feed.use_websocket = False
+        autotrade.reconciler.start = lambda: None
+        self.store_prefix = f"bbtreplay{os.getpid()}"
+        for calc in (autotrade.indicator_calc, tg_bot.indicator_calc):
+            calc.store = CandleStore(prefix=self.store_prefix)
+
+        async def no_main_loop():
+            return None
+
+        # Вызовы trade_logic берутся из записи, а не из основного цикла
+        autotrade.main_trade_loop = no_main_loop
+        if self.speed is None:
+            self.clock.now = self.events[0]["t"] if self.events else time.time()
+            clock.set_clock(self.clock)
+        self.autotrade, self.tg_bot, self.stub_bot = autotrade, tg_bot, stub_bot
+
+    async def _dispatch_update(self, data):
+        from telegram import Update
+
+        update = Update.de_json(data, self.stub_bot)
+        if update.callback_query:
+            started = time.perf_counter()
+            await self.tg_bot.kill_confirm(update, None)
+            self.collector.stage("telegram", started)
+            return
+        text = update.message.text if update.message else None
+        if not text:
+            return
+        started = time.perf_counter()
+        if text.startswith("/"):
+            handler = self.tg_bot.COMMANDS.get(text[1:].split()[0].split("@")[0])
+            if handler:
+                await handler(update, None)
+        else:
+            await self.tg_bot.button_handler(update, None)
+        self.collector.stage("telegram", started)
+
+    async def _run(self):
+        try:
+            self.autotrade.auto_trade_active = True
+            stream_events = deque(e for e in self.events if e["kind"] == "stream")
+            previous = None
+            for event in self.events:
+                if event["kind"] not in ("stage", "telegram_in"):
+                    continue
+                if event["kind"] == "stage" and event["name"] != "trade_logic":
+                    continue
+                if self.speed is not None and previous is not None:
+                    await asyncio.sleep(max(0, event["t"] - previous) / self.speed)
+                previous = event["t"]
+                if self.clock.now is not None:
+                    self.clock.now = max(self.clock.now, event["t"])
+                while stream_events and stream_events[0]["t"] <= event["t"]:
+                    self.autotrade.execution_engine.feed._on_message(stream_events.popleft()["message"])
+                try:
+                    if event["kind"] == "telegram_in":
+                        await self._dispatch_update(event["update"])
+                    else:
+                        # Тот же цикл, что и в main_trade_loop: этап и ошибки учитываются одинаково
+                        await self.autotrade.run_trade_cycle()
+                except ReplayExhausted:
+                    pass
+            # Даём мониторам позиций доиграть оставшиеся записанные ответы
+            for _ in range(10000):
+                tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+                if not tasks:
+                    break
+                await asyncio.sleep(0)
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+        finally:
+            self.autotrade.auto_trade_active = False
+
+    def run(self):
+        """Воспроизводит запись и возвращает отчёт о совпадении решений и латентности."""
+        cwd = os.getcwd()
+        self._prepare_workdir()
+        try:
+            self._install()
+            asyncio.run(self._run())
+        finally:
+            os.chdir(cwd)
+            clock.set_clock(None)
+            capture.set_recorder(None)
+            if hasattr(self, "tg_bot"):
+                import candle_store
+
+                for calc in (self.autotrade.indicator_calc, self.tg_bot.indicator_calc):
+                    calc.store.close()
+                candle_store.cleanup(self.store_prefix)
+            shutil.rmtree(self.workdir, ignore_errors=True)
+        return self.report()
+
+    def report(self):
+        recorded_orders = [
+            _order_decision(e["args"])
+            for e in self.events
+            if e["kind"] == "exchange" and e["name"] == "place_order"
+        ]
+        recorded_messages = [e["text"] for e in self.events if e["kind"] == "telegram_out"]
+        recorded_stages = defaultdict(list)
+        for event in self.events:
+            if event["kind"] == "stage":
+                recorded_stages[event["name"]].append(event["dt"])
+        mismatches = []
+        for label, recorded, replayed in (
+            ("order", recorded_orders, self.decisions),
+            ("message", recorded_messages, self.messages),
+        ):
+            for index in range(max(len(recorded), len(replayed))):
+                left = recorded[index] if index < len(recorded) else None
+                right = replayed[index] if index < len(replayed) else None
+                if left != right:
+                    mismatches.append({"type": label, "index": index, "recorded": left, "replayed": right})
+        return {
+            "identical": not mismatches,
+            "mismatches": mismatches,
+            "orders": len(self.decisions),
+            "messages": len(self.messages),
+            "latency_recorded": latency_summary(recorded_stages),
+            "latency_replayed": latency_summary(self.collector.stages),
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Воспроизведение записанной сессии бота")
+    parser.add_argument("capture", help="файл записи (CAPTURE_FILE)")
+    parser.add_argument("--speed", type=float, default=None, help="1.0 - реальное время; без флага - максимально быстро")
+    args = parser.parse_args()
+    result = ReplayDriver(args.capture, speed=args.speed).run()
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+    sys.exit(0 if result["identical"] else 1)
@@ -0,0 +1,283 @@
+import logging
+import random
+import threading
+import uuid
+import clock
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests import exceptions as http_errors
+from pybit.exceptions import InvalidRequestError, FailedRequestError
+from config import (
+    REQUEST_MAX_RETRIES,
+    REQUEST_BACKOFF_BASE,
+    REQUEST_BACKOFF_MAX,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_TIMEOUT,
+    HEDGE_DELAY,
+)
+
+# Коды ответа Bybit v5 (retCode). 10002 (время запроса) и 10006 (лимит запросов)
+# pybit повторяет сам (max_retries в HTTP), поэтому здесь их нет: когда его повторы
+# исчерпаны, приходит FailedRequestError "Retries exceeded" — см. RetriesExhaustedError
+RATE_LIMIT_CODES = {10018}
+TRANSIENT_CODES = {10000, 10016}
+AUTH_CODES = {10003, 10004, 10005, 10007, 10009, 10010}
+DUPLICATE_ORDER_CODES = {110072, 170141}
+
+# Сетевые ошибки requests (по имени — для записанных сессий replay)
+NETWORK_ERRORS = (
+    http_errors.ConnectionError,
+    http_errors.Timeout,
+    http_errors.SSLError,
+    http_errors.ChunkedEncodingError,
+)
+NETWORK_ERROR_NAMES = {
+    "ConnectionError",
+    "Timeout",
+    "ReadTimeout",
+    "ConnectTimeout",
+    "SSLError",
+    "ChunkedEncodingError",
+}
+
+
+class BybitError(Exception):
+    """Ошибка запроса к Bybit; retryable — можно ли безопасно повторить."""
+
+    retryable = False
+
+    def __init__(self, message, code=None, endpoint=None):
+        super().__init__(message)
+        self.code = code
+        self.endpoint = endpoint
+
+
+class TransientError(BybitError):
+    """Сбой сети или сервера биржи: запрос можно повторить."""
+
+    retryable = True
+
+
+class RateLimitError(TransientError):
+    """Превышен лимит запросов."""
+
+
+class RetriesExhaustedError(TransientError):
+    """
+    pybit уже исчерпал собственные повторы: ещё один круг повторов поверх них
+    только умножит запросы, но для размыкателя это сбой.
+    """
+
+    retryable = False
+
+
+class AuthError(BybitError):
+    """Неверный ключ, подпись или нет прав."""
+
+
+class RejectedError(BybitError):
+    """Биржа ответила отказом (параметры, баланс): повтор не поможет."""
+
+
+class DuplicateOrderError(RejectedError):
+    """Ордер с таким orderLinkId уже создан (предыдущая попытка дошла до биржи)."""
+
+
+class CircuitOpenError(BybitError):
+    """Эндпоинт временно отключён размыкателем после серии сбоев."""
+
+
+def classify(exc, endpoint=None):
+    """Переводит исключение pybit/requests в типизированную BybitError."""
+    if isinstance(exc, BybitError):
+        return exc
+    name = getattr(exc, "error_type", type(exc).__name__)
+    code = getattr(exc, "status_code", None)
+    message = getattr(exc, "message", None) or str(exc)
+    if isinstance(exc, InvalidRequestError) or name == "InvalidRequestError":
+        if code in RATE_LIMIT_CODES:
+            cls = RateLimitError
+        elif code in TRANSIENT_CODES:
+            cls = TransientError
+        elif code in AUTH_CODES:
+            cls = AuthError
+        elif code in DUPLICATE_ORDER_CODES:
+            cls = DuplicateOrderError
+        else:
+            cls = RejectedError
+    elif isinstance(exc, FailedRequestError) or name == "FailedRequestError":
+        # Ответ не дошёл или не 200: 401 — доступ, 403 — бан IP за превышение лимита,
+        # остальное — временный сбой
+        if "Retries exceeded" in message:
+            cls = RetriesExhaustedError
+        elif code == 403:
+            cls = RateLimitError
+        elif code == 401:
+            cls = AuthError
+        else:
+            cls = TransientError
+    elif isinstance(exc, NETWORK_ERRORS) or name in NETWORK_ERROR_NAMES:
+        cls = TransientError
+    else:
+        cls = BybitError
+    error = cls(message, code=code, endpoint=endpoint)
+    error.__cause__ = exc
+    return error
+
+
+# Префикс orderLinkId ордеров бота: по нему исполнения бота отличаются от ручных сделок
+ORDER_LINK_PREFIX = "bbt-"
+
+
+def new_order_link_id():
+    """Клиентский идентификатор ордера: повтор с ним не создаст дубль."""
+    return f"{ORDER_LINK_PREFIX}{uuid.uuid4().hex[:24]}"
+
+
+class CircuitBreaker:
+    """
+    Размыкатель эндпоинта: после threshold временных сбоев подряд запросы
+    отклоняются сразу, через reset_timeout пропускается одна пробная попытка.
+    """
+
+    def __init__(self, name, threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if clock.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if clock.monotonic() - self.opened_at < self.reset_timeout or self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logging.info(f"🔌 {self.name}: связь восстановлена")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.opened_at is None and self.failures < self.threshold:
+                return
+            if self.opened_at is None:
+                logging.warning(
+                    f"⚡ {self.name}: {self.failures} сбоев подряд, запросы приостановлены на {self.reset_timeout} с"
+                )
+            self.opened_at = clock.monotonic()
+
+
+class RequestLayer:
+    """
+    Прослойка над вызовами pybit: повторы с экспоненциальной задержкой и джиттером,
+    размыкатели по эндпоинтам и дублирующие (hedged) запросы для чтения цен.
+    """
+
+    def __init__(self, max_retries=REQUEST_MAX_RETRIES, hedge_delay=HEDGE_DELAY):
+        self.max_retries = max_retries
+        self.hedge_delay = hedge_delay
+        self.breakers = {}
+        self.stats = Counter()
+        self.pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+    def breaker(self, endpoint):
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers.setdefault(endpoint, CircuitBreaker(endpoint))
+        return breaker
+
+    @staticmethod
+    def backoff(attempt, error=None):
+        """Полный джиттер: случайная пауза до base * 2^attempt (дольше при лимите запросов)."""
+        if isinstance(error, RateLimitError):
+            attempt += 2
+        return random.uniform(0, min(REQUEST_BACKOFF_MAX, REQUEST_BACKOFF_BASE * 2 ** attempt))
+
+    def call(self, endpoint, func, retry=True, hedge=False, **params):
+        """
+        Выполняет func(**params). Повторяются только временные сбои; для ордеров
+        повтор безопасен лишь с orderLinkId в params. Бросает BybitError.
+        """
+        breaker = self.breaker(endpoint)
+        attempts = self.max_retries + 1 if retry else 1
+        for attempt in range(attempts):
+            if not breaker.allow():
+                self.stats["rejected_open"] += 1
+                raise CircuitOpenError(f"{endpoint}: запросы приостановлены", endpoint=endpoint)
+            try:
+                if hedge and self.hedge_delay:
+                    result = self._hedged(func, params)
+                else:
+                    result = func(**params)
+            except Exception as e:
+                error = classify(e, endpoint)
+                if isinstance(error, RetriesExhaustedError):
+                    breaker.record_failure()
+                    self.stats["failures"] += 1
+                    raise error
+                if not error.retryable:
+                    # Биржа ответила — канал исправен
+                    breaker.record_success()
+                    raise error
+                breaker.record_failure()
+                self.stats["failures"] += 1
+                if attempt + 1 >= attempts or breaker.state == "open":
+                    raise error
+                delay = self.backoff(attempt, error)
+                self.stats["retries"] += 1
+                logging.warning(
+                    f"🔁 {endpoint}: {error}; повтор {attempt + 1}/{attempts - 1} через {delay:.2f} с"
+                )
+                clock.sleep(delay)
+            else:
+                breaker.record_success()
+                return result
+
+    def _hedged(self, func, params):
+        """Если ответ не пришёл за hedge_delay, шлёт дубль и берёт первый успешный."""
+        first = self.pool.submit(func, **params)
+        done, _ = wait([first], timeout=self.hedge_delay)
+        if done:
+            return first.result()
+        self.stats["hedges"] += 1
+        second = self.pool.submit(func, **params)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self.stats["hedge_wins"] += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def snapshot(self):
+        """Счётчики и состояние размыкателей (для метрик)."""
+        return {
+            "stats": dict(self.stats),
+            "breakers": {
+                name: {"state": b.state, "failures": b.failures} for name, b in self.breakers.items()
+            },
+        }
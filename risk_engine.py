@@ -0,0 +1,182 @@
+import json
+import logging
+import math
+import os
+import time
+import clock
+from collections import deque
+from config import (
+    MIN_ORDER_USDT,
+    RISK_MAX_TOTAL_EXPOSURE_USDT,
+    RISK_MAX_PAIR_EXPOSURE_USDT,
+    RISK_MAX_CORRELATED_EXPOSURE_USDT,
+    RISK_MAX_CORRELATION,
+    RISK_MAX_DAILY_LOSS_USDT,
+    RISK_CORRELATION_WINDOW,
+)
+
+RISK_STATE_FILE = "risk_state.json"
+
+
+class RiskEngine:
+    """
+    Предторговый риск-контроль портфеля. Держит текущие агрегаты экспозиции
+    и кэш корреляций, поэтому проверка ордера не ходит на биржу и не пересчитывает историю.
+    """
+
+    def __init__(self, ledger=None, state_file=RISK_STATE_FILE):
+        self.ledger = ledger
+        self.state_file = state_file
+        self.exposure = {}
+        self.total_exposure = 0.0
+        self.returns = {}
+        self.returns_version = {}
+        self.correlations = {}
+        self.halted = False
+        self.day = None
+        self.day_start_pnl = 0.0
+        self.load_state()
+
+    # --- Состояние (база дневного убытка переживает перезапуск) ---
+    def load_state(self):
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, "r") as file:
+                    state = json.load(file)
+                self.day = state.get("day")
+                self.day_start_pnl = float(state.get("day_start_pnl", 0.0))
+            except Exception as e:
+                logging.error(f"Ошибка загрузки состояния риск-движка: {e}")
+
+    def save_state(self):
+        try:
+            with open(self.state_file, "w") as file:
+                json.dump({"day": self.day, "day_start_pnl": self.day_start_pnl}, file, indent=4)
+        except Exception as e:
+            logging.error(f"Ошибка сохранения состояния риск-движка: {e}")
+
+    # --- Экспозиция ---
+    def set_exposure(self, symbol, notional):
+        """Устанавливает экспозицию пары (USDT), поддерживая общий итог."""
+        self.total_exposure += notional - self.exposure.get(symbol, 0.0)
+        if notional:
+            self.exposure[symbol] = notional
+        else:
+            self.exposure.pop(symbol, None)
+
+    def add_exposure(self, symbol, notional):
+        self.set_exposure(symbol, self.exposure.get(symbol, 0.0) + notional)
+
+    def sync_positions(self, active_orders):
+        """Пересобирает агрегаты из active_orders (при старте/восстановлении)."""
+        self.exposure = {}
+        self.total_exposure = 0.0
+        for symbol, info in active_orders.items():
+            if info:
+                self.set_exposure(symbol, float(info.get("order_size", 0)))
+
+    # --- Корреляции ---
+    def update_returns(self, symbol, closes):
+        """Кэширует доходности последних свечей пары."""
+        tail = list(closes[-(RISK_CORRELATION_WINDOW + 1):])
+        returns = deque(maxlen=RISK_CORRELATION_WINDOW)
+        for prev, curr in zip(tail, tail[1:]):
+            if prev > 0 and curr > 0:
+                returns.append(math.log(curr / prev))
+        self.returns[symbol] = returns
+        self.returns_version[symbol] = self.returns_version.get(symbol, 0) + 1
+
+    def correlation(self, a, b):
+        """Корреляция Пирсона доходностей пары; пересчитывается только после обновления данных."""
+        if a == b:
+            return 1.0
+        if a not in self.returns or b not in self.returns:
+            return None
+        key = (a, b) if a < b else (b, a)
+        versions = (self.returns_version[key[0]], self.returns_version[key[1]])
+        cached = self.correlations.get(key)
+        if cached and cached[0] == versions:
+            return cached[1]
+        x, y = list(self.returns[key[0]]), list(self.returns[key[1]])
+        n = min(len(x), len(y))
+        value = None
+        if n >= 2:
+            x, y = x[-n:], y[-n:]
+            mean_x, mean_y = sum(x) / n, sum(y) / n
+            cov = sum((i - mean_x) * (j - mean_y) for i, j in zip(x, y))
+            var_x = sum((i - mean_x) ** 2 for i in x)
+            var_y = sum((j - mean_y) ** 2 for j in y)
+            if var_x > 0 and var_y > 0:
+                value = cov / math.sqrt(var_x * var_y)
+        self.correlations[key] = (versions, value)
+        return value
+
+    def correlation_matrix(self, symbols=None):
+        symbols = symbols or list(self.exposure)
+        return {a: {b: self.correlation(a, b) for b in symbols} for a in symbols}
+
+    # --- Дневной убыток ---
+    def daily_pnl(self):
+        if self.ledger is None:
+            return 0.0
+        net = self.ledger.totals()["net"]
+        today = time.strftime("%Y-%m-%d", clock.gmtime())
+        if self.day != today:
+            self.day = today
+            self.day_start_pnl = net
+            self.save_state()
+        return net - self.day_start_pnl
+
+    # --- Проверка ордера ---
+    def check_order(self, symbol, side, order_size):
+        """
+        Проверяет ордер на order_size USDT.
+        Возвращает (решение "approve" | "resize" | "reject", допустимый объём, причина).
+        """
+        if self.halted:
+            return "reject", 0.0, "торговля остановлена kill switch"
+        if self.daily_pnl() <= -RISK_MAX_DAILY_LOSS_USDT:
+            return "reject", 0.0, "достигнут дневной лимит убытка"
+
+        limits = {
+            "общая экспозиция": RISK_MAX_TOTAL_EXPOSURE_USDT - self.total_exposure,
+            "экспозиция пары": RISK_MAX_PAIR_EXPOSURE_USDT - self.exposure.get(symbol, 0.0),
+        }
+        # Нет данных для корреляции с открытой позицией — считаем пару коррелированной
+        correlated, unknown = [], False
+        for other in self.exposure:
+            if other == symbol:
+                continue
+            value = self.correlation(symbol, other)
+            if value is None:
+                unknown = True
+            if value is None or value >= RISK_MAX_CORRELATION:
+                correlated.append(other)
+        if correlated:
+            group = self.exposure.get(symbol, 0.0) + sum(self.exposure[o] for o in correlated)
+            reason = "коррелированные позиции (нет данных)" if unknown else "коррелированные позиции"
+            limits[reason] = RISK_MAX_CORRELATED_EXPOSURE_USDT - group
+
+        reason, room = min(limits.items(), key=lambda item: item[1])
+        size = round(min(order_size, room), 2)
+        if size < MIN_ORDER_USDT:
+            return "reject", 0.0, f"лимит: {reason}"
+        if size < order_size:
+            return "resize", size, f"лимит: {reason}"
+        return "approve", order_size, ""
+
+    def halt(self):
+        """Kill switch: блокирует новые ордера до ручного сброса."""
+        self.halted = True
+        logging.warning("🛑 Kill switch: новые ордера заблокированы")
+
+    def resume(self):
+        self.halted = False
+
+    def snapshot(self):
+        return {
+            "halted": self.halted,
+            "total_exposure": self.total_exposure,
+            "exposure": dict(self.exposure),
+            "daily_pnl": self.daily_pnl(),
+        }
@@ -0,0 +1,110 @@
+import calendar
+import clock
+from config import (
+    TRADE_INTERVAL,
+    SCHEDULER_CLOSE_DELAY,
+    SCHEDULER_RETRY_DELAY,
+    MONITOR_MIN_INTERVAL,
+    MONITOR_MAX_INTERVAL,
+    MONITOR_FAR_ATR,
+)
+
+# Недели Bybit начинаются с понедельника, а 1970-01-01 — четверг
+WEEK_OFFSET = 4 * 86400
+
+
+def candle_bounds(interval, now=None):
+    """Начало и конец (unix, сек) текущей свечи интервала Bybit."""
+    now = clock.now() if now is None else now
+    interval = str(interval)
+    if interval == "M":
+        tm = clock.gmtime(now)
+        year, month = (tm.tm_year + 1, 1) if tm.tm_mon == 12 else (tm.tm_year, tm.tm_mon + 1)
+        start = calendar.timegm((tm.tm_year, tm.tm_mon, 1, 0, 0, 0))
+        return start, calendar.timegm((year, month, 1, 0, 0, 0))
+    if interval == "W":
+        week = 7 * 86400
+        start = (now - WEEK_OFFSET) // week * week + WEEK_OFFSET
+        return start, start + week
+    seconds = 86400 if interval == "D" else int(interval) * 60
+    start = now // seconds * seconds
+    return start, start + seconds
+
+
+class CandleCloseScheduler:
+    """
+    Запускает оценку сигналов по закрытию свечи: сигналы строятся по закрытым
+    свечам, поэтому пересчёт внутри свечи даёт тот же результат.
+    """
+
+    def __init__(
+        self,
+        interval=TRADE_INTERVAL,
+        close_delay=SCHEDULER_CLOSE_DELAY,
+        retry_delay=SCHEDULER_RETRY_DELAY,
+    ):
+        self.interval = interval
+        self.close_delay = close_delay
+        self.retry_delay = retry_delay
+        self.evaluated = {}
+        self.pending = {}
+
+    def current_close(self, now=None):
+        """Время закрытия последней закрытой свечи."""
+        now = clock.now() if now is None else now
+        return candle_bounds(self.interval, now - self.close_delay)[0]
+
+    async def wait_next_close(self):
+        """Ждёт закрытия следующей свечи (плюс задержку на финализацию данных биржей)."""
+        close = candle_bounds(self.interval)[1]
+        await clock.async_sleep(max(0, close + self.close_delay - clock.now()))
+        return close
+
+    async def wait_next_pass(self):
+        """
+        Ждёт следующего прохода: если по последней закрытой свече остались
+        неоценённые пары — повтор через retry_delay, иначе закрытия следующей свечи.
+        """
+        close = self.current_close()
+        if any(pending >= close for pending in self.pending.values()):
+            next_close = candle_bounds(self.interval)[1] + self.close_delay
+            await clock.async_sleep(max(0, min(self.retry_delay, next_close - clock.now())))
+        else:
+            await self.wait_next_close()
+
+    def due_pairs(self, pairs):
+        """
+        Пары, для которых последняя закрытая свеча ещё не оценивалась.
+        Оценёнными они становятся только через mark_evaluated: пара, по которой
+        сигнал не посчитался, остаётся в очереди до следующего прохода.
+        """
+        close = self.current_close()
+        due = [pair for pair in pairs if self.evaluated.get(pair, 0) < close]
+        for pair in due:
+            self.pending[pair] = close
+        return due
+
+    def mark_evaluated(self, pairs):
+        """Отмечает свечу, выданную due_pairs, как оценённую."""
+        for pair in pairs:
+            self.evaluated[pair] = self.pending.pop(pair, None) or self.current_close()
+
+    def reset(self, pair=None):
+        if pair is None:
+            self.evaluated = {}
+            self.pending = {}
+        else:
+            self.evaluated.pop(pair, None)
+            self.pending.pop(pair, None)
+
+
+def monitor_delay(price, levels, atr):
+    """
+    Пауза между проверками позиции: чем ближе цена к ближайшему уровню
+    (трейлинг-стоп, тейк-профит, доливка) в единицах ATR, тем чаще опрос.
+    """
+    if not atr or atr != atr or atr <= 0:
+        return MONITOR_MIN_INTERVAL * 5
+    distance = min(abs(price - level) for level in levels) / atr
+    ratio = min(distance / MONITOR_FAR_ATR, 1.0)
+    return MONITOR_MIN_INTERVAL + (MONITOR_MAX_INTERVAL - MONITOR_MIN_INTERVAL) * ratio
@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import threading
+import zlib
+from multiprocessing import get_context
+from multiprocessing.connection import Client, Listener
+from config import SHARD_WORKERS, SHARD_REMOTE_WORKERS, SHARD_AUTHKEY
+
+
+# Ключ из примера конфигурации: с ним соединение не защищено
+DEFAULT_AUTHKEY = "change-me"
+
+
+def shard_authkey():
+    """
+    Ключ аутентификации удалённых воркеров. Команды передаются через pickle,
+    поэтому без секретного ключа любой, кто достучится до порта, выполнит код
+    на воркере: пустой или стандартный ключ не принимается.
+    """
+    if not SHARD_AUTHKEY or SHARD_AUTHKEY == DEFAULT_AUTHKEY:
+        raise ValueError("задайте свой SHARD_AUTHKEY в config.py")
+    return SHARD_AUTHKEY.encode()
+
+
+def shard_for(symbol, shard_count):
+    """Возвращает номер шарда для пары (crc32 не зависит от PYTHONHASHSEED)."""
+    return zlib.crc32(symbol.encode()) % shard_count
+
+
+def split_pairs(pairs, shard_count):
+    """Раскладывает пары по шардам."""
+    shards = [[] for _ in range(shard_count)]
+    for pair in pairs:
+        shards[shard_for(pair, shard_count)].append(pair)
+    return shards
+
+
+def serve_connection(conn):
+    """
+    Обрабатывает команды координатора на стороне воркера.
+    Каждый воркер держит свой клиент Bybit и свои расчёты индикаторов.
+    """
+    from indicators import IndicatorCalculator
+
+    calc = IndicatorCalculator()
+    while True:
+        try:
+            command, payload = conn.recv()
+        except (EOFError, OSError):
+            break
+        try:
+            if command == "scan":
+                result = calc.compute_batch(payload)
+            elif command == "prices":
+                result = {}
+                for pair in payload:
+                    price = calc.client.get_last_price(pair)
+                    if price is not None:
+                        result[pair] = price
+            elif command == "stop":
+                conn.send(("ok", None))
+                break
+            else:
+                raise ValueError(f"неизвестная команда {command}")
+            conn.send(("ok", result))
+        except Exception as e:
+            logging.error(f"❌ Ошибка воркера при обработке {command}: {e}")
+            conn.send(("error", str(e)))
+    conn.close()
+
+
+def run_worker_server(host, port):
+    """Запускает воркер, принимающий координатора по TCP (для других машин)."""
+    try:
+        authkey = shard_authkey()
+    except ValueError as e:
+        logging.error(f"❌ Воркер не запущен: {e}")
+        return
+    with Listener((host, port), authkey=authkey) as listener:
+        logging.info(f"✅ Воркер слушает {host}:{port}")
+        while True:
+            conn = listener.accept()
+            logging.info(f"Подключен координатор {listener.last_accepted}")
+            serve_connection(conn)
+
+
+class ShardCoordinator:
+    """
+    Координатор: раскладывает пары по воркерам и собирает их результаты.
+    Telegram, баланс и размещение ордеров остаются в основном процессе.
+    Мониторинг позиций тоже остаётся здесь: решения о закрытии и доливке
+    меняют active_orders, журнал PnL и риск-движок, которые живут только
+    в основном процессе. Воркерам уходят лишь запросы цен для мониторов.
+    """
+
+    def __init__(self, workers=SHARD_WORKERS, remote_workers=SHARD_REMOTE_WORKERS):
+        self.workers = workers
+        self.remote_workers = remote_workers
+        # Шард — пара (соединение, блокировка). Списки заменяются целиком,
+        # поэтому запрос в потоке работает со своей копией
+        self.local = []
+        self.remote = []
+        self.shards = []
+        self.processes = []
+
+    @property
+    def shard_count(self):
+        return len(self.shards)
+
+    def start_local(self):
+        """
+        Форкает локальные воркеры (один раз за жизнь процесса). Вызывается из
+        основного потока при старте бота, пока других потоков нет: fork из
+        рабочего потока наследует чужие захваченные блокировки.
+        """
+        if self.local or not self.workers:
+            return
+        # fork, а не spawn: иначе дочерний процесс заново импортирует tg_bot.py
+        ctx = get_context("fork")
+        shards = []
+        try:
+            for _ in range(self.workers):
+                parent_conn, child_conn = ctx.Pipe()
+                process = ctx.Process(target=serve_connection, args=(child_conn,), daemon=True)
+                process.start()
+                child_conn.close()
+                self.processes.append(process)
+                shards.append((parent_conn, threading.Lock()))
+        except Exception:
+            self._close(shards)
+            self._join()
+            raise
+        self.local = shards
+        self.shards = self.local + self.remote
+        logging.info(f"✅ Запущено локальных воркеров: {len(shards)}")
+
+    def connect_remote(self):
+        """
+        Подключается к удалённым воркерам (блокирующий вызов, выполняется в потоке).
+        Недоступный воркер пропускается — его пары уходят остальным шардам,
+        локальные воркеры не трогаются. Возвращает адреса, к которым подключиться
+        не удалось. Без своего SHARD_AUTHKEY не подключается ни к кому (ValueError).
+        """
+        if self.remote or not self.remote_workers:
+            return []
+        authkey = shard_authkey()
+        shards = []
+        failed = []
+        for address in self.remote_workers:
+            try:
+                host, port = address.rsplit(":", 1)
+                conn = Client((host, int(port)), authkey=authkey)
+            except Exception as e:
+                logging.error(f"❌ Удалённый воркер {address} недоступен: {e}")
+                failed.append(address)
+                continue
+            shards.append((conn, threading.Lock()))
+        self.remote = shards
+        self.shards = self.local + self.remote
+        logging.info(f"✅ Шардов: {self.shard_count} (удалённых {len(shards)})")
+        return failed
+
+    def disconnect_remote(self):
+        """Отключает удалённые воркеры (блокирующий вызов); локальные продолжают ждать команд."""
+        shards, self.remote = self.remote, []
+        self.shards = self.local
+        self._close(shards)
+
+    def stop(self):
+        """Останавливает все воркеры и закрывает соединения (блокирующий вызов)."""
+        shards = self.shards
+        self.local, self.remote, self.shards = [], [], []
+        self._close(shards)
+        self._join()
+
+    @staticmethod
+    def _close(shards):
+        for conn, lock in shards:
+            # Ждём запрос, который сейчас идёт через это соединение
+            with lock:
+                try:
+                    conn.send(("stop", None))
+                    conn.recv()
+                except Exception:
+                    pass
+                conn.close()
+
+    def _join(self):
+        processes, self.processes = self.processes, []
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    @staticmethod
+    def _request(shard, command, payload):
+        conn, lock = shard
+        with lock:
+            if conn.closed:
+                raise ConnectionError("шард остановлен")
+            conn.send((command, payload))
+            status, result = conn.recv()
+        if status != "ok":
+            raise RuntimeError(result)
+        return result
+
+    async def _broadcast(self, command, pairs):
+        shards = self.shards
+        groups = split_pairs(pairs, len(shards))
+        indexes = [index for index, group in enumerate(groups) if group]
+        calls = [
+            asyncio.to_thread(self._request, shards[index], command, groups[index])
+            for index in indexes
+        ]
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        for index, result in zip(indexes, results):
+            if isinstance(result, Exception):
+                logging.error(f"❌ Шард {index} не ответил на {command}: {result}")
+                yield index, groups[index], None
+            else:
+                yield index, groups[index], result
+
+    async def compute_batch(self, pairs):
+        """
+        Индикаторы и сигналы по всем парам: pair -> (last_row, signal, strength).
+        Пар упавшего шарда и пар без данных в результате нет.
+        """
+        results = {}
+        async for _, _, result in self._broadcast("scan", pairs):
+            if result:
+                results.update(result)
+        return results
+
+    async def get_prices(self, pairs):
+        """Последние цены закрытия, полученные воркерами своих шардов."""
+        prices = {}
+        async for _, _, result in self._broadcast("prices", pairs):
+            if result:
+                prices.update(result)
+        return prices
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(description="Воркер шарда торговых пар")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6001)
+    args = parser.parse_args()
+    run_worker_server(args.host, args.port)
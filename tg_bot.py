@@ -1,29 +1,42 @@
-import json
+import os
 import asyncio
 import logging
-from telegram import Update, Bot, ReplyKeyboardMarkup
+from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
     ApplicationBuilder,
     Application,
     CommandHandler,
+    CallbackQueryHandler,
     MessageHandler,
     filters,
     CallbackContext,
+    TypeHandler,
 )
 
 from autotrade import (
     start_auto_trade,
     stop_auto_trade,
+    kill_switch,
     update_trade_pairs,
-    auto_trade_active,
     active_orders,
+    pnl_ledger,
+    pair_manager,
 )
 from bybit_client import BybitAPI
 from indicators import IndicatorCalculator
-from config import TELEGRAM_API_TOKEN, ADMIN_CHAT_ID, TRADE_PAIRS
-from pair_manager import PairManager
-
-pair_manager = PairManager()
+from config import (
+    TELEGRAM_API_TOKEN,
+    ADMIN_CHAT_ID,
+    PROFILE_DEFAULT_SECONDS,
+    PROFILE_MAX_SECONDS,
+    API_ENABLED,
+)
+from pnl_ledger import format_position_pnl
+import autotrade
+import candle_store
+import api_server
+import diagnostics
+from capture import make_bot, get_recorder, record_update, record_update_done
 
 
 # Настройка логов
@@ -36,18 +49,11 @@ logging.getLogger("telegram").setLevel(logging.WARNING)
 
 print("✅ Бот запущен и готов к работе!")
 
-bot = Bot(token=TELEGRAM_API_TOKEN)
+bot = make_bot(TELEGRAM_API_TOKEN)
 bybit_client = BybitAPI()
 indicator_calc = IndicatorCalculator()
-
-
-def load_trade_pairs():
-    try:
-        with open("active_pairs.json", "r") as file:
-            config_data = json.load(file)
-            return config_data.get("TRADE_PAIRS", [])
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
+# Фоновая задача /profile (одновременно — только одна)
+profile_task = None
 
 
 def main_menu():
@@ -57,6 +63,7 @@ def main_menu():
             ["▶️ Запустить автоторговлю", "⏹ Остановить автоторговлю"],
             ["📊 Баланс", "📈 Индикаторы"],
             ["🔄 Обновить торговые пары", "📉 Позиции"],
+            ["🛑 Закрыть всё"],
         ],
         resize_keyboard=True,
     )
@@ -75,6 +82,15 @@ async def positions(update: Update, context: CallbackContext) -> None:
                 f"Сторона: {info.get('side')}, Вход: {info.get('entry_price'):.2f}, "
                 f"Размер: {info.get('order_size')} USDT\n"
             )
+            pnl = format_position_pnl(pnl_ledger.position(pair))
+            if pnl:
+                msg += f"  {pnl}\n"
+    totals = pnl_ledger.totals()
+    msg += (
+        f"💼 *Итого PnL:* {totals['net']:+.2f} USDT "
+        f"(нереализ. {totals['unrealized']:+.2f}, реализ. {totals['realized']:+.2f}, "
+        f"комиссии {totals['fees']:.4f})"
+    )
     await update.message.reply_text(msg, parse_mode="Markdown")
 
 
@@ -99,7 +115,7 @@ async def start(update: Update, context: CallbackContext) -> None:
 async def balance(update: Update, context: CallbackContext) -> None:
     """Команда /balance: показывает баланс аккаунта"""
     try:
-        result = bybit_client.get_wallet_balance(as_report=True)
+        result = await asyncio.to_thread(bybit_client.get_wallet_balance, as_report=True)
         if not result:
             await update.message.reply_text("❌ Ошибка получения баланса")
             return
@@ -114,8 +130,9 @@ async def balance(update: Update, context: CallbackContext) -> None:
 async def indicators(update: Update, context: CallbackContext) -> None:
     """Команда /indicators: анализирует RSI, MACD, SMA и возвращает таблицу"""
     try:
-        updated_pairs = load_trade_pairs()
-        result = indicator_calc.calculate_indicators(updated_pairs)
+        result = await asyncio.to_thread(
+            indicator_calc.calculate_indicators, pair_manager.get_active_pairs()
+        )
         if not result:
             await update.message.reply_text("❌ Ошибка получения индикаторов")
             return
@@ -128,50 +145,177 @@ async def indicators(update: Update, context: CallbackContext) -> None:
 async def update_pairs(update: Update, context: CallbackContext):
     """Команда 'Обновить торговые пары'"""
     await update.message.reply_text("📡 Обновление списка торговых пар...")
-    await update_trade_pairs()
+    if not await update_trade_pairs():
+        await update.message.reply_text("❌ Ошибка получения пар!")
+        return False
     await update.message.reply_text("✅ Торговые пары обновлены!")
+    return True
+
+
+def is_admin(update: Update) -> bool:
+    """Апдейт пришёл из чата администратора"""
+    chat = update.effective_chat
+    return chat is not None and str(chat.id) == str(ADMIN_CHAT_ID)
+
+
+async def kill(update: Update, context: CallbackContext) -> None:
+    """Команда /kill: после подтверждения закрывает все позиции и останавливает автоторговлю"""
+    if not is_admin(update):
+        await update.message.reply_text("⛔ Команда доступна только администратору")
+        return
+    keyboard = InlineKeyboardMarkup(
+        [
+            [
+                InlineKeyboardButton("✅ Подтвердить", callback_data="kill:confirm"),
+                InlineKeyboardButton("❌ Отмена", callback_data="kill:cancel"),
+            ]
+        ]
+    )
+    await update.message.reply_text(
+        "🛑 Закрыть все позиции и остановить автоторговлю?", reply_markup=keyboard
+    )
+
+
+async def kill_confirm(update: Update, context: CallbackContext) -> None:
+    """Ответ на подтверждение /kill"""
+    query = update.callback_query
+    await query.answer()
+    if not is_admin(update):
+        return
+    if query.data != "kill:confirm":
+        await query.edit_message_text("↩️ Закрытие позиций отменено")
+        return
+    await query.edit_message_text("🛑 Закрываю все позиции...")
+    result = await kill_switch()
+    await query.message.reply_text(result)
+
+
+async def send_profile(message, seconds):
+    """Снимает профиль в фоне и присылает flame graph по готовности"""
+    try:
+        path = await diagnostics.profile(seconds)
+        with open(path, "rb") as file:
+            await message.reply_document(file, filename=os.path.basename(path))
+    except Exception as e:
+        logging.error(f"❌ Ошибка в /profile: {e}")
+        await message.reply_text(f"❌ Ошибка: {e}")
+    await message.reply_text(diagnostics.report())
+
+
+async def profile(update: Update, context: CallbackContext) -> None:
+    """Команда /profile [секунды]: снимает профиль процесса и присылает flame graph"""
+    global profile_task
+    args = getattr(context, "args", None) or []
+    seconds = int(args[0]) if args and args[0].isdigit() else PROFILE_DEFAULT_SECONDS
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    if profile_task and not profile_task.done():
+        await update.message.reply_text("⏳ Профилирование уже идёт, дождитесь результата")
+        return
+    await update.message.reply_text(f"⏱ Профилирование {seconds} с, результат придёт по готовности...")
+    # Обработчик не ждёт профиля: бот продолжает отвечать на другие команды
+    profile_task = asyncio.create_task(send_profile(update.message, seconds), name="profile")
+
+
+async def diag(update: Update, context: CallbackContext) -> None:
+    """Команда /diag: лаг event loop и CPU по задачам"""
+    await update.message.reply_text(diagnostics.report())
 
 
 async def button_handler(update: Update, context: CallbackContext) -> None:
-    global auto_trade_active
     text = update.message.text
 
     if text == "▶️ Запустить автоторговлю":
-        if auto_trade_active:
+        if autotrade.auto_trade_active:
             await update.message.reply_text("⚠️ Автоторговля уже запущена!")
         else:
-            auto_trade_active = True
             asyncio.create_task(start_auto_trade())
     elif text == "⏹ Остановить автоторговлю":
-        if not auto_trade_active:
+        if not autotrade.auto_trade_active:
             await update.message.reply_text("⚠️ Автоторговля уже остановлена!")
         else:
-            stop_message = stop_auto_trade()
+            stop_message = await stop_auto_trade()
             await update.message.reply_text(stop_message)
     elif text == "📊 Баланс":
         await balance(update, context)
     elif text == "📈 Индикаторы":
         await indicators(update, context)
     elif text == "🔄 Обновить торговые пары":
-        await update_pairs(update, context)
+        if not await update_pairs(update, context):
+            return
         await update.message.reply_text(
-            f"✅ Торговые пары сохранены: {', '.join(TRADE_PAIRS)}",
+            f"✅ Торговые пары сохранены: {', '.join(pair_manager.get_active_pairs())}",
             reply_markup=main_menu(),
         )
     elif text == "📉 Позиции":
         await positions(update, context)
+    elif text == "🛑 Закрыть всё":
+        await kill(update, context)
+
+
+# Команды бота (используются и при воспроизведении записанных сессий)
+COMMANDS = {
+    "start": start,
+    "balance": balance,
+    "indicators": indicators,
+    "update_pairs": update_pairs,
+    "positions": positions,
+    "kill": kill,
+    "profile": profile,
+    "diag": diag,
+}
+
+
+async def on_startup(application: Application):
+    """Включает диагностику event loop и HTTP API после старта приложения"""
+    diagnostics.start()
+    if API_ENABLED:
+        await api_server.start()
+
+
+async def on_shutdown(application: Application):
+    """Останавливает воркеры шардов и удаляет общий буфер свечей при выходе"""
+    if autotrade.shard_coordinator:
+        await asyncio.to_thread(autotrade.shard_coordinator.stop)
+    autotrade.indicator_calc.store.close()
+    indicator_calc.store.close()
+    candle_store.cleanup()
 
 
 def main():
-    app = ApplicationBuilder().token(TELEGRAM_API_TOKEN).build()
+    # Воркеры шардов форкаются до появления других потоков (PTB, пулы запросов)
+    if autotrade.shard_coordinator:
+        autotrade.shard_coordinator.start_local()
+    builder = (
+        ApplicationBuilder()
+        .token(TELEGRAM_API_TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if get_recorder() is not None:
+        builder = builder.bot(bot)
+    app = builder.build()
+
+    for name, handler in COMMANDS.items():
+        app.add_handler(
+            CommandHandler(name, diagnostics.labelled(f"tg:{name}", handler))
+        )
 
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("balance", balance))
-    app.add_handler(CommandHandler("indicators", indicators))
-    app.add_handler(CommandHandler("update_pairs", update_pairs))
-    app.add_handler(CommandHandler("positions", positions))
+    app.add_handler(
+        CallbackQueryHandler(
+            diagnostics.labelled("tg:kill_confirm", kill_confirm), pattern="^kill:"
+        )
+    )
+
+    app.add_handler(
+        MessageHandler(
+            filters.TEXT & ~filters.COMMAND,
+            diagnostics.labelled("tg:button", button_handler),
+        )
+    )
 
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, button_handler))
+    if get_recorder() is not None:
+        app.add_handler(TypeHandler(Update, record_update), group=-1)
+        app.add_handler(TypeHandler(Update, record_update_done), group=1)
 
     loop = asyncio.get_event_loop()
     loop.create_task(send_startup_message(app))
@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import numpy as np
+import clock
+from config import (
+    MIN_VOLUME_USDT,
+    MAX_VOLATILITY,
+    UNIVERSE_SIZE,
+    UNIVERSE_SNAPSHOT_TTL,
+    UNIVERSE_MAX_SPREAD,
+    UNIVERSE_WEIGHTS,
+)
+
+STABLECOINS = frozenset({"USDC", "BUSD", "DAI", "TUSD", "FDUSD", "EURS", "USDE", "PYUSD"})
+QUOTE = "USDT"
+
+
+def is_tradable_symbol(symbol):
+    """Пара к USDT, базовый актив которой не стейблкоин (проверка за O(1))."""
+    return symbol.endswith(QUOTE) and symbol[: -len(QUOTE)] not in STABLECOINS
+
+
+TICKER_FIELDS = ("turnover24h", "highPrice24h", "lowPrice24h", "lastPrice", "bid1Price", "ask1Price")
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def percentile_rank(values):
+    """Перцентильный ранг каждого значения в [0, 1] (1 — наибольшее)."""
+    if len(values) < 2:
+        return np.ones(len(values))
+    return values.argsort().argsort() / (len(values) - 1)
+
+
+class UniverseService:
+    """
+    Выбор торговых пар: кэширует снимок тикеров, считает метрики (оборот,
+    волатильность, спред) векторно по всему снимку и ранжирует пары по
+    взвешенной сумме перцентилей метрик (UNIVERSE_WEIGHTS).
+    Новые пары прогреваются (история свечей в буфере) до публикации в PairManager.
+    """
+
+    def __init__(self, client, pair_manager, indicator_calc=None, size=UNIVERSE_SIZE):
+        self.client = client
+        self.pair_manager = pair_manager
+        self.indicator_calc = indicator_calc
+        self.size = size
+        self.snapshot = {}
+        self.snapshot_time = 0.0
+        self.symbols = []
+        self.metrics = {}
+
+    async def refresh_snapshot(self, force=False):
+        """Обновляет снимок тикеров, если он старше UNIVERSE_SNAPSHOT_TTL."""
+        if not force and self.snapshot and clock.now() - self.snapshot_time < UNIVERSE_SNAPSHOT_TTL:
+            return self.snapshot
+        tickers = await asyncio.to_thread(self.client.get_spot_pairs)
+        if tickers:
+            self.snapshot = {t["symbol"]: t for t in tickers if is_tradable_symbol(t["symbol"])}
+            self.snapshot_time = clock.now()
+            self._update_metrics()
+        return self.snapshot
+
+    def _update_metrics(self):
+        """Метрики всех тикеров снимка: массивы NumPy, выровненные по self.symbols."""
+        self.symbols = list(self.snapshot)
+        raw = np.array(
+            [[_float(ticker.get(field)) for field in TICKER_FIELDS] for ticker in self.snapshot.values()],
+            dtype=np.float64,
+        ).reshape(-1, len(TICKER_FIELDS))
+        turnover, high, low, last, bid, ask = raw.T
+        quoted = (bid > 0) & (ask > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            volatility = np.where(last > 0, (high - low) / last * 100, 0.0)
+            # Без котировок спред неизвестен (NaN): фильтр его пропускает, ранг — худший
+            spread = np.where(quoted, (ask - bid) / ((bid + ask) / 2), np.nan)
+        self.metrics = {"turnover": turnover, "volatility": volatility, "spread": spread}
+
+    def eligible(self):
+        """Маска пар, прошедших фильтры оборота, волатильности и спреда."""
+        metrics = self.metrics
+        spread = metrics["spread"]
+        return (
+            (metrics["turnover"] >= MIN_VOLUME_USDT)
+            & (metrics["volatility"] <= MAX_VOLATILITY)
+            & (np.isnan(spread) | (spread <= UNIVERSE_MAX_SPREAD))
+        )
+
+    def scores(self, mask):
+        """Взвешенная сумма перцентилей: выше оборот и волатильность, ниже спред — лучше."""
+        spread = self.metrics["spread"][mask]
+        return (
+            UNIVERSE_WEIGHTS["turnover"] * percentile_rank(self.metrics["turnover"][mask])
+            + UNIVERSE_WEIGHTS["volatility"] * percentile_rank(self.metrics["volatility"][mask])
+            + UNIVERSE_WEIGHTS["spread"] * percentile_rank(-np.nan_to_num(spread, nan=np.inf))
+        )
+
+    def ranked(self, count=None):
+        """Топ пар по составному рейтингу среди прошедших фильтры."""
+        count = count or self.size
+        if not self.symbols:
+            return []
+        mask = self.eligible()
+        candidates = np.flatnonzero(mask)
+        if not len(candidates):
+            return []
+        order = np.argsort(-self.scores(mask), kind="stable")[:count]
+        return [self.symbols[i] for i in candidates[order]]
+
+    async def warm_up(self, pairs):
+        """Загружает историю свечей новых пар, чтобы первый скан не был холодным."""
+        if self.indicator_calc is None:
+            return
+        for pair in pairs:
+            await asyncio.to_thread(self.indicator_calc.get_historical_data, pair)
+
+    async def rerank(self, force=False):
+        """
+        Пересчитывает состав пар и публикует изменения подписчикам PairManager.
+        Возвращает (новый список, добавленные, удалённые) или None, если тикеры
+        получить не удалось и ранжировать нечего (текущий список не меняется).
+        """
+        await self.refresh_snapshot(force=force)
+        top = self.ranked()
+        if not top:
+            return None
+        current = set(self.pair_manager.get_active_pairs())
+        added = [pair for pair in top if pair not in current]
+        removed = [pair for pair in current if pair not in top]
+        if added:
+            await self.warm_up(added)
+        if added or removed:
+            self.pair_manager.save_pairs(top)
+            logging.info(f"Состав пар обновлён: +{added} -{removed}")
+        return top, added, removed
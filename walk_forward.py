@@ -0,0 +1,351 @@
+import itertools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from backtest import DEFAULT_PARAMS, load_history, simulate, summarize
+from fast_indicators import compute_indicators
+from config import (
+    HISTORY_DIR,
+    WALK_FORWARD_TRAIN_DAYS,
+    WALK_FORWARD_TEST_DAYS,
+    WALK_FORWARD_MIN_TRADES,
+    WALK_FORWARD_GRID,
+    WALK_FORWARD_WORKERS,
+    MONTE_CARLO_RUNS,
+    BOOTSTRAP_BLOCK_DAYS,
+    CONFIDENCE_LEVEL,
+)
+
+DAY_MS = 86400 * 1000
+# Сколько прогонов Монте-Карло считать одной матрицей (ограничивает память)
+RUNS_PER_BATCH = 200
+
+
+def parameter_grid(grid=WALK_FORWARD_GRID):
+    """Все комбинации параметров сетки поверх текущих настроек бота."""
+    names = sorted(grid)
+    return [
+        {**DEFAULT_PARAMS, **dict(zip(names, values))}
+        for values in itertools.product(*(grid[name] for name in names))
+    ]
+
+
+def walk_forward_windows(timestamps, train_days, test_days):
+    """
+    Скользящие окна (train_start, test_start, test_end) в индексах свечей:
+    оптимизация на train_days, проверка на следующих test_days, сдвиг на test_days.
+    """
+    windows = []
+    start = timestamps[0]
+    while True:
+        test_start = start + train_days * DAY_MS
+        test_end = test_start + test_days * DAY_MS
+        if test_start >= timestamps[-1]:
+            break
+        windows.append(tuple(int(i) for i in np.searchsorted(timestamps, (start, test_start, test_end))))
+        start += test_days * DAY_MS
+    return windows
+
+
+def _window_sum(trades, cumulative, begin, end):
+    """
+    Число сделок и их суммарная доходность со входом не раньше begin и выходом
+    до end: сделка, закрывшаяся уже в окне проверки, заглядывала бы в будущее.
+    Позиция одна на пару, поэтому выходы, как и входы, упорядочены.
+    """
+    lo = int(np.searchsorted(trades["entry"], begin))
+    hi = max(lo, int(np.searchsorted(trades["exit"], end)))
+    return hi - lo, cumulative[hi] - cumulative[lo]
+
+
+def analyze_pair(symbol, interval, grid, train_days, test_days, directory=HISTORY_DIR):
+    """
+    Walk-forward по одной паре (выполняется в процессе пула).
+    Индикаторы причинные, поэтому считаются один раз по всей истории,
+    а каждая комбинация параметров прогоняется по истории один раз: в обучении
+    учитываются сделки, закрытые до начала проверки, в проверке — по свече входа. Для каждого окна выбирается комбинация
+    с лучшим PnL на обучении и берутся её сделки из окна проверки.
+    """
+    started = time.perf_counter()
+    candles = load_history(symbol, interval, directory)
+    if candles is None or not len(candles):
+        return {"symbol": symbol, "error": "нет истории"}
+    indicators = compute_indicators(candles)
+    combos = parameter_grid(grid)
+    runs = []
+    for params in combos:
+        trades = simulate(candles, indicators, params)
+        runs.append((trades, np.concatenate(([0.0], np.cumsum(trades["ret"])))))
+    baseline = simulate(candles, indicators, DEFAULT_PARAMS)
+
+    timestamps = candles.timestamp
+    windows = []
+    oos_time, oos_ret, base_time, base_ret = [], [], [], []
+    for train_start, test_start, test_end in walk_forward_windows(timestamps, train_days, test_days):
+        best, best_pnl = None, -np.inf
+        for index, (trades, cumulative) in enumerate(runs):
+            count, pnl = _window_sum(trades, cumulative, train_start, test_start)
+            if count >= WALK_FORWARD_MIN_TRADES and pnl > best_pnl:
+                best, best_pnl = index, pnl
+        window = {
+            "train_start": int(timestamps[train_start]),
+            "test_start": int(timestamps[min(test_start, len(timestamps) - 1)]),
+            "test_end": int(timestamps[min(test_end, len(timestamps)) - 1]),
+            "params": None,
+        }
+        if best is not None:
+            trades, _ = runs[best]
+            lo, hi = np.searchsorted(trades["entry"], (test_start, test_end))
+            oos_time.append(timestamps[trades["exit"][lo:hi]])
+            oos_ret.append(trades["ret"][lo:hi])
+            window.update(
+                params=combos[best],
+                train_pnl=float(best_pnl),
+                test_pnl=float(trades["ret"][lo:hi].sum()),
+                test_trades=int(hi - lo),
+            )
+        lo, hi = np.searchsorted(baseline["entry"], (test_start, test_end))
+        base_time.append(timestamps[baseline["exit"][lo:hi]])
+        base_ret.append(baseline["ret"][lo:hi])
+        windows.append(window)
+
+    def joined(parts, dtype):
+        return np.concatenate(parts).astype(dtype) if parts else np.empty(0, dtype)
+
+    return {
+        "symbol": symbol,
+        "bars": len(candles),
+        "combos": len(combos),
+        "windows": windows,
+        "oos_time": joined(oos_time, np.int64),
+        "oos_ret": joined(oos_ret, np.float64),
+        "baseline_time": joined(base_time, np.int64),
+        "baseline_ret": joined(base_ret, np.float64),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+# --- Оценка устойчивости ---
+def _resampled_stats(samples):
+    """PnL и максимальная просадка для каждой строки матрицы runs × n."""
+    equity = np.cumsum(samples, axis=1)
+    equity = np.concatenate((np.zeros((len(samples), 1)), equity), axis=1)
+    drawdown = (np.maximum.accumulate(equity, axis=1) - equity).max(axis=1)
+    return equity[:, -1], drawdown
+
+
+def monte_carlo_trades(returns, runs, seed):
+    """Монте-Карло по последовательности сделок: выборка сделок с возвращением."""
+    rng = np.random.default_rng(seed)
+    pnl, drawdown = [], []
+    for batch in range(0, runs, RUNS_PER_BATCH):
+        count = min(RUNS_PER_BATCH, runs - batch)
+        samples = returns[rng.integers(0, len(returns), (count, len(returns)))]
+        batch_pnl, batch_drawdown = _resampled_stats(samples)
+        pnl.append(batch_pnl)
+        drawdown.append(batch_drawdown)
+    return np.concatenate(pnl), np.concatenate(drawdown)
+
+
+def block_bootstrap(daily, runs, block, seed):
+    """
+    Блочный бутстрап дневных доходностей: блоки по block дней сохраняют
+    автокорреляцию (серии убытков), которую теряет выборка отдельных сделок.
+    """
+    rng = np.random.default_rng(seed)
+    days = len(daily)
+    block = max(1, min(block, days))
+    blocks = -(-days // block)
+    offsets = np.arange(block)
+    pnl, drawdown = [], []
+    for batch in range(0, runs, RUNS_PER_BATCH):
+        count = min(RUNS_PER_BATCH, runs - batch)
+        starts = rng.integers(0, days - block + 1, (count, blocks))
+        index = (starts[:, :, None] + offsets).reshape(count, -1)[:, :days]
+        batch_pnl, batch_drawdown = _resampled_stats(daily[index])
+        pnl.append(batch_pnl)
+        drawdown.append(batch_drawdown)
+    return np.concatenate(pnl), np.concatenate(drawdown)
+
+
+def daily_returns(times, returns):
+    """Суммарная доходность сделок по дням закрытия (дни без сделок — нули)."""
+    if not len(times):
+        return np.empty(0)
+    days = (times // DAY_MS).astype(np.int64)
+    return np.bincount(days - days.min(), weights=returns)
+
+
+def confidence_interval(values, level=CONFIDENCE_LEVEL):
+    tail = (1 - level) / 2 * 100
+    low, median, high = np.percentile(values, (tail, 50, 100 - tail))
+    return {"low": float(low), "median": float(median), "high": float(high)}
+
+
+def _robustness_task(kind, values, runs, block, seed):
+    if kind == "trades":
+        return monte_carlo_trades(values, runs, seed)
+    return block_bootstrap(values, runs, block, seed)
+
+
+def robustness(pool, workers, times, returns, runs, block, level=CONFIDENCE_LEVEL, seed=None):
+    """
+    Доверительные интервалы PnL и просадки: Монте-Карло по сделкам и блочный
+    бутстрап дневных доходностей. Прогоны делятся между процессами пула.
+    """
+    if len(returns) < 2:
+        return None
+    order = np.argsort(times, kind="stable")
+    times, returns = times[order], returns[order]
+    daily = daily_returns(times, returns)
+    chunks = [runs // workers + (1 if i < runs % workers else 0) for i in range(workers)]
+    seeds = np.random.SeedSequence(seed).spawn(2 * workers)
+    futures = {}
+    for kind, values in (("trades", returns), ("daily", daily)):
+        futures[kind] = [
+            pool.submit(_robustness_task, kind, values, count, block, seeds.pop())
+            for count in chunks
+            if count
+        ]
+    result = {"trades": summarize(returns), "days": int(len(daily))}
+    for kind, parts in futures.items():
+        pnl, drawdown = (np.concatenate(arrays) for arrays in zip(*(f.result() for f in parts)))
+        result[kind + "_mc"] = {
+            "pnl": confidence_interval(pnl, level),
+            "max_drawdown": confidence_interval(drawdown, level),
+            "p_loss": float((pnl < 0).mean()),
+        }
+    return result
+
+
+def run_analysis(
+    pairs,
+    interval="1",
+    grid=WALK_FORWARD_GRID,
+    train_days=WALK_FORWARD_TRAIN_DAYS,
+    test_days=WALK_FORWARD_TEST_DAYS,
+    runs=MONTE_CARLO_RUNS,
+    block=BOOTSTRAP_BLOCK_DAYS,
+    workers=WALK_FORWARD_WORKERS,
+    directory=HISTORY_DIR,
+    seed=None,
+):
+    """
+    Полный анализ: walk-forward по парам в пуле процессов, затем оценка
+    устойчивости вне выборки — для подобранных параметров и для текущих.
+    """
+    started = time.perf_counter()
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(analyze_pair, pair, interval, grid, train_days, test_days, directory)
+            for pair in pairs
+        ]
+        results = [future.result() for future in futures]
+        failed = [r["symbol"] for r in results if "error" in r]
+        results = [r for r in results if "error" not in r]
+        if failed:
+            logging.warning(f"⚠️ Нет истории для {', '.join(failed)}")
+
+        def pooled(prefix):
+            if not results:
+                return np.empty(0, np.int64), np.empty(0)
+            return (
+                np.concatenate([r[prefix + "_time"] for r in results]),
+                np.concatenate([r[prefix + "_ret"] for r in results]),
+            )
+
+        report = {
+            "interval": interval,
+            "pairs": [r["symbol"] for r in results],
+            "missing": failed,
+            "train_days": train_days,
+            "test_days": test_days,
+            "combos": results[0]["combos"] if results else 0,
+            "confidence": CONFIDENCE_LEVEL,
+            "walk_forward": robustness(pool, workers, *pooled("oos"), runs, block, seed=seed),
+            "current_params": robustness(pool, workers, *pooled("baseline"), runs, block, seed=seed),
+            "per_pair": {
+                r["symbol"]: {
+                    "bars": r["bars"],
+                    "oos": summarize(r["oos_ret"]),
+                    "current": summarize(r["baseline_ret"]),
+                    "windows": r["windows"],
+                    "seconds": round(r["seconds"], 2),
+                }
+                for r in results
+            },
+        }
+    report["seconds"] = round(time.perf_counter() - started, 2)
+    return report
+
+
+def format_report(report):
+    """Текстовый отчёт walk-forward и интервалов (для консоли и Telegram)."""
+    level = report["confidence"] * 100
+    lines = [
+        f"🧪 Walk-forward ({report['train_days']}/{report['test_days']} дней, "
+        f"{report['combos']} комбинаций, интервал {report['interval']})",
+        f"Пары: {', '.join(report['pairs']) or 'нет'}",
+    ]
+    for title, key in (("Подбор параметров", "walk_forward"), ("Текущие параметры", "current_params")):
+        block = report[key]
+        if block is None:
+            lines.append(f"{title}: недостаточно сделок вне выборки")
+            continue
+        trades = block["trades"]
+        lines.append(
+            f"{title}: сделок {trades['trades']}, PnL {trades['pnl'] * 100:+.2f}%, "
+            f"побед {trades['win_rate'] * 100:.1f}%, просадка {trades['max_drawdown'] * 100:.2f}%"
+        )
+        for name, label in (("trades_mc", "МК сделок"), ("daily_mc", "бутстрап дней")):
+            mc = block[name]
+            lines.append(
+                f"  {label}: PnL {level:.0f}% ДИ [{mc['pnl']['low'] * 100:+.2f}%, {mc['pnl']['high'] * 100:+.2f}%], "
+                f"просадка до {mc['max_drawdown']['high'] * 100:.2f}%, P(убыток) {mc['p_loss'] * 100:.1f}%"
+            )
+    lines.append(f"⏱ {report['seconds']} с")
+    return "\n".join(lines)
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} не сериализуется")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(
+        description="Walk-forward и Монте-Карло по локальной истории (python backtest.py download ...)"
+    )
+    parser.add_argument("pairs", nargs="+")
+    parser.add_argument("--interval", default="1")
+    parser.add_argument("--train-days", type=int, default=WALK_FORWARD_TRAIN_DAYS)
+    parser.add_argument("--test-days", type=int, default=WALK_FORWARD_TEST_DAYS)
+    parser.add_argument("--runs", type=int, default=MONTE_CARLO_RUNS)
+    parser.add_argument("--workers", type=int, default=WALK_FORWARD_WORKERS)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="сохранить полный отчёт в файл")
+    args = parser.parse_args()
+
+    result = run_analysis(
+        args.pairs,
+        interval=args.interval,
+        train_days=args.train_days,
+        test_days=args.test_days,
+        runs=args.runs,
+        workers=args.workers,
+        seed=args.seed,
+    )
+    print(format_report(result))
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(result, file, indent=2, ensure_ascii=False, default=_json_default)